@@ -8,8 +8,18 @@ import json
 import zipfile
 import time
 import shutil
-from utils.utils_pdf import extract_section_to_pdf, extract_section_to_pdf_self, \
-    extract_info,parser_file,extract_pages_by_keywords,dict_save2csv
+from utils.utils_pdf import extract_section_to_pdf_self, \
+    parser_file,dict_save2csv,get_toc_analysis,match_sections_batch, \
+    batch_crop_files,default_crop_workers,materialize_crop,list_virtual_crops,delete_crop_output, \
+    text_export_path,batch_plan_crops,planned_crop_jobs,format_page_ranges,parse_page_ranges
+from utils.utils_ingest import ingest_upload
+from utils.utils_region import normalize_region, normalize_regions, load_region_aliases, save_region_aliases, \
+    REGION_ALIAS_FIELDS
+from utils.utils_cache import load_repair_stats, load_output_sizes
+from utils.utils_metrics import load_crop_metrics, summarize_crop_metrics, clear_crop_metrics
+from utils.utils_thumbnail import render_page_thumbnails, THUMBNAIL_WINDOW
+from utils.utils_table import extract_crop_locally, LOCAL_EXTRACTORS
+from utils.utils_index import index_documents_async, search_corpus
 from utils.api_client import CozeClient, get_mock_data, WORKFLOW_CONFIG 
 from utils.utils_fusion import unify_and_concatenate, preprocess_X 
 from utils.utils_vis import plot_heatmap ,plot_horizontal_bars_from_df,plot_category_radar_chart,plot_clusters
@@ -59,6 +69,35 @@ TEMPLATE_COLUMNS = {
 for d in DIRS.values():
     if not os.path.exists(d): os.makedirs(d)
 
+# 定义全局任务字典
+TASK_DICT={
+    "自然资源禀赋":"LandUse",
+    "存在问题":"issue",
+    "整治潜力":"potential",
+    "子项目":"project",
+    "空间布局":"spatial"
+}
+
+# 各任务类型的默认裁剪关键词与模式 (TOC: 目录章节匹配, Content: 全文关键词扫描)
+CROP_DEFAULTS = {
+    # r"(土地利用.*表|表.*土地利用.*表)"
+    # r"(?s)(?:表\s*[\d\-\.]*\s*)?土地\s*利用.*(?:统计|现状|)?\s*表"
+    # r"(?s)(?:表\s*[\d\-\.]*\s*)?土\s*地\s*利\s*用.*表"
+    "自然资源禀赋": (r"(?s)(?:表\s*[\d\-\.]*\s*)?(?:土\s*地|地\s*类).*(?:利\s*用|现\s*状|统\s*计).*表", "Content"),
+    "存在问题": ("存在问题", "TOC"),
+    "整治潜力": ("整治可行性分析", "TOC"),
+    "子项目": ("子项目安排", "TOC"),
+    "空间布局": ("空间布局优化", "TOC"),
+}
+ALL_TASKS_OPTION = "全部类型 (单次遍历)"
+# 裁剪结果的输出体积优化配置 (显示名称 -> utils_pdf.OUTPUT_PROFILES)
+OUTPUT_PROFILE_LABELS = {
+    "无损压缩 (推荐)": "compact",
+    "压缩 + 图片降采样": "downsample",
+    "压缩 + 删除图片 (仅文字/表格)": "strip_images",
+    "原样保存": "original",
+}
+
 # === 侧边栏：流程控制 ===
 with st.sidebar:
     st.header("工作流导航")
@@ -69,6 +108,11 @@ with st.sidebar:
         "4. 数据融合&展示",
         "5. 数据分类与导出"
     ])
+    # 放在侧边栏，步骤 2 按清单生成 PDF 时同样生效
+    output_profile = OUTPUT_PROFILE_LABELS[st.selectbox(
+        "📦 裁剪结果体积优化", list(OUTPUT_PROFILE_LABELS.keys()),
+        help="裁剪结果会上传到大模型，体积越小上传越快；删除图片只作用于文字/表格章节，空间布局等图件章节仍保留图片"
+    )]
     st.divider()
     if st.button("清理临时文件"):
         if os.path.exists(TEMP_DIR):
@@ -77,15 +121,6 @@ with st.sidebar:
                 if not os.path.exists(d): os.makedirs(d)
         st.success("已清理缓存")
 
-# 定义全局任务字典
-TASK_DICT={
-    "自然资源禀赋":"LandUse",
-    "存在问题":"issue",
-    "整治潜力":"potential",
-    "子项目":"project",
-    "空间布局":"spatial"
-}
-
 def render_file_manager(dir_path, title="结果文件管理", file_ext=".csv", key_prefix="common"):
     """
     通用文件管理组件：列表、预览、下载、删除
@@ -252,14 +287,24 @@ if step == "1. 文档上传与裁剪":
                 save_status = st.empty()
                 save_status.text("正在保存文件到硬盘...")
                 
+                # 每个上传只落盘一次：会话内已保存的直接复用，内容相同的文件按哈希去重
+                persisted_uploads = st.session_state.setdefault("persisted_uploads", {})
                 saved_count = 0
+                skipped_count = 0
+                to_index = []
                 for f in uploaded_files:
-                    file_path = os.path.join(DIRS["upload"], f.name)
-                    with open(file_path, "wb") as buffer:
-                        buffer.write(f.getbuffer()) 
-                    saved_count += 1
+                    file_path, ingest_status = ingest_upload(f, DIRS["upload"], persisted_uploads)
+                    if ingest_status != "session":
+                        to_index.append(file_path)
+                    if ingest_status == "written":
+                        saved_count += 1
+                    else:
+                        skipped_count += 1
                     target_files.append(file_path)
-                save_status.success(f"✅ 已保存 {saved_count} 个文件到服务器缓存。")
+                if to_index:
+                    # 入库后在后台增量建立全库检索索引 (已建过的按内容哈希跳过)，不阻塞页面
+                    st.session_state.setdefault("index_jobs", []).append(index_documents_async(to_index))
+                save_status.success(f"✅ 服务器缓存中共 {len(target_files)} 个文件 (本次写入 {saved_count} 个，已存在跳过 {skipped_count} 个)。")
         else:
             if os.path.exists(DIRS["upload"]):
                 existing_pdfs = [f for f in os.listdir(DIRS["upload"]) if f.endswith(".pdf")]
@@ -282,38 +327,229 @@ if step == "1. 文档上传与裁剪":
         with col1:
             crop_task_type = st.selectbox(
                 "选择要提取的数据类型", 
-                list(TASK_DICT.keys()) 
+                list(TASK_DICT.keys()) + [ALL_TASKS_OPTION]
             )
         with col2:
-            default_kw = ""
-            algo_type = "TOC" 
-            if "自然资源禀赋" in crop_task_type:
-                 # default_kw = r"(土地利用.*表|表.*土地利用.*表)" 
-                # default_kw = r"(?s)(?:表\s*[\d\-\.]*\s*)?土地\s*利用.*(?:统计|现状|)?\s*表"
-                # default_kw = r"(?s)(?:表\s*[\d\-\.]*\s*)?土\s*地\s*利\s*用.*表"
-                default_kw = r"(?s)(?:表\s*[\d\-\.]*\s*)?(?:土\s*地|地\s*类).*(?:利\s*用|现\s*状|统\s*计).*表"
-                algo_type = "Content"
-            elif "存在问题" in crop_task_type:
-                default_kw = "存在问题"
-            elif "整治潜力" in crop_task_type:
-                default_kw = "整治可行性分析"
-            elif "子项目" in crop_task_type:
-                default_kw = "子项目安排"
-            elif "空间布局" in crop_task_type:
-                default_kw = "空间布局优化"
-            
-            keyword = st.text_input("提取关键词 (支持正则)", value=default_kw)
-            
-            if algo_type == "Content" or crop_task_type == "自定义全文搜索":
-                st.caption("ℹ️ 模式：**全文关键词扫描**")
-                use_content_mode = True
-            else:
-                st.caption("ℹ️ 模式：**目录章节匹配**")
+            max_table_pages = None
+            if crop_task_type == ALL_TASKS_OPTION:
+                keyword = ""
                 use_content_mode = False
+                st.caption("ℹ️ 模式：**单次遍历**，每个文件只打开一次，按默认关键词同时裁剪全部类型")
+                st.dataframe(
+                    pd.DataFrame(
+                        [{"数据类型": t, "关键词": kw, "模式": "全文扫描" if mode == "Content" else "目录匹配"}
+                         for t, (kw, mode) in CROP_DEFAULTS.items()],
+                        index=range(1, len(CROP_DEFAULTS) + 1)
+                    ),
+                    width="stretch"
+                )
+            else:
+                default_kw, algo_type = CROP_DEFAULTS.get(crop_task_type, ("", "TOC"))
+                
+                keyword = st.text_input("提取关键词 (支持正则)", value=default_kw)
+                
+                if algo_type == "Content" or crop_task_type == "自定义全文搜索":
+                    st.caption("ℹ️ 模式：**全文关键词扫描**")
+                    use_content_mode = True
+                    table_cap = st.number_input(
+                        "标题后最多合并的连续表格页数 (0 = 不限制)", min_value=0, value=0,
+                        help="防止标题之后的大段附表被整体并入裁剪结果"
+                    )
+                    max_table_pages = table_cap if table_cap > 0 else None
+                else:
+                    st.caption("ℹ️ 模式：**目录章节匹配**")
+                    use_content_mode = False
+
+        # 关键词命中预览：先用倒排索引筛出候选页，只在候选页的缓存文本上执行完整正则
+        if crop_task_type != ALL_TASKS_OPTION and keyword and target_files and \
+                st.checkbox("🔎 预览关键词命中 (全库索引)", help="不打开 PDF，调整关键词 / 正则后立即查看各文件命中的页"):
+            preview = search_corpus(keyword, target_files, max_results=500)
+            index_jobs = [j for j in st.session_state.get("index_jobs", []) if j["done"] < j["total"]]
+            st.session_state["index_jobs"] = index_jobs
+            if index_jobs:
+                done, total = sum(j["done"] for j in index_jobs), sum(j["total"] for j in index_jobs)
+                st.progress(done / total, text=f"⏳ 后台建立检索索引: {done} / {total} 个文件 (不影响裁剪)")
+                st.button("🔄 刷新索引进度")
+            if preview["unindexed"]:
+                st.caption(f"⚠️ {len(preview['unindexed'])} 个文件尚未建立索引，暂不参与预览。")
+                if not index_jobs and st.button("🗂️ 为这些文件建立索引"):
+                    st.session_state.setdefault("index_jobs", []).append(index_documents_async(
+                        [p for p in target_files if os.path.basename(p) in set(preview["unindexed"])]
+                    ))
+                    st.rerun()
+            p1, p2, p3 = st.columns(3)
+            p1.metric("命中文件", f"{preview['matched_docs']} / {len(target_files) - len(preview['unindexed'])}")
+            p2.metric("命中页数", preview["matched_pages"])
+            p3.metric("耗时", f"{preview['seconds'] * 1000:.0f} ms")
+            st.caption(f"索引筛出候选页 {preview['candidate_pages']} / {preview['total_pages']} 页，完整正则只在候选页上执行。")
+            if preview["results"]:
+                st.dataframe(pd.DataFrame(preview["results"]), width="stretch", hide_index=True, height=240)
         
         # --- 开始处理 ---
+        crop_workers = st.number_input(
+            "并行进程数", min_value=1, max_value=os.cpu_count() or 1,
+            value=default_crop_workers(),
+            help="每个进程独立打开一份 PDF；设为 1 时在当前进程中逐个处理"
+        )
+        memory_limit = st.number_input(
+            "单文件内存上限 (MB, 0 = 不限制)", min_value=0, value=0, step=256,
+            help="设置后全文扫描按页窗口处理并定期释放缓存；处理期间新增的常驻内存超过上限的文件记为失败，"
+                 "避免单个超大文件拖垮服务器。"
+                 "超过 300 页的文档会自动按窗口处理"
+        )
+        virtual_crop = st.checkbox(
+            "🗂️ 仅记录裁剪清单 (延迟生成 PDF)",
+            help="只记录源文件与页码区间，PDF 在步骤 2 上传或下载时才生成，节省大批量裁剪的磁盘读写"
+        )
+        export_text = st.checkbox(
+            "📝 同时导出文本层 (.text.json)",
+            help="在裁剪的同一次遍历中导出逐页文本与表格单元格，体积远小于 PDF，便于比对与本地解析"
+        )
+        force_recrop = st.checkbox(
+            "🔁 强制重新裁剪",
+            help="默认跳过源文件内容、任务类型、关键词、裁剪模式均未变化且结果仍在的文件；勾选后全部重新裁剪"
+        )
+
+        def crop_job_options():
+            """裁剪任务的公共参数 (自动裁剪与按计划输出共用)"""
+            return {"virtual": virtual_crop, "output_profile": output_profile, "export_text": export_text,
+                    "memory_limit_mb": memory_limit or None}
+
+        def build_crop_jobs():
+            """为每个待处理文件生成裁剪任务，返回 (任务列表, 生成失败的文件)"""
+            crop_jobs, failed = [], []
+            # 地区名一次性批量标准化 (已登记的文件名直接读登记表)
+            region_records = normalize_regions([os.path.basename(p) for p in target_files])
+            for src_path in target_files:
+                f_name = os.path.basename(src_path)
+                try:
+                    info = region_records[f_name]
+                    clean_region_name = info["文件名"]
+                    
+                    if crop_task_type == ALL_TASKS_OPTION:
+                        # 单次遍历：一次打开、一次目录分析、一次逐页扫描，输出全部类型
+                        section_tasks = [{
+                            "keyword": kw,
+                            "output_path": os.path.join(DIRS["crop"], f"{clean_region_name}_{TASK_DICT[t]}.pdf"),
+                            "content_mode": mode == "Content",
+                            "task_suffix": TASK_DICT[t],
+                        } for t, (kw, mode) in CROP_DEFAULTS.items()]
+                    else:
+                        task_suffix = "data"
+                        if crop_task_type in TASK_DICT:
+                            task_suffix = TASK_DICT[crop_task_type]
+                        else:
+                            task_suffix = keyword.replace("*", "")[:5]
+
+                        dst_name = f"{clean_region_name}_{task_suffix}.pdf"
+                        section_tasks = [{
+                            "keyword": keyword,
+                            "output_path": os.path.join(DIRS["crop"], dst_name),
+                            "content_mode": use_content_mode,
+                            "task_suffix": task_suffix,
+                            "max_table_pages": max_table_pages,
+                        }]
+                    crop_jobs.append({"src_path": src_path, "section_tasks": section_tasks, **crop_job_options()})
+                except Exception as e:
+                    print(f"处理出错 {f_name}: {e}")
+                    failed.append(f_name)
+            return crop_jobs, failed
+
+        def run_crop_batch(crop_jobs, bar, status):
+            """多进程执行裁剪任务，逐文件回报进度，返回 (成功数, 失败列表, 跳过数)"""
+            def on_crop_progress(done, total, result):
+                tag = "未变化，跳过" if result.get("skipped") else "已完成"
+                status.text(f"{tag} ({done}/{total}): {os.path.basename(result['src_path'])}")
+                bar.progress(done / total)
+
+            status.text(f"正在处理 {len(crop_jobs)} 个文件 (并行进程数: {crop_workers}) ...")
+            result = batch_crop_files(
+                crop_jobs, max_workers=crop_workers, progress_callback=on_crop_progress,
+                skip_unchanged=not force_recrop
+            )
+            bar.progress(1.0)
+            return result
+
         error_files = []
-        if st.button("开始自动裁剪", type="primary"):
+        col_run, col_plan = st.columns(2)
+        with col_plan:
+            plan_clicked = st.button("🧭 生成裁剪计划 (不写文件)",
+                                     help="只定位每个文件、每类数据的页码区间与命中的目录标题，审核修改后再一次性批量输出")
+        with col_run:
+            run_clicked = st.button("开始自动裁剪", type="primary")
+
+        if plan_clicked:
+            if not target_files:
+                st.error("没有待处理的文件！")
+            else:
+                bar = st.progress(0)
+                status = st.empty()
+                crop_jobs, error_files = build_crop_jobs()
+
+                def on_plan_progress(done, total, src_path):
+                    status.text(f"已定位 ({done}/{total}): {os.path.basename(src_path)}")
+                    bar.progress(done / total)
+
+                plan_rows = batch_plan_crops(crop_jobs, max_workers=crop_workers, progress_callback=on_plan_progress)
+                bar.progress(1.0)
+                st.session_state["crop_plan"] = plan_rows
+                st.session_state.pop("crop_plan_editor", None)
+                if error_files:
+                    st.warning(f"⚠️ 以下文件未能生成任务：{error_files}")
+
+        if st.session_state.get("crop_plan"):
+            plan_rows = st.session_state["crop_plan"]
+            st.markdown("#### 🧭 裁剪计划")
+            st.caption("可直接修改「页码」(如 5-12, 20)，取消勾选「采用」的行不输出；未定位到的行填写页码并勾选「采用」后一并输出。")
+            plan_df = pd.DataFrame([{
+                "采用": bool(row["page_ranges"]),
+                "源文件": os.path.basename(row["src_path"]),
+                "输出文件": os.path.basename(row["output_path"]),
+                "页码": format_page_ranges(row["page_ranges"]),
+                "命中标题": row["title"] or ("全文扫描" if row["source"] == "content" else "❌ 未定位到"),
+                "匹配分": round(row["score"], 2) if row["score"] is not None else None,
+                "来源": {"outline": "书签", "text": "文本目录", "headings": "字号标题", "content": "全文扫描"}.get(row["source"], "-"),
+            } for row in plan_rows])
+            edited_plan = st.data_editor(
+                plan_df, hide_index=True, width="stretch", key="crop_plan_editor",
+                disabled=["源文件", "输出文件", "命中标题", "匹配分", "来源"],
+            )
+            low_scores = sum(1 for row in plan_rows if row["score"] is not None and row["score"] < 0.6)
+            st.caption(f"共 {len(plan_rows)} 项，未定位到 {sum(1 for r in plan_rows if not r['page_ranges'])} 项，"
+                       f"匹配分低于 0.6 的 {low_scores} 项建议重点核对。")
+
+            col_apply, col_drop = st.columns(2)
+            with col_drop:
+                if st.button("🗑️ 丢弃计划"):
+                    st.session_state.pop("crop_plan", None)
+                    st.rerun()
+            with col_apply:
+                apply_clicked = st.button("✅ 按计划批量输出", type="primary")
+            if apply_clicked:
+                accepted, plan_errors = [], []
+                for row, (_, edited) in zip(plan_rows, edited_plan.iterrows()):
+                    if not edited["采用"]: continue
+                    try:
+                        page_ranges = parse_page_ranges(edited["页码"])
+                    except ValueError as e:
+                        plan_errors.append(f"{edited['输出文件']}: {e}")
+                        continue
+                    if page_ranges:
+                        accepted.append(dict(row, page_ranges=page_ranges))
+                if plan_errors:
+                    st.error("页码格式有误，请修改后重试：\n\n" + "\n\n".join(plan_errors))
+                elif not accepted:
+                    st.warning("没有可输出的行。")
+                else:
+                    crop_jobs = planned_crop_jobs(accepted, **crop_job_options())
+                    success_count, batch_errors, skipped_count = run_crop_batch(crop_jobs, st.progress(0), st.empty())
+                    if batch_errors:
+                        st.warning(f"⚠️ 完成，但有 {len(batch_errors)} 个失败。失败列表：{batch_errors}")
+                    else:
+                        st.success(f"✅ 已按计划输出 {len(accepted)} 个裁剪结果 "
+                                   f"({success_count} 个文件，跳过 {skipped_count} 个未变化的文件)。")
+
+        if run_clicked:
             if not target_files:
                 st.error("没有待处理的文件！")
             else:
@@ -321,50 +557,66 @@ if step == "1. 文档上传与裁剪":
                 status = st.empty()
                 success_count = 0
                 total_files = len(target_files)
-                import gc 
 
-                for i, src_path in enumerate(target_files):
-                    f_name = os.path.basename(src_path)
-                    status.text(f"正在处理 ({i+1}/{total_files}): {f_name} ...")
-                    
-                    try:
-                        info = extract_info(f_name)
-                        clean_region_name = info["文件名"]
-                        
-                        task_suffix = "data"
-                        if crop_task_type in TASK_DICT:
-                            task_suffix = TASK_DICT[crop_task_type]
-                        else:
-                            task_suffix = keyword.replace("*", "")[:5]
+                # 1. 为每个文件生成裁剪任务
+                crop_jobs, error_files = build_crop_jobs()
 
-                        dst_name = f"{clean_region_name}_{task_suffix}.pdf"
-                        dst_path = os.path.join(DIRS["crop"], dst_name)
-                        
-                        # 3. 执行裁剪
-                        is_ok = False
-                        if use_content_mode:
-                            is_ok = extract_pages_by_keywords(src_path, dst_path, keyword)
-                        else:
-                            is_ok = extract_section_to_pdf(src_path, dst_path, keyword)
-                        
-                        if is_ok: 
-                            success_count += 1
-                        else:
-                            error_files.append(f_name)
-                            
-                    except Exception as e:
-                        print(f"处理出错 {f_name}: {e}")
-                        error_files.append(f_name)
-                    
-                    bar.progress((i + 1) / total_files)
-                    
-                    # 手动清理内存
-                    gc.collect() 
-                if success_count == total_files: 
-                    st.success(f"✅ 全部完成！成功 {success_count} 个。")
+                # 2. 多进程执行，逐文件回报进度
+                success_count, batch_errors, skipped_count = run_crop_batch(crop_jobs, bar, status)
+                error_files.extend(batch_errors)
+
+                if skipped_count:
+                    st.info(f"⏭️ 跳过 {skipped_count} 个未变化的文件 (源文件与裁剪参数均与上次相同)。")
+                if success_count + skipped_count == total_files: 
+                    st.success(f"✅ 全部完成！成功 {success_count} 个，跳过 {skipped_count} 个。")
                 else: 
                     st.warning(f"⚠️ 完成，但有 {len(error_files)} 个失败。失败列表：{error_files}")
 
+        if st.session_state.get("current_user") == "admin":
+            with st.expander("🏷️ 地区别名表 (管理员)"):
+                st.caption("原始文件名包含「匹配」文本时，用非空字段覆盖自动解析的地区信息；"
+                           "「文件名」是数据融合的地区主键，留空时按覆盖后的 城市-地区/县-详细单元 生成，修改后需重新裁剪。")
+                alias_df = pd.DataFrame(load_region_aliases(), columns=["匹配"] + REGION_ALIAS_FIELDS)
+                edited_aliases = st.data_editor(alias_df, num_rows="dynamic", hide_index=True,
+                                                width="stretch", key="region_alias_editor")
+                if st.button("💾 保存别名表"):
+                    saved = save_region_aliases(edited_aliases.to_dict("records"))
+                    st.success(f"✅ 已保存 {len(saved)} 条别名")
+
+        with st.expander("⏱️ 裁剪耗时统计"):
+            metrics_scope = st.radio("统计范围", ["最近 500 个文档", "全部记录"], horizontal=True, key="metrics_scope")
+            crop_metrics = load_crop_metrics(limit=500 if metrics_scope.startswith("最近") else None)
+            if not crop_metrics:
+                st.caption("暂无记录，执行裁剪后显示各阶段耗时。")
+            else:
+                summary = summarize_crop_metrics(crop_metrics)
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("文档数", summary["documents"])
+                m2.metric("总页数", summary["pages"])
+                m3.metric("总耗时 (秒)", f"{summary['seconds']:.1f}")
+                m4.metric("页/秒", f"{summary['pages_per_sec']:.0f}")
+                col_m1, col_m2 = st.columns([2, 3])
+                with col_m1:
+                    st.caption("各阶段耗时占比")
+                    st.dataframe(pd.DataFrame(summary["phases"]), width="stretch", hide_index=True)
+                with col_m2:
+                    st.caption("最慢的文件")
+                    st.dataframe(pd.DataFrame(summary["slowest"]), width="stretch", hide_index=True)
+                if st.button("🧹 清空耗时记录"):
+                    clear_crop_metrics()
+                    st.rerun()
+
+        with st.expander("🩹 损坏文件修复统计"):
+            repair_stats = load_repair_stats()
+            if repair_stats["repaired_files"] == 0:
+                st.caption("暂无需要修复的文件。")
+            else:
+                st.write(
+                    f"共修复 {repair_stats['repaired_files']} 个文件，修复耗时 {repair_stats['repair_seconds']:.1f} 秒，"
+                    f"复用已修复缓存 {repair_stats['cache_hits']} 次。"
+                )
+                st.dataframe(pd.DataFrame(repair_stats["files"]), width="stretch", hide_index=True)
+
     with tab2:
         st.info("如果自动裁剪失败，可在此手动指定页码修复。")
         existing_files = [f for f in os.listdir(DIRS["upload"]) if f.endswith(".pdf")]
@@ -379,8 +631,8 @@ if step == "1. 文档上传与裁剪":
         
         target_file_path = None
         if manual_file:
-            target_file_path = os.path.join(DIRS["upload"], manual_file.name)
-            with open(target_file_path, "wb") as f: f.write(manual_file.getbuffer())
+            persisted_uploads = st.session_state.setdefault("persisted_uploads", {})
+            target_file_path, _ = ingest_upload(manual_file, DIRS["upload"], persisted_uploads)
         elif sel_file != "--请选择--":
             target_file_path = os.path.join(DIRS["upload"], sel_file)
         
@@ -391,19 +643,65 @@ if step == "1. 文档上传与裁剪":
                 manual_task_type = st.selectbox(
                     "这是哪类数据？", list(TASK_DICT.keys()), key="manual_task_sel"
                 )
+            # 按目录章节定位：目录与偏移量按文件内容哈希缓存，重复定位不再提取 PDF 文本
+            default_start, default_end = 1, 5
+            if st.checkbox("📑 按目录章节定位页码", key="manual_use_toc"):
+                analysis = get_toc_analysis(target_file_path)
+                if not analysis or not analysis["toc"]:
+                    st.warning("⚠️ 未能解析出目录，请直接输入页码。")
+                else:
+                    # 按当前数据类型的默认关键词给章节打分，候选排在前面供选择
+                    manual_kw = CROP_DEFAULTS.get(manual_task_type, ("", "TOC"))[0]
+                    ranked = match_sections_batch(analysis["toc"], [manual_kw], top_k=5)[manual_kw] if manual_kw else []
+                    scores = {c["title"]: c["score"] for c in ranked}
+                    toc_titles = [c["title"] for c in ranked] + [t for t in analysis["toc"] if t not in scores]
+                    sel_title = st.selectbox(
+                        "选择目录章节 (按匹配度排序)", toc_titles, key="manual_toc_sel",
+                        format_func=lambda t: f"{t}  (匹配分 {scores[t]:.2f})" if t in scores else t
+                    )
+                    start_logic, end_logic = analysis["toc"][sel_title]
+                    offset = analysis["offset"]
+                    # 物理页码 = 逻辑页码 + Offset；结束页码不包含，与自动裁剪一样保留下一章起始页
+                    default_start = max(1, start_logic + offset)
+                    default_end = min(analysis["page_count"] + 1, end_logic + offset + 1)
+                    if analysis.get("source") == "outline":
+                        st.caption(f"来源：内嵌书签，物理页码 {start_logic}-{end_logic}")
+                    else:
+                        st.caption(f"目录页码 {start_logic}-{end_logic}，Offset = {offset} "
+                                   f"(锚点: {analysis['anchor'] or '无'}，置信度 {analysis.get('confidence') or 0:.2f})")
+                        if (analysis.get("confidence") or 0) < 0.5:
+                            st.warning("⚠️ 偏移量置信度较低，请核对页码后再裁剪。")
             with c_m2:
                 col_p1, col_p2 = st.columns(2)
-                with col_p1: start_p = st.number_input("起始页码", 1, value=1)
-                with col_p2: end_p = st.number_input("结束页码", 1, value=5)
-            
+                with col_p1: start_p = st.number_input("起始页码", 1, value=default_start)
+                with col_p2: end_p = st.number_input("结束页码", 1, value=default_end)
+
+            # 页面缩略图预览：只渲染当前窗口内的页，按文件哈希缓存，无需下载原 PDF 查找页码
+            if st.checkbox("🖼️ 页面预览", key="manual_preview"):
+                preview_start = st.number_input(
+                    f"从第几页开始预览 (每次 {THUMBNAIL_WINDOW} 页)", 1, value=int(start_p), key="manual_preview_start"
+                )
+                page_count, thumbs = render_page_thumbnails(target_file_path, preview_start - 1, THUMBNAIL_WINDOW)
+                if not thumbs:
+                    st.warning("⚠️ 该范围内没有可预览的页面")
+                else:
+                    st.caption(f"共 {page_count} 页，当前显示第 {min(thumbs) + 1}-{max(thumbs) + 1} 页；"
+                               f"🔷 为当前裁剪范围内的页 (结束页不包含)")
+                    grid = st.columns(4)
+                    for i, (idx, thumb_path) in enumerate(thumbs.items()):
+                        in_range = start_p <= idx + 1 < end_p
+                        with grid[i % 4]:
+                            st.image(thumb_path, caption=f"{'🔷 ' if in_range else ''}第 {idx + 1} 页",
+                                     width="stretch")
+
             if st.button("✂️ 执行裁剪", type="primary"):
                 f_name = os.path.basename(target_file_path)
-                info = extract_info(f_name)
+                info = normalize_region(f_name)
                 task_suffix = TASK_DICT[manual_task_type]
                 dst_name = f"{info['文件名']}_{task_suffix}_manual.pdf"
                 dst_path = os.path.join(DIRS["crop"], dst_name)
                 
-                if extract_section_to_pdf_self(target_file_path, start_p, end_p, dst_path):
+                if extract_section_to_pdf_self(target_file_path, start_p, end_p, dst_path, output_profile):
                     st.success(f"✅ 修复成功: {dst_name}")
                     time.sleep(1)
                     st.rerun()
@@ -413,13 +711,31 @@ if step == "1. 文档上传与裁剪":
     st.divider()
     st.subheader("📂 结果文件管理")
     cropped_files = []
+    virtual_crops = {}
+    output_sizes = {}
     if os.path.exists(DIRS["crop"]):
         cropped_files = [f for f in os.listdir(DIRS["crop"]) if f.endswith(".pdf")]
+        # 只有清单、尚未生成实体文件的裁剪结果
+        virtual_crops = list_virtual_crops(DIRS["crop"])
+        cropped_files += list(virtual_crops.keys())
+        # 优化前后的体积记录
+        output_sizes = load_output_sizes(DIRS["crop"])
     
     if cropped_files:
         file_data = []
         for f in cropped_files:
             file_path = os.path.join(DIRS["crop"], f)
+            if f in virtual_crops:
+                entry = virtual_crops[f]
+                pages_str = ", ".join(f"{a+1}-{b+1}" for a, b in entry["page_ranges"])
+                file_data.append({
+                    "选择": False,
+                    "📄 文件名称": f,
+                    "📄 大小": f"清单 (第 {pages_str} 页)",
+                    "🕒 修改时间": time.strftime('%Y-%m-%d %H:%M', time.localtime(entry["created_at"])),
+                    "_timestamp": entry["created_at"]
+                })
+                continue
             file_size_bytes = os.path.getsize(file_path)
             stats = os.stat(file_path)
             if stats.st_size < 1024 * 1024:
@@ -427,6 +743,10 @@ if step == "1. 文档上传与裁剪":
             else:
                 size_str = f"{stats.st_size / (1024 * 1024):.2f} MB"
             time_str = time.strftime('%Y-%m-%d %H:%M', time.localtime(stats.st_mtime))
+            size_info = output_sizes.get(f)
+            if size_info and size_info["optimized_size"] == stats.st_size \
+                    and (size_info["original_size"] or 0) > size_info["optimized_size"]:
+                size_str += f" (原约 {size_info['original_size'] / 1024:.0f} KB)"
             file_data.append({
                 "选择": False,
                 "📄 文件名称": f,
@@ -457,7 +777,7 @@ if step == "1. 文档上传与裁剪":
                 success_num = 0
                 for f_del in files_to_delete:
                     try:
-                        os.remove(os.path.join(DIRS["crop"], f_del))
+                        delete_crop_output(os.path.join(DIRS["crop"], f_del))
                         success_num += 1
                     except Exception as e:
                         st.error(f"删除失败 {f_del}: {e}")
@@ -478,8 +798,8 @@ if step == "1. 文档上传与裁剪":
                 for f_del in files:
                     path_to_del = os.path.join(DIRS["crop"], f_del)
                     try:
-                        if os.path.exists(path_to_del):
-                            os.remove(path_to_del)
+                        if os.path.exists(path_to_del) or f_del in virtual_crops:
+                            delete_crop_output(path_to_del)
                             success_num += 1
                     except:
                         fail_num += 1
@@ -522,7 +842,7 @@ if step == "1. 文档上传与裁剪":
             source_dir = DIRS["crop"]
             all_pdfs = []
             if os.path.exists(source_dir):
-                all_pdfs = [f for f in os.listdir(source_dir) if f.endswith(".pdf")]
+                all_pdfs = [f for f in os.listdir(source_dir) if f.endswith(".pdf")] + list(virtual_crops.keys())
 
             if not all_pdfs:
                 st.info("暂无文件可下载")
@@ -555,12 +875,27 @@ if step == "1. 文档上传与裁剪":
                     zip_filename = f"{suffix}_files.zip"
 
                 # 4. 生成并显示下载按钮
-                if files_to_zip:
+                pending_files = [f for f in files_to_zip if f in virtual_crops]
+                if pending_files:
+                    # 清单中的文件需要先生成 PDF 才能打包下载
+                    st.info(f"🗂️ 其中 {len(pending_files)} 个文件只记录了裁剪清单，需先生成 PDF。")
+                    if st.button(f"⚙️ 生成 {len(pending_files)} 个文件", key="materialize_btn"):
+                        with st.spinner("正在生成 PDF..."):
+                            failed = [f for f in pending_files if not materialize_crop(os.path.join(source_dir, f), output_profile)]
+                        if failed:
+                            st.error(f"以下文件生成失败 (源文件缺失或已变化)：{failed}")
+                        else:
+                            st.rerun()
+                elif files_to_zip:
                     zip_buffer = io.BytesIO()
                     with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
                         for f_name in files_to_zip:
                             file_full_path = os.path.join(source_dir, f_name)
                             zf.write(file_full_path, arcname=f_name)
+                            # 一并打包对应的文本层
+                            text_path = text_export_path(file_full_path)
+                            if os.path.exists(text_path):
+                                zf.write(text_path, arcname=os.path.basename(text_path))
                     
                     # 将指针移回头部
                     zip_buffer.seek(0)
@@ -591,6 +926,8 @@ elif step == "2. 大模型数据获取":
         st.warning("⚠️ 裁剪目录不存在。")
     else:
         all_pdfs = [f for f in os.listdir(DIRS["crop"]) if f.endswith(".pdf")]
+        # 裁剪清单中的文件在上传前才生成
+        all_pdfs += list(list_virtual_crops(DIRS["crop"]).keys())
         
         target_files = [f for f in all_pdfs if f.endswith(f"_{target_suffix}.pdf")]
         
@@ -600,10 +937,8 @@ elif step == "2. 大模型数据获取":
         else:
             st.subheader(f"1️⃣ 待处理文件列表 ({len(target_files)} 个)")
             # preview file info
-            file_info_list = []
-            for f in target_files:
-                info = extract_info(f)
-                file_info_list.append(info)
+            region_records = normalize_regions(target_files)
+            file_info_list = [region_records[f] for f in target_files]
             
             st.dataframe(
                 pd.DataFrame(file_info_list,index=range(1,len(file_info_list)+1))[["原始文件名", "文件名", "城市", "地区/县"]], 
@@ -613,6 +948,12 @@ elif step == "2. 大模型数据获取":
             
             st.divider()
             st.subheader("2️⃣ 开始提取")
+            use_local = False
+            if target_suffix in LOCAL_EXTRACTORS:
+                use_local = st.checkbox(
+                    "⚡ 优先本地表格提取 (失败时再调用大模型)", value=True,
+                    help="直接读取裁剪结果中的表格 (有文本层时复用文本层)，识别出的数据完整时不再上传工作流"
+                )
             
             if st.button("🚀 大模型解析，数据提取", type="primary"):
                 results = []
@@ -634,21 +975,37 @@ elif step == "2. 大模型数据获取":
                         with status_expander:
                             st.write(f"📄 文件: `{file_name}`")
                             raw_data = None
-                            try:
+                            source = "大模型"
+                            if use_local:
+                                raw_data = extract_crop_locally(file_path, target_suffix)
+                                if raw_data:
+                                    source = "本地表格"
+                                    st.success("⚡ 本地表格提取成功")
+                                else:
+                                    st.write("↪️ 本地提取不完整，改用大模型...")
+                            if not raw_data:
+                                try:
                                     if not workflow_id:
                                         st.error(f"❌ 未配置 '{task_type}' 的 Workflow ID")
                                     else:
-                                        st.write("📤 上传中...")
-                                        file_id = client.upload_file(file_path)
-                                        if file_id:
-                                            st.write("🤖 分析中...")
-                                            raw_data = client.run_workflow(workflow_id, file_id)
-                                            if raw_data: st.success("✅ 成功")
-                                            else: st.error("❌ 返回为空")
-                                        else: st.error("❌ 上传失败")
-                                        time.sleep(1)
-                            except Exception as e:
-                                st.error(f"❌ 异常: {e}")
+                                        crop_ready = True
+                                        if not os.path.exists(file_path):
+                                            st.write("🗂️ 按裁剪清单生成 PDF...")
+                                            crop_ready = materialize_crop(file_path, output_profile)
+                                        if not crop_ready:
+                                            st.error("❌ 无法生成裁剪文件 (源文件缺失或已变化)")
+                                        else:
+                                            st.write("📤 上传中...")
+                                            file_id = client.upload_file(file_path)
+                                            if file_id:
+                                                st.write("🤖 分析中...")
+                                                raw_data = client.run_workflow(workflow_id, file_id)
+                                                if raw_data: st.success("✅ 成功")
+                                                else: st.error("❌ 返回为空")
+                                            else: st.error("❌ 上传失败")
+                                            time.sleep(1)
+                                except Exception as e:
+                                    st.error(f"❌ 异常: {e}")
                             
                             if raw_data:
                                 try:
@@ -659,12 +1016,15 @@ elif step == "2. 大模型数据获取":
                                 results.append({
                                     "地区": region_name, 
                                     "rawdata": raw_data, 
-                                    "原始文件名": file_name
+                                    "原始文件名": file_name,
+                                    "来源": source
                                 })
                     
                     progress_bar.progress((i + 1) / len(target_files))
                 
-                st.success(f"🎉 处理完成！获取 {len(results)} 条数据。")
+                local_count = sum(1 for r in results if r["来源"] == "本地表格")
+                st.success(f"🎉 处理完成！获取 {len(results)} 条数据 (本地表格 {local_count} 条，"
+                           f"大模型 {len(results) - local_count} 条)。")
                 
                 if results:
                     df_result = pd.DataFrame(results)
@@ -675,6 +1035,15 @@ elif step == "2. 大模型数据获取":
                     df_result.to_csv(save_path, index=False, encoding='utf-8-sig')
                     st.write(f"数据已分类保存至: `{save_path}`")
                     st.dataframe(df_result.head())
+
+                    if use_local:
+                        # 本地提取的结果格式与工作流一致，直接按步骤 3 的方式解析，省去一次手动解析
+                        parsed_df = process_raw_data(df_result, task_type)
+                        parsed_df.index = df_result.index
+                        final_df = pd.concat([df_result[['地区']], parsed_df], axis=1)
+                        out_name = f"parsed_{target_suffix}.csv"
+                        final_df.to_csv(os.path.join(DIRS["result"], out_name), index=False, encoding='utf-8-sig')
+                        st.write(f"已同时解析并保存至: `{out_name}` (可直接进入步骤 4)")
             
     # 文件管理
     render_file_manager(DIRS["raw"], title="大模型获取的数据", file_ext=".csv", key_prefix="step2")
@@ -0,0 +1,343 @@
+"""
+步骤 1 (PDF 裁剪) 吞吐量基准测试。
+
+用 PyMuPDF 生成模拟的《全域土地综合整治实施方案》语料，随机变化：
+页数、目录版式 (点线 / 省略号 / 空格引导、单页或跨页目录、"一、" 或 "第一章" 编号)、
+页码偏移、表格页数、是否带内嵌书签；并记录每份文档的标准答案 (章节物理页码区间、表格页)。
+
+依次计时 parse_toc_to_dict / calculate_global_offset / match_section_from_dict /
+extract_section_to_pdf / extract_pages_by_keywords，输出 页/秒、峰值内存，
+并校验选出的页码是否与标准答案一致。
+
+用法:
+    python benchmark_step1.py                       # 默认 10 / 100 / 1000 份
+    python benchmark_step1.py --scales 10 100 --output bench_output.txt
+"""
+import os
+import re
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+import fitz  # PyMuPDF
+
+try:
+    import resource  # 仅 Unix 可用
+except ImportError:
+    resource = None
+
+from utils.utils_pdf import parse_toc_to_dict, calculate_global_offset, match_section_from_dict, \
+    extract_section_to_pdf, extract_pages_by_keywords, PageTextStore
+
+FONT = "china-s"
+CN_NUMS = "一二三四五六七八九十"
+# 与 app.py 中 CROP_DEFAULTS 保持一致
+LANDUSE_PATTERN = r"(?s)(?:表\s*[\d\-\.]*\s*)?(?:土\s*地|地\s*类).*(?:利\s*用|现\s*状|统\s*计).*表"
+SECTION_KEYWORDS = ["存在问题", "整治可行性分析", "子项目安排", "空间布局优化"]
+# 必备章节 (裁剪目标) 与随机插入的其他章节
+REQUIRED_SECTIONS = ["基本情况", "土地利用现状", "存在问题", "整治可行性分析", "空间布局优化", "子项目安排"]
+OPTIONAL_SECTIONS = ["规划目标与任务", "投资估算与资金筹措", "效益分析", "公众参与", "实施保障措施"]
+LEADERS = {"dots": ".", "ellipsis": "…", "spaces": None}
+MARK_RE = re.compile(r"\[p(\d{4})\]")
+
+
+# ========================================================
+# 语料生成
+# ========================================================
+def random_spec(rng):
+    """随机生成一份文档的版式参数"""
+    sections = REQUIRED_SECTIONS[:1] + rng.sample(OPTIONAL_SECTIONS, rng.randint(0, 3)) + REQUIRED_SECTIONS[1:]
+    return {
+        "sections": sections,
+        "section_pages": [rng.randint(2, 12) for _ in sections],
+        "cover_pages": rng.randint(0, 4),
+        "toc_pages": rng.choice([1, 1, 2]),
+        "leader": rng.choice(list(LEADERS)),
+        "numbering": rng.choice(["cn", "chapter"]),
+        "table_pages": rng.randint(1, 4),
+        "outline": rng.random() < 0.5,
+    }
+
+
+def _number_title(name, i, numbering):
+    """给章节名加编号：三、存在问题 / 第三章 存在问题"""
+    num = CN_NUMS[i] if i < 10 else f"十{CN_NUMS[i - 10]}"
+    return f"{num}、{name}" if numbering == "cn" else f"第{num}章 {name}"
+
+
+def _toc_line(title, page, leader):
+    if LEADERS[leader] is None:
+        return f"{title}      {page}"
+    return f"{title}{LEADERS[leader] * 12}{page}"
+
+
+def make_report(path, spec):
+    """
+    按 spec 生成一份 PDF，返回标准答案：
+    {"offset", "page_count", "toc": {紧凑标题: [起始逻辑页, 结束逻辑页]}, "logic": {关键词: (起始逻辑页, 结束逻辑页)},
+     "sections": {关键词: (起始物理索引, 结束物理索引)}, "table_pages": [物理索引...]}
+    结束页的约定与 parse_toc_to_dict / parse_outline_to_dict 相同：下一章的起始页 (闭区间)，最后一章到文档末尾。
+    每页正文带有 [pNNNN] 物理页标记，用于校验裁剪结果。
+    """
+    doc = fitz.open()
+    titles = [_number_title(name, i, spec["numbering"]) for i, name in enumerate(spec["sections"])]
+    starts, logic = [], 1
+    for n in spec["section_pages"]:
+        starts.append(logic)
+        logic += n
+    body_pages = logic - 1
+    offset = spec["cover_pages"] + spec["toc_pages"]
+
+    def new_page():
+        page = doc.new_page()
+        page.insert_text((72, 780), f"[p{doc.page_count - 1:04d}]", fontname="helv", fontsize=8)
+        return page
+
+    for _ in range(spec["cover_pages"]):
+        new_page().insert_text((72, 120), "全域土地综合整治实施方案", fontname=FONT, fontsize=20)
+
+    # 目录：跨页时前一半条目在第一页
+    per_page = -(-len(titles) // spec["toc_pages"])
+    for k in range(spec["toc_pages"]):
+        page = new_page()
+        y = 72
+        if k == 0:
+            page.insert_text((72, y), "目  录", fontname=FONT, fontsize=16)
+        for title, start in list(zip(titles, starts))[k * per_page:(k + 1) * per_page]:
+            y += 26
+            page.insert_text((72, y), _toc_line(title, start, spec["leader"]), fontname=FONT, fontsize=11)
+
+    # 正文
+    landuse_start = starts[spec["sections"].index("土地利用现状")]
+    table_first = landuse_start + 1
+    table_last = min(table_first + spec["table_pages"] - 1, starts[spec["sections"].index("土地利用现状") + 1] - 1)
+    for lp in range(1, body_pages + 1):
+        page = new_page()
+        if lp in starts:
+            page.insert_text((72, 80), titles[starts.index(lp)], fontname=FONT, fontsize=16)
+        page.insert_text((72, 700), f"正文内容 第{lp}页", fontname=FONT, fontsize=10)
+        if table_first <= lp <= table_last:
+            if lp == table_first:
+                page.insert_text((72, 120), "表 2-1 土地利用现状统计表", fontname=FONT, fontsize=11)
+            for r in range(6):
+                for c in range(4):
+                    rect = fitz.Rect(72 + c * 110, 140 + r * 22, 182 + c * 110, 162 + r * 22)
+                    page.draw_rect(rect, color=(0, 0, 0), width=0.8)
+                    cell = ["地类", "耕地", "园地", "林地", "草地", "水域"][r] if c == 0 else f"{r * 7 + c}.{c}"
+                    page.insert_text((rect.x0 + 3, rect.y1 - 6), cell, fontname=FONT, fontsize=9)
+
+    if spec["outline"]:
+        doc.set_toc([[1, t, s + offset] for t, s in zip(titles, starts)])
+    doc.save(path)
+    page_count = doc.page_count
+    doc.close()
+
+    toc, logic, sections = {}, {}, {}
+    for i, (title, start) in enumerate(zip(titles, starts)):
+        end = starts[i + 1] if i + 1 < len(starts) else page_count
+        toc[re.sub(r"\s+", "", title)] = [start, end]
+        logic[spec["sections"][i]] = (start, end)
+        end_idx = end + offset - 1 if i + 1 < len(starts) else page_count - 1
+        sections[spec["sections"][i]] = (start + offset - 1, end_idx)
+    return {
+        "offset": offset,
+        "page_count": page_count,
+        "toc": toc,
+        "logic": {kw: logic[kw] for kw in SECTION_KEYWORDS},
+        "sections": {kw: sections[kw] for kw in SECTION_KEYWORDS},
+        "table_pages": list(range(table_first + offset - 1, table_last + offset)),
+    }
+
+
+def build_corpus(corpus_dir, count, seed=0):
+    """生成 count 份文档，返回 [(pdf_path, truth), ...]"""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        path = os.path.join(corpus_dir, f"广东省某市某{i:04d}区全域土地综合整治实施方案.pdf")
+        corpus.append((path, make_report(path, random_spec(rng))))
+    return corpus
+
+
+# ========================================================
+# 计时与校验
+# ========================================================
+def reset_peak_rss():
+    """
+    把峰值常驻内存重置为当前值 (Linux: 向 /proc/self/clear_refs 写 5)，每个阶段开始前调用，
+    使 peak_rss_mb 反映该阶段自己的峰值。不支持时返回 False，峰值为进程启动以来的累计值。
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    峰值常驻内存 (MB)：优先读 /proc/self/status 的 VmHWM (可由 reset_peak_rss 重置)，
+    否则回退到 ru_maxrss (进程累计峰值)；都不支持的平台返回 None
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _output_pages(pdf_path):
+    """读取裁剪结果中每页的物理页标记"""
+    if not os.path.exists(pdf_path):
+        return []
+    with fitz.open(pdf_path) as doc:
+        return [int(m.group(1)) for page in doc for m in [MARK_RE.search(page.get_text())] if m]
+
+
+def run_phases(corpus, out_dir):
+    """对语料依次执行各阶段，返回 [{阶段, 文档数, 页数, 耗时, 正确数, 峰值内存}, ...]，峰值内存按阶段分别统计"""
+    total_pages = sum(t["page_count"] for _, t in corpus)
+    rows = []
+
+    def record(name, elapsed, correct, checks):
+        rows.append({
+            "阶段": name, "文档数": len(corpus), "页数": total_pages, "耗时(秒)": elapsed,
+            "页/秒": total_pages / elapsed if elapsed > 0 else float("inf"),
+            "正确": f"{correct}/{checks}", "峰值内存(MB)": peak_rss_mb(),
+        })
+
+    # 前三个阶段在已打开的文档上计时 (不计打开文件的时间)，各阶段使用独立的内存文本缓存
+    docs = [fitz.open(path) for path, _ in corpus]
+    try:
+        toc_dicts, correct = [], 0
+        reset_peak_rss()
+        t0 = time.perf_counter()
+        for doc in docs:
+            toc_dicts.append(parse_toc_to_dict(doc, text_store=PageTextStore(doc)))
+        elapsed = time.perf_counter() - t0
+        for toc_dict, (_, truth) in zip(toc_dicts, corpus):
+            correct += all(toc_dict.get(title) == pages for title, pages in truth["toc"].items())
+        record("parse_toc_to_dict", elapsed, correct, len(corpus))
+
+        # 偏移量校准使用标准目录，与目录解析的结果相互独立
+        offsets = []
+        reset_peak_rss()
+        t0 = time.perf_counter()
+        for doc, (_, truth) in zip(docs, corpus):
+            offsets.append(calculate_global_offset(doc, truth["toc"], text_store=PageTextStore(doc)))
+        elapsed = time.perf_counter() - t0
+        correct = sum(o == truth["offset"] for o, (_, truth) in zip(offsets, corpus))
+        record("calculate_global_offset", elapsed, correct, len(corpus))
+    finally:
+        for doc in docs:
+            doc.close()
+
+    correct = 0
+    reset_peak_rss()
+    t0 = time.perf_counter()
+    matches = [[match_section_from_dict(truth["toc"], kw) for kw in SECTION_KEYWORDS] for _, truth in corpus]
+    elapsed = time.perf_counter() - t0
+    for found, (_, truth) in zip(matches, corpus):
+        for kw, (start, end, _title) in zip(SECTION_KEYWORDS, found):
+            correct += (start, end) == truth["logic"][kw]
+    record("match_section_from_dict", elapsed, correct, len(corpus) * len(SECTION_KEYWORDS))
+
+    outputs = []
+    reset_peak_rss()
+    t0 = time.perf_counter()
+    for i, (path, _) in enumerate(corpus):
+        for kw in SECTION_KEYWORDS:
+            output_path = os.path.join(out_dir, f"{i:04d}_{kw}.pdf")
+            extract_section_to_pdf(path, output_path, kw)
+            outputs.append((output_path, i, kw))
+    elapsed = time.perf_counter() - t0
+    correct = 0
+    for output_path, i, kw in outputs:
+        s_idx, e_idx = corpus[i][1]["sections"][kw]
+        correct += _output_pages(output_path) == list(range(s_idx, e_idx + 1))
+    record("extract_section_to_pdf", elapsed, correct, len(outputs))
+
+    outputs = []
+    reset_peak_rss()
+    t0 = time.perf_counter()
+    for i, (path, _) in enumerate(corpus):
+        output_path = os.path.join(out_dir, f"{i:04d}_LandUse.pdf")
+        extract_pages_by_keywords(path, output_path, LANDUSE_PATTERN)
+        outputs.append((output_path, i))
+    elapsed = time.perf_counter() - t0
+    correct = sum(_output_pages(p) == corpus[i][1]["table_pages"] for p, i in outputs)
+    record("extract_pages_by_keywords", elapsed, correct, len(outputs))
+    return rows
+
+
+def format_report(results):
+    """把各规模的结果整理为文本表格"""
+    header = f"{'阶段':<28}{'文档数':>8}{'页数':>10}{'耗时(秒)':>12}{'页/秒':>12}{'正确':>12}{'峰值内存(MB)':>14}"
+    lines = [header, "-" * len(header)]
+    for rows in results:
+        for r in rows:
+            rss = f"{r['峰值内存(MB)']:.0f}" if r["峰值内存(MB)"] is not None else "-"
+            lines.append(f"{r['阶段']:<28}{r['文档数']:>8}{r['页数']:>10}{r['耗时(秒)']:>12.2f}"
+                         f"{r['页/秒']:>12.0f}{r['正确']:>12}{rss:>14}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="步骤 1 PDF 裁剪吞吐量基准测试")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000], help="文档数量规模")
+    parser.add_argument("--seed", type=int, default=0, help="语料随机种子")
+    parser.add_argument("--output", help="报告另存为文本文件")
+    parser.add_argument("--keep", action="store_true", help="保留生成的语料与裁剪结果")
+    parser.add_argument("--verbose", action="store_true", help="显示裁剪函数的日志输出")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_step1_")
+    corpus_dir = os.path.join(work_dir, "corpus")
+    os.makedirs(corpus_dir)
+    cwd = os.getcwd()
+    try:
+        t0 = time.perf_counter()
+        corpus = build_corpus(corpus_dir, max(args.scales), args.seed)
+        print(f"📄 已生成 {len(corpus)} 份模拟文档 ({time.perf_counter() - t0:.1f}s): {corpus_dir}")
+
+        results = []
+        for scale in sorted(args.scales):
+            # 每个规模使用独立的缓存目录 (temp_workspace 为相对路径)，保证各规模都是冷启动
+            scale_dir = os.path.join(work_dir, f"scale_{scale}")
+            out_dir = os.path.join(scale_dir, "out")
+            os.makedirs(out_dir)
+            os.chdir(scale_dir)
+            print(f"⏱️ 规模 {scale} ...")
+            with open(os.devnull, "w") as devnull, \
+                    contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                results.append(run_phases(corpus[:scale], out_dir))
+            os.chdir(cwd)
+
+        report = format_report(results)
+        print(report)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(report)
+            print(f"💾 报告已保存: {args.output}")
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"📁 语料与结果保留在: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
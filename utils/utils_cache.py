@@ -0,0 +1,476 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import contextlib
+
+# ========================================================
+# 工作区磁盘缓存 (SQLite)
+# ========================================================
+# 缓存放在 temp_workspace 下，侧边栏"清理临时文件"会一并清除
+CACHE_DIR = os.path.join("temp_workspace", "cache")
+CACHE_DB_NAME = "pdf_cache.sqlite"
+
+# 目录解析 / 偏移量校准的算法版本号，算法有改动时 +1，旧缓存自动失效
+TOC_CACHE_VERSION = 4
+
+# 数据库结构版本号：结构变化 (包括新增表) 时 +1，只重建可再生的缓存表 (其余表保留)。
+# 建表语句只在版本号不一致 (含新建的数据库) 时执行
+_SCHEMA_VERSION = 10
+_REBUILD_ON_UPGRADE = ["toc_cache"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    file_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS ingested_files (
+    path TEXT PRIMARY KEY,
+    file_hash TEXT,
+    size INTEGER,
+    ingested_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_ingested_hash ON ingested_files (file_hash);
+CREATE TABLE IF NOT EXISTS repair_stats (
+    file_hash TEXT PRIMARY KEY,
+    source_path TEXT,
+    repair_seconds REAL,
+    cache_hits INTEGER DEFAULT 0,
+    repaired_at REAL
+);
+CREATE TABLE IF NOT EXISTS crop_manifest (
+    output_path TEXT PRIMARY KEY,
+    source_path TEXT,
+    source_hash TEXT,
+    page_ranges TEXT,
+    task_suffix TEXT,
+    region TEXT,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS crop_fingerprints (
+    output_path TEXT PRIMARY KEY,
+    fingerprint TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS region_registry (
+    filename TEXT PRIMARY KEY,
+    rules_key TEXT,
+    record_json TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS corpus_docs (
+    doc_id INTEGER PRIMARY KEY,
+    file_hash TEXT UNIQUE,
+    page_count INTEGER,
+    version INTEGER,
+    indexed_at REAL
+);
+CREATE TABLE IF NOT EXISTS corpus_postings (
+    term TEXT,
+    doc_id INTEGER,
+    pages BLOB,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS crop_outputs (
+    output_path TEXT PRIMARY KEY,
+    profile TEXT,
+    original_size INTEGER,
+    optimized_size INTEGER,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS toc_cache (
+    file_hash TEXT,
+    source TEXT,
+    version INTEGER,
+    page_count INTEGER,
+    toc_json TEXT,
+    offset INTEGER,
+    anchor TEXT,
+    confidence REAL,
+    updated_at REAL,
+    PRIMARY KEY (file_hash, source)
+);
+"""
+
+
+def _connect(cache_dir=None):
+    """打开 (必要时创建 / 升级) 缓存数据库，新建一个连接"""
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(cache_dir, CACHE_DB_NAME), timeout=30)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+        for table in _REBUILD_ON_UPGRADE:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.executescript(_SCHEMA)
+        conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        conn.commit()
+    return conn
+
+
+# 当前线程正在使用的连接 {数据库路径: [连接, 嵌套层数]}，连接不跨线程共享 (Streamlit 多线程)
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def cache_session(cache_dir=None):
+    """
+    取得缓存数据库连接。同一线程内嵌套使用时复用外层连接，最外层退出时关闭；
+    调用方可以用它包住一整段缓存读写 (如 计算哈希 -> 读目录缓存 -> 写目录缓存)，只打开一次连接。
+    """
+    db_path = os.path.abspath(os.path.join(cache_dir or CACHE_DIR, CACHE_DB_NAME))
+    sessions = _local.__dict__.setdefault("sessions", {})
+    entry = sessions.get(db_path)
+    if entry is None:
+        entry = sessions[db_path] = [_connect(cache_dir), 0]
+    entry[1] += 1
+    try:
+        yield entry[0]
+    except Exception:
+        entry[0].rollback()
+        raise
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del sessions[db_path]
+            entry[0].close()
+
+
+def file_content_hash(file_path, chunk_size=1024 * 1024, cache_dir=None):
+    """
+    计算文件内容的 SHA1 (分块读取，不会把大文件整个读进内存)。
+    按 (路径, 大小, 修改时间) 记忆结果，文件未变化时不再重复读取。
+    """
+    stat = os.stat(file_path)
+    abs_path = os.path.abspath(file_path)
+
+    with cache_session(cache_dir) as conn:
+        row = conn.execute(
+            "SELECT size, mtime, file_hash FROM file_hashes WHERE path = ?", (abs_path,)
+        ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+
+        sha1 = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha1.update(chunk)
+        file_hash = sha1.hexdigest()
+
+        conn.execute(
+            "INSERT OR REPLACE INTO file_hashes (path, size, mtime, file_hash) VALUES (?, ?, ?, ?)",
+            (abs_path, stat.st_size, stat.st_mtime, file_hash)
+        )
+        conn.commit()
+        return file_hash
+
+
+def remember_file_hash(file_path, file_hash, cache_dir=None):
+    """已知文件哈希时直接写入记忆表 (例如上传时边读边算)，后续 file_content_hash 不再读文件"""
+    stat = os.stat(file_path)
+    with cache_session(cache_dir) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO file_hashes (path, size, mtime, file_hash) VALUES (?, ?, ?, ?)",
+            (os.path.abspath(file_path), stat.st_size, stat.st_mtime, file_hash)
+        )
+        conn.commit()
+
+
+def find_ingested_files(file_hash, cache_dir=None):
+    """按内容哈希查询已入库的文件路径 (只返回仍存在的文件)"""
+    with cache_session(cache_dir) as conn:
+        rows = conn.execute(
+            "SELECT path FROM ingested_files WHERE file_hash = ?", (file_hash,)
+        ).fetchall()
+    return [r[0] for r in rows if os.path.exists(r[0])]
+
+
+def record_ingested_file(file_path, file_hash, cache_dir=None):
+    """登记一个已入库的文件，并同步写入哈希记忆表"""
+    abs_path = os.path.abspath(file_path)
+    with cache_session(cache_dir) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO ingested_files (path, file_hash, size, ingested_at) VALUES (?, ?, ?, ?)",
+            (abs_path, file_hash, os.path.getsize(file_path), time.time())
+        )
+        conn.commit()
+        remember_file_hash(file_path, file_hash, cache_dir)
+
+
+def load_toc_cache(file_hash, source="text", cache_dir=None):
+    """
+    读取目录解析缓存。source: "text" (文本目录 + 偏移量校准) 或 "outline" (内嵌书签)。
+    返回 {"toc": {...}, "offset": int, "anchor": str|None, "confidence": float,
+          "page_count": int, "source": str}，未命中返回 None。
+    """
+    with cache_session(cache_dir) as conn:
+        row = conn.execute(
+            "SELECT version, page_count, toc_json, offset, anchor, confidence FROM toc_cache "
+            "WHERE file_hash = ? AND source = ?",
+            (file_hash, source)
+        ).fetchone()
+
+    if not row or row[0] != TOC_CACHE_VERSION:
+        return None
+    return {
+        "toc": json.loads(row[2]),
+        "offset": row[3],
+        "anchor": row[4],
+        "confidence": row[5],
+        "page_count": row[1],
+        "source": source,
+    }
+
+
+def save_toc_cache(file_hash, toc_dict, offset, anchor, page_count, source="text", confidence=None, cache_dir=None):
+    """写入目录解析缓存 (同一文件、同一来源覆盖旧记录)"""
+    with cache_session(cache_dir) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO toc_cache "
+            "(file_hash, source, version, page_count, toc_json, offset, anchor, confidence, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (file_hash, source, TOC_CACHE_VERSION, page_count,
+             json.dumps(toc_dict, ensure_ascii=False), offset, anchor, confidence, time.time())
+        )
+        conn.commit()
+
+
+# ========================================================
+# 损坏 PDF 修复统计
+# ========================================================
+def record_repair(file_hash, source_path, repair_seconds, cache_dir=None):
+    """记录一次 pikepdf 修复 (耗时秒数)"""
+    with cache_session(cache_dir) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO repair_stats (file_hash, source_path, repair_seconds, cache_hits, repaired_at) "
+            "VALUES (?, ?, ?, COALESCE((SELECT cache_hits FROM repair_stats WHERE file_hash = ?), 0), ?)",
+            (file_hash, os.path.abspath(source_path), repair_seconds, file_hash, time.time())
+        )
+        conn.commit()
+
+
+def record_repair_hit(file_hash, cache_dir=None):
+    """记录一次修复缓存命中 (复用了磁盘上已修复的文件)"""
+    with cache_session(cache_dir) as conn:
+        conn.execute("UPDATE repair_stats SET cache_hits = cache_hits + 1 WHERE file_hash = ?", (file_hash,))
+        conn.commit()
+
+
+def load_repair_stats(cache_dir=None):
+    """
+    修复统计汇总：
+    {"repaired_files": 修复过的文件数, "repair_seconds": 修复总耗时, "cache_hits": 缓存命中次数,
+     "files": [{"文件": ..., "修复耗时(秒)": ..., "缓存命中": ...}, ...]}
+    """
+    with cache_session(cache_dir) as conn:
+        rows = conn.execute(
+            "SELECT source_path, repair_seconds, cache_hits FROM repair_stats ORDER BY repair_seconds DESC"
+        ).fetchall()
+    return {
+        "repaired_files": len(rows),
+        "repair_seconds": sum(r[1] or 0 for r in rows),
+        "cache_hits": sum(r[2] or 0 for r in rows),
+        "files": [{"文件": os.path.basename(r[0]), "修复耗时(秒)": round(r[1] or 0, 2), "缓存命中": r[2]}
+                  for r in rows],
+    }
+
+
+# ========================================================
+# 虚拟裁剪清单 (延迟生成 PDF)
+# ========================================================
+_MANIFEST_COLUMNS = ["output_path", "source_path", "source_hash", "page_ranges", "task_suffix", "region", "created_at"]
+
+
+def _manifest_row_to_dict(row):
+    entry = dict(zip(_MANIFEST_COLUMNS, row))
+    entry["page_ranges"] = [tuple(r) for r in json.loads(entry["page_ranges"])]
+    return entry
+
+
+def save_crop_manifest(output_path, source_path, source_hash, page_ranges, task_suffix, region, cache_dir=None):
+    """记录一条裁剪清单：输出文件暂不生成，只保存 源文件哈希 + 页码区间"""
+    with cache_session(cache_dir) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO crop_manifest "
+            "(output_path, source_path, source_hash, page_ranges, task_suffix, region, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(output_path), os.path.abspath(source_path), source_hash,
+             json.dumps([list(r) for r in page_ranges]), task_suffix, region, time.time())
+        )
+        conn.commit()
+
+
+def load_crop_manifest(output_path, cache_dir=None):
+    """按输出路径读取裁剪清单，不存在返回 None"""
+    with cache_session(cache_dir) as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(_MANIFEST_COLUMNS)} FROM crop_manifest WHERE output_path = ?",
+            (os.path.abspath(output_path),)
+        ).fetchone()
+    return _manifest_row_to_dict(row) if row else None
+
+
+def list_crop_manifest(crop_dir, cache_dir=None):
+    """列出某个输出目录下的全部裁剪清单"""
+    with cache_session(cache_dir) as conn:
+        rows = conn.execute(f"SELECT {', '.join(_MANIFEST_COLUMNS)} FROM crop_manifest").fetchall()
+    crop_dir = os.path.abspath(crop_dir)
+    return [_manifest_row_to_dict(r) for r in rows if os.path.dirname(r[0]) == crop_dir]
+
+
+def delete_crop_manifest(output_path, cache_dir=None):
+    """删除裁剪清单 (文件已实际生成或被用户删除时调用)"""
+    with cache_session(cache_dir) as conn:
+        conn.execute("DELETE FROM crop_manifest WHERE output_path = ?", (os.path.abspath(output_path),))
+        conn.commit()
+
+
+# ========================================================
+# 裁剪任务指纹 (重复运行时跳过未变化的任务)
+# ========================================================
+def load_crop_fingerprints(output_paths, cache_dir=None):
+    """批量读取输出文件对应的任务指纹 {output_path: fingerprint}，没有记录的不返回"""
+    if not output_paths:
+        return {}
+    abs_paths = {os.path.abspath(p): p for p in output_paths}
+    with cache_session(cache_dir) as conn:
+        rows = conn.execute("SELECT output_path, fingerprint FROM crop_fingerprints").fetchall()
+    return {abs_paths[path]: fp for path, fp in rows if path in abs_paths}
+
+
+def save_crop_fingerprints(fingerprints, cache_dir=None):
+    """记录成功完成的任务指纹 {output_path: fingerprint}"""
+    if not fingerprints:
+        return
+    with cache_session(cache_dir) as conn:
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO crop_fingerprints (output_path, fingerprint, updated_at) VALUES (?, ?, ?)",
+            [(os.path.abspath(p), fp, now) for p, fp in fingerprints.items()]
+        )
+        conn.commit()
+
+
+# ========================================================
+# 裁剪结果体积记录
+# ========================================================
+def record_output_size(output_path, profile, original_size, optimized_size, cache_dir=None):
+    """记录裁剪结果 优化前 / 优化后 的字节数"""
+    with cache_session(cache_dir) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO crop_outputs (output_path, profile, original_size, optimized_size, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (os.path.abspath(output_path), profile, original_size, optimized_size, time.time())
+        )
+        conn.commit()
+
+
+def load_output_sizes(crop_dir, cache_dir=None):
+    """读取某个输出目录下的体积记录 {文件名: {"profile", "original_size", "optimized_size"}}"""
+    with cache_session(cache_dir) as conn:
+        rows = conn.execute("SELECT output_path, profile, original_size, optimized_size FROM crop_outputs").fetchall()
+    crop_dir = os.path.abspath(crop_dir)
+    return {os.path.basename(r[0]): {"profile": r[1], "original_size": r[2], "optimized_size": r[3]}
+            for r in rows if os.path.dirname(r[0]) == crop_dir}
+
+
+# ========================================================
+# 地区名称登记表 (文件名 -> 标准化地区记录)
+# ========================================================
+_SQL_CHUNK = 500   # 单条 SQL 的参数个数上限以内
+
+
+def load_region_records(filenames, rules_key, cache_dir=None):
+    """批量读取已登记的地区记录 {filename: record}，规则版本不一致的记录视为未登记"""
+    filenames = list(dict.fromkeys(filenames))
+    records = {}
+    if not filenames:
+        return records
+    with cache_session(cache_dir) as conn:
+        for i in range(0, len(filenames), _SQL_CHUNK):
+            chunk = filenames[i:i + _SQL_CHUNK]
+            rows = conn.execute(
+                f"SELECT filename, record_json FROM region_registry "
+                f"WHERE rules_key = ? AND filename IN ({','.join('?' * len(chunk))})",
+                [rules_key] + chunk
+            ).fetchall()
+            records.update({name: json.loads(record_json) for name, record_json in rows})
+    return records
+
+
+def save_region_records(records, rules_key, cache_dir=None):
+    """登记地区记录 {filename: record}"""
+    if not records:
+        return
+    with cache_session(cache_dir) as conn:
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO region_registry (filename, rules_key, record_json, updated_at) VALUES (?, ?, ?, ?)",
+            [(name, rules_key, json.dumps(record, ensure_ascii=False), now) for name, record in records.items()]
+        )
+        conn.commit()
+
+
+# ========================================================
+# 全库倒排索引 (词项 -> 各文档的页位图)
+# ========================================================
+def load_indexed_docs(file_hashes, version, cache_dir=None):
+    """批量读取已建索引的文档 {file_hash: (doc_id, page_count)}，索引版本不一致的视为未建"""
+    file_hashes = list(dict.fromkeys(file_hashes))
+    docs = {}
+    if not file_hashes:
+        return docs
+    with cache_session(cache_dir) as conn:
+        for i in range(0, len(file_hashes), _SQL_CHUNK):
+            chunk = file_hashes[i:i + _SQL_CHUNK]
+            rows = conn.execute(
+                f"SELECT file_hash, doc_id, page_count FROM corpus_docs "
+                f"WHERE version = ? AND file_hash IN ({','.join('?' * len(chunk))})",
+                [version] + chunk
+            ).fetchall()
+            docs.update({file_hash: (doc_id, page_count) for file_hash, doc_id, page_count in rows})
+    return docs
+
+
+def save_corpus_index(file_hash, page_count, postings, version, cache_dir=None):
+    """写入 (或重建) 一个文档的倒排索引，postings: {term: 页位图 (int，第 i 位表示第 i 页)}"""
+    with cache_session(cache_dir) as conn:
+        row = conn.execute("SELECT doc_id FROM corpus_docs WHERE file_hash = ?", (file_hash,)).fetchone()
+        if row:
+            doc_id = row[0]
+            conn.execute("DELETE FROM corpus_postings WHERE doc_id = ?", (doc_id,))
+            conn.execute("UPDATE corpus_docs SET page_count = ?, version = ?, indexed_at = ? WHERE doc_id = ?",
+                         (page_count, version, time.time(), doc_id))
+        else:
+            doc_id = conn.execute(
+                "INSERT INTO corpus_docs (file_hash, page_count, version, indexed_at) VALUES (?, ?, ?, ?)",
+                (file_hash, page_count, version, time.time())
+            ).lastrowid
+        conn.executemany(
+            "INSERT INTO corpus_postings (term, doc_id, pages) VALUES (?, ?, ?)",
+            [(term, doc_id, bits.to_bytes((bits.bit_length() + 7) // 8, "little"))
+             for term, bits in postings.items()]
+        )
+        conn.commit()
+
+
+def load_corpus_postings(terms, doc_ids, cache_dir=None):
+    """读取词项的倒排表 {(term, doc_id): 页位图}，只返回 doc_ids 中的文档"""
+    terms = list(dict.fromkeys(terms))
+    doc_ids = set(doc_ids)
+    postings = {}
+    if not terms or not doc_ids:
+        return postings
+    with cache_session(cache_dir) as conn:
+        for i in range(0, len(terms), _SQL_CHUNK):
+            chunk = terms[i:i + _SQL_CHUNK]
+            rows = conn.execute(
+                f"SELECT term, doc_id, pages FROM corpus_postings WHERE term IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            postings.update({(term, doc_id): int.from_bytes(pages, "little")
+                             for term, doc_id, pages in rows if doc_id in doc_ids})
+    return postings
@@ -0,0 +1,295 @@
+import os
+import re
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+try:
+    from re import _parser as sre_parse, _constants as sre_constants   # Python 3.11+
+except ImportError:
+    import sre_parse, sre_constants
+from utils.utils_cache import file_content_hash, load_indexed_docs, save_corpus_index, load_corpus_postings, \
+    cache_session
+from utils.utils_pdf import open_pdf_auto_repair, PageTextStore, PAGE_TEXT_DIR, _compile_keyword_pattern
+
+# ========================================================
+# 全库倒排索引：词项 (单字 + 字符二元组) -> (文档, 页) 位图
+# 关键词 / 正则先用索引筛出候选页，完整正则只在候选页的缓存文本上执行
+# ========================================================
+# 分词规则有改动时 +1，旧索引自动重建
+INDEX_VERSION = 1
+SNIPPET_CHARS = 30   # 命中片段前后各保留的字数
+
+_NON_INDEX_RE = re.compile(r"[^\u4e00-\u9fa5a-z0-9]")
+
+
+def _normalize(text):
+    """只保留汉字与小写字母数字 (去掉空白与标点，正则中的 \\s* 不影响相邻关系)"""
+    return _NON_INDEX_RE.sub("", text.lower())
+
+
+def _page_terms(text):
+    """一页的索引词项：单字 + 相邻二元组"""
+    norm = _normalize(text)
+    terms = set(norm)
+    terms.update(norm[i:i + 2] for i in range(len(norm) - 1))
+    return terms
+
+
+def index_document(pdf_path):
+    """
+    为一个文档建立倒排索引 (按内容哈希，已建过的直接跳过)。
+    页面文本写入 PageTextStore 缓存，之后的裁剪与检索都不必再提取文本。
+    返回 "cached" / "indexed" / "failed"
+    """
+    try:
+        with cache_session():
+            file_hash = file_content_hash(pdf_path)
+            indexed = load_indexed_docs([file_hash], INDEX_VERSION)
+        # 页面文本缓存被清理时 (检索要读它) 也需要重建
+        if indexed and \
+                os.path.exists(os.path.join(PAGE_TEXT_DIR, f"{file_hash}.idx")):
+            return "cached"
+    except Exception as e:
+        print(f"⚠️ 读取索引失败 {os.path.basename(pdf_path)}: {e}")
+        return "failed"
+
+    doc = open_pdf_auto_repair(pdf_path)
+    if doc is None:
+        return "failed"
+    text_store = PageTextStore(doc, file_hash)
+    try:
+        postings = {}
+        for page_index in range(doc.page_count):
+            bit = 1 << page_index
+            for term in _page_terms(text_store.text(page_index)):
+                postings[term] = postings.get(term, 0) | bit
+        save_corpus_index(file_hash, doc.page_count, postings, INDEX_VERSION)
+        print(f"🗂️ 已建立索引: {os.path.basename(pdf_path)} ({doc.page_count} 页, {len(postings)} 个词项)")
+        return "indexed"
+    except Exception as e:
+        print(f"⚠️ 建立索引失败 {os.path.basename(pdf_path)}: {e}")
+        return "failed"
+    finally:
+        text_store.close()
+        doc.close()
+
+
+def index_documents(pdf_paths, progress_callback=None):
+    """批量建立索引，progress_callback(done, total, pdf_path, status)；返回 {status: 数量}"""
+    counts = {}
+    for done, pdf_path in enumerate(pdf_paths, 1):
+        status = index_document(pdf_path)
+        counts[status] = counts.get(status, 0) + 1
+        if progress_callback:
+            progress_callback(done, len(pdf_paths), pdf_path, status)
+    return counts
+
+
+# 后台建立索引：所有会话共用一个工作进程，按提交顺序处理；
+# 同一文件重复提交时后一次直接命中 "cached"，不会重复建立。
+# 使用 spawn 进程而不是线程：MuPDF 不是线程安全的 (前台的裁剪 / 目录分析 / 缩略图同时在用)，
+# 且提取文本会长时间占用 GIL，拖慢 Streamlit 页面
+_index_executor = None
+_index_executor_lock = threading.Lock()
+
+
+def _submit_index(pdf_path):
+    global _index_executor
+    with _index_executor_lock:
+        for _ in range(2):
+            if _index_executor is None:
+                _index_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            try:
+                return _index_executor.submit(index_document, pdf_path)
+            except BrokenProcessPool:
+                # 工作进程崩溃 (如 MuPDF 段错误) 后进程池不可再用，重新创建
+                _index_executor = None
+        raise BrokenProcessPool("索引进程无法启动")
+
+
+def index_documents_async(pdf_paths):
+    """
+    在后台进程中批量建立索引，立即返回任务 {"futures", "done", "total"}，done 随进度更新
+    (失败的文件同样计入 done)。
+    上传大批文件时不阻塞页面；索引完成前，这些文件在 search_corpus 中计入 unindexed。
+    """
+    job = {"done": 0, "total": len(pdf_paths), "futures": []}
+
+    def finished(future):
+        job["done"] += 1
+
+    for pdf_path in pdf_paths:
+        future = _submit_index(pdf_path)
+        future.add_done_callback(finished)
+        job["futures"].append(future)
+    return job
+
+
+# ========================================================
+# 正则 -> 必需词项 (AND / OR 查询树)
+# ========================================================
+def _is_optional_space(op, av):
+    """\\s* / \\s? / 空格* 之类可有可无的空白：索引文本已去掉空白，不打断相邻的字面量"""
+    if op not in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) or av[0] != 0:
+        return False
+    item = list(av[2])
+    if len(item) != 1:
+        return False
+    item_op, item_av = item[0]
+    if item_op is sre_constants.LITERAL:
+        return chr(item_av).isspace()
+    if item_op is sre_constants.IN:
+        return all(o is sre_constants.CATEGORY and a is sre_constants.CATEGORY_SPACE for o, a in item_av)
+    return False
+
+
+def _run_terms(run):
+    """连续字面量 -> 必需词项：单字直接作为词项，多字拆成相邻二元组"""
+    if len(run) == 1:
+        return [("term", run)]
+    return [("term", run[i:i + 2]) for i in range(len(run) - 1)]
+
+
+def _and(nodes):
+    nodes = [n for n in nodes if n is not None]
+    if not nodes:
+        return None
+    return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+
+def _sequence_query(items):
+    """
+    解析后的正则序列 -> 查询树。结果是原正则的必要条件 (宽松)：
+    正则能在某页匹配，则该页一定满足查询树；反之不一定，候选页还需完整正则确认。
+    None 表示没有可用的约束 (所有页都是候选)。
+    """
+    nodes, run = [], ""
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            ch = chr(av).lower()
+            if ch.isspace():
+                continue
+            if _NON_INDEX_RE.match(ch):
+                nodes += _run_terms(run) if run else []
+                run = ""
+            else:
+                run += ch
+            continue
+        if _is_optional_space(op, av):
+            continue
+        if run:
+            nodes += _run_terms(run)
+            run = ""
+        if op is sre_constants.SUBPATTERN:
+            nodes.append(_sequence_query(av[-1]))
+        elif op is sre_constants.BRANCH:
+            branches = [_sequence_query(branch) for branch in av[1]]
+            # 任一分支没有约束，整个分支就没有约束
+            if all(b is not None for b in branches):
+                nodes.append(("or", branches))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+            nodes.append(_sequence_query(av[2]))
+        elif op is sre_constants.IN:
+            # 单字的分支会被合并成字符集，如 "土|地" -> [土地]
+            chars = [chr(a).lower() for o, a in av if o is sre_constants.LITERAL]
+            if chars and len(chars) == len(av) and not any(_NON_INDEX_RE.match(c) for c in chars):
+                nodes.append(("or", [("term", c) for c in chars]))
+        # 其余 (., 取反 / 范围字符集, 断言, 反向引用 ...) 不产生约束
+    if run:
+        nodes += _run_terms(run)
+    return _and(nodes)
+
+
+def regex_index_query(pattern):
+    """把正则 (字符串或已编译) 转为索引查询树：("term", 词) / ("and", [...]) / ("or", [...]) / None"""
+    pattern_str = pattern.pattern if hasattr(pattern, "pattern") else pattern
+    try:
+        return _sequence_query(list(sre_parse.parse(pattern_str)))
+    except Exception:
+        return None
+
+
+def _query_terms(node):
+    if node is None:
+        return []
+    if node[0] == "term":
+        return [node[1]]
+    return [t for child in node[1] for t in _query_terms(child)]
+
+
+def _evaluate(node, postings, doc_id, all_pages):
+    """在一个文档上计算查询树，返回候选页位图"""
+    if node is None:
+        return all_pages
+    if node[0] == "term":
+        return postings.get((node[1], doc_id), 0)
+    results = [_evaluate(child, postings, doc_id, all_pages) for child in node[1]]
+    bits = results[0]
+    for r in results[1:]:
+        bits = bits & r if node[0] == "and" else bits | r
+    return bits
+
+
+def _snippet(text, match):
+    start = max(0, match.start() - SNIPPET_CHARS)
+    end = min(len(text), match.end() + SNIPPET_CHARS)
+    return re.sub(r"\s+", " ", text[start:end]).strip()
+
+
+def search_corpus(keyword_pattern_str, pdf_paths, max_results=None):
+    """
+    在已建索引的文档中检索关键词 / 正则 (与 extract_pages_by_keywords 相同的编译规则，按整页文本匹配)。
+    返回 {"results": [{"文件", "页码", "片段"}...], "matched_docs", "matched_pages",
+          "candidate_pages", "total_pages", "unindexed": [未建索引的文件], "seconds"}
+    """
+    t0 = time.time()
+    pattern = _compile_keyword_pattern(keyword_pattern_str)
+    query = regex_index_query(pattern)
+
+    hashes = {}
+    with cache_session():
+        for pdf_path in pdf_paths:
+            try:
+                hashes[pdf_path] = file_content_hash(pdf_path)
+            except OSError:
+                continue
+        indexed = load_indexed_docs(hashes.values(), INDEX_VERSION)
+        postings = load_corpus_postings(_query_terms(query), [doc_id for doc_id, _ in indexed.values()])
+    unindexed = [os.path.basename(p) for p, h in hashes.items() if h not in indexed]
+
+    results, matched_docs, candidate_pages, total_pages = [], 0, 0, 0
+    for pdf_path, file_hash in hashes.items():
+        if file_hash not in indexed:
+            continue
+        doc_id, page_count = indexed[file_hash]
+        total_pages += page_count
+        bits = _evaluate(query, postings, doc_id, (1 << page_count) - 1)
+        if not bits:
+            continue
+        candidates = [i for i in range(page_count) if bits >> i & 1]
+        candidate_pages += len(candidates)
+        text_store = PageTextStore(None, file_hash, page_count=page_count)
+        try:
+            doc_hit = False
+            for page_index in candidates:
+                text = text_store.text(page_index)
+                match = pattern.search(text)
+                if match:
+                    doc_hit = True
+                    results.append({"文件": os.path.basename(pdf_path), "页码": page_index + 1,
+                                    "片段": _snippet(text, match)})
+            matched_docs += doc_hit
+        finally:
+            text_store.close()
+
+    return {
+        "results": results[:max_results] if max_results else results,
+        "matched_docs": matched_docs,
+        "matched_pages": len(results),
+        "candidate_pages": candidate_pages,
+        "total_pages": total_pages,
+        "unindexed": unindexed,
+        "seconds": time.time() - t0,
+    }
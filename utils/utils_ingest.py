@@ -0,0 +1,80 @@
+import os
+import shutil
+import hashlib
+from utils.utils_cache import file_content_hash, find_ingested_files, record_ingested_file, cache_session
+
+# 上传文件分块大小：每次只读写 4MB，不再一次性 getbuffer 整个文件
+INGEST_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _upload_key(uploaded_file):
+    """同一次会话中标识一个上传文件 (Streamlit 的 file_id；旧版本退化为 文件名+大小)"""
+    file_id = getattr(uploaded_file, "file_id", None)
+    return file_id or f"{uploaded_file.name}:{uploaded_file.size}"
+
+
+def _hash_upload(uploaded_file, chunk_size=INGEST_CHUNK_SIZE):
+    """分块计算上传文件内容的 SHA1"""
+    sha1 = hashlib.sha1()
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(chunk_size), b""):
+        sha1.update(chunk)
+    uploaded_file.seek(0)
+    return sha1.hexdigest()
+
+
+def ingest_upload(uploaded_file, upload_dir, persisted=None, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    把 Streamlit 上传的文件保存到 upload_dir，每个上传只落盘一次。
+    - persisted: 会话级记录 {上传标识: 保存路径} (传入 st.session_state 中的字典)，
+                 命中时直接返回，Streamlit 每次 rerun 不再重复写盘；
+    - 按内容哈希去重：同名同内容的文件已存在时跳过写入；
+                 内容相同但文件名不同，则从已有文件硬链接 (失败时复制)，不再读写上传缓冲区；
+    - 写入时分块写到临时文件再原子替换，避免半截文件。
+    返回 (保存路径, 状态)，状态为 "session" / "duplicate" / "linked" / "written"
+    """
+    key = _upload_key(uploaded_file)
+    if persisted is not None:
+        saved_path = persisted.get(key)
+        if saved_path and os.path.exists(saved_path):
+            return saved_path, "session"
+
+    os.makedirs(upload_dir, exist_ok=True)
+    file_path = os.path.join(upload_dir, uploaded_file.name)
+    file_hash = _hash_upload(uploaded_file, chunk_size)
+
+    # 已入库且内容未被改动的同哈希文件 (哈希按 大小+修改时间 记忆，通常不需要重新读盘)
+    with cache_session():
+        existing = [p for p in find_ingested_files(file_hash) if file_content_hash(p) == file_hash]
+        is_duplicate = os.path.exists(file_path) and file_content_hash(file_path) == file_hash
+    status = None
+    if is_duplicate:
+        status = "duplicate"
+    elif existing:
+        try:
+            tmp_path = file_path + ".part"
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            try:
+                os.link(existing[0], tmp_path)
+            except OSError:
+                shutil.copyfile(existing[0], tmp_path)
+            os.replace(tmp_path, file_path)
+            status = "linked"
+        except Exception as e:
+            print(f"⚠️ 复用已有文件失败，改为重新写入: {e}")
+
+    if status is None:
+        tmp_path = file_path + ".part"
+        uploaded_file.seek(0)
+        with open(tmp_path, "wb") as buffer:
+            for chunk in iter(lambda: uploaded_file.read(chunk_size), b""):
+                buffer.write(chunk)
+        uploaded_file.seek(0)
+        os.replace(tmp_path, file_path)
+        status = "written"
+
+    # 重复上传同样登记 (按内容哈希)，之后的去重与指纹查询都能找到它
+    record_ingested_file(file_path, file_hash)
+    if persisted is not None:
+        persisted[key] = file_path
+    return file_path, status
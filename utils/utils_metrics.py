@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import contextlib
+import functools
+import threading
+from utils.utils_cache import CACHE_DIR
+
+# 裁剪耗时记录：每处理完一个文档追加一行 JSON (多进程追加写，互不干扰)
+METRICS_PATH = os.path.join(CACHE_DIR, "crop_metrics.jsonl")
+
+# 阶段名称 -> 显示名称
+PHASE_LABELS = {
+    "open": "打开/修复 (open_pdf_auto_repair)",
+    "outline": "读取书签",
+    "parse_toc": "目录解析 (parse_toc_to_dict)",
+    "offset": "偏移量校准 (calculate_global_offset)",
+    "match": "章节匹配 (match_section_from_dict)",
+    "get_text": "文本提取 (get_text)",
+    "find_tables": "表格检测 (find_tables)",
+    "scan_parallel": "分片并行扫描",
+    "insert_pdf": "页面复制 (insert_pdf)",
+    "optimize": "体积优化",
+    "save": "保存 (save)",
+    "text_export": "文本层导出",
+    "other": "其他",
+}
+
+# 当前线程正在处理的文档 (每个线程同一时间只处理一个文档)。
+# 按线程隔离：Streamlit 每个会话在各自的线程中运行，单文件 / 单进程裁剪不会互相嵌套
+_local = threading.local()
+
+
+def _current_state():
+    state = getattr(_local, "state", None)
+    if state is None:
+        state = _local.state = {"depth": 0, "record": None, "stack": []}
+    return state
+
+
+@contextlib.contextmanager
+def document_metrics(pdf_path, kind):
+    """
+    记录一个文档的处理耗时。可以嵌套调用 (如 _crop_job -> extract_section_to_pdf)，只有最外层写入记录。
+    kind: 调用的裁剪入口，如 "toc" / "content" / "single_pass" / "manual"
+    """
+    state = _current_state()
+    outer = state["depth"] == 0
+    if outer:
+        state["record"] = {"file": os.path.basename(pdf_path), "kind": kind, "pages": 0, "phases": {}}
+        state["stack"] = []
+    state["depth"] += 1
+    t0 = time.perf_counter()
+    try:
+        yield state["record"]
+    finally:
+        state["depth"] -= 1
+        if outer:
+            record = state["record"]
+            record["total"] = time.perf_counter() - t0
+            record["other"] = max(0.0, record["total"] - sum(record["phases"].values()))
+            record["phases"] = {name: round(secs, 4) for name, secs in record["phases"].items()}
+            record["total"], record["other"] = round(record["total"], 4), round(record["other"], 4)
+            record["ts"] = time.time()
+            state["record"] = None
+            _append_metrics(record)
+
+
+@contextlib.contextmanager
+def timed_phase(name):
+    """
+    累计某个阶段的耗时 (只在 document_metrics 内生效)。
+    阶段可以嵌套，计时是互斥的：进入子阶段时父阶段暂停，各阶段耗时之和不超过总耗时。
+    """
+    state = _current_state()
+    record = state["record"]
+    if record is None:
+        yield
+        return
+    stack = state["stack"]
+    now = time.perf_counter()
+    if stack:
+        parent = stack[-1]
+        record["phases"][parent[0]] = record["phases"].get(parent[0], 0.0) + now - parent[1]
+    stack.append([name, now])
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        finished = stack.pop()
+        record["phases"][name] = record["phases"].get(name, 0.0) + now - finished[1]
+        if stack:
+            stack[-1][1] = now
+
+
+def set_document_pages(page_count):
+    """记录当前文档的页数 (用于计算 页/秒)"""
+    state = _current_state()
+    if state["record"] is not None:
+        state["record"]["pages"] = max(state["record"]["pages"], page_count)
+
+
+def set_document_result(ok):
+    """记录当前文档是否处理成功"""
+    state = _current_state()
+    if state["record"] is not None:
+        state["record"]["ok"] = bool(ok)
+
+
+def _append_metrics(record, path=None):
+    path = path or METRICS_PATH
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"⚠️ 耗时记录写入失败: {e}")
+
+
+def load_crop_metrics(path=None, limit=None):
+    """读取耗时记录 (最新的在后)，limit 只保留最近的 N 条"""
+    path = path or METRICS_PATH
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records[-limit:] if limit else records
+
+
+def clear_crop_metrics(path=None):
+    path = path or METRICS_PATH
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def summarize_crop_metrics(records, top_n=10):
+    """
+    汇总耗时记录，返回:
+    {"documents", "pages", "seconds", "pages_per_sec",
+     "phases": [{"阶段", "耗时(秒)", "占比"}...] (按耗时降序),
+     "slowest": [{"文件", "入口", "页数", "耗时(秒)", "页/秒", "最慢阶段"}...]}
+    """
+    total_seconds = sum(r.get("total", 0.0) for r in records)
+    total_pages = sum(r.get("pages", 0) for r in records)
+    phase_totals = {}
+    for r in records:
+        for name, secs in r.get("phases", {}).items():
+            phase_totals[name] = phase_totals.get(name, 0.0) + secs
+        phase_totals["other"] = phase_totals.get("other", 0.0) + r.get("other", 0.0)
+
+    phases = [{
+        "阶段": PHASE_LABELS.get(name, name),
+        "耗时(秒)": round(secs, 2),
+        "占比": f"{secs / total_seconds:.1%}" if total_seconds else "-",
+    } for name, secs in sorted(phase_totals.items(), key=lambda x: -x[1])]
+
+    slowest = []
+    for r in sorted(records, key=lambda r: -r.get("total", 0.0))[:top_n]:
+        doc_phases = dict(r.get("phases", {}), other=r.get("other", 0.0))
+        worst = max(doc_phases.items(), key=lambda x: x[1]) if doc_phases else ("other", 0.0)
+        slowest.append({
+            "文件": r.get("file"),
+            "入口": r.get("kind"),
+            "页数": r.get("pages", 0),
+            "耗时(秒)": round(r.get("total", 0.0), 2),
+            "页/秒": round(r["pages"] / r["total"], 1) if r.get("total") and r.get("pages") else None,
+            "最慢阶段": f"{PHASE_LABELS.get(worst[0], worst[0])} ({worst[1]:.2f}s)",
+        })
+
+    return {
+        "documents": len(records),
+        "pages": total_pages,
+        "seconds": total_seconds,
+        "pages_per_sec": total_pages / total_seconds if total_seconds else 0.0,
+        "phases": phases,
+        "slowest": slowest,
+    }
+
+
+def timed(name):
+    """装饰器：把整个函数的耗时计入某个阶段"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed_phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def tracked_document(kind):
+    """
+    装饰器：把裁剪入口函数 (第一个参数为 PDF 路径) 的一次调用记录为一个文档。
+    返回值为字典 (多个输出) 时，全部成功才算成功。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(pdf_path, *args, **kwargs):
+            with document_metrics(pdf_path, kind):
+                result = func(pdf_path, *args, **kwargs)
+                set_document_result(all(result.values()) if isinstance(result, dict) else result)
+                return result
+        return wrapper
+    return decorator
@@ -6,21 +6,24 @@ import numpy as np
 # ==========================================
 # 1. 土地利用现状 (自然资源禀赋) 解析器
 # ==========================================
+# 定义12个标准地类
+LAND_USE_CATEGORIES = [
+    # 农用地相关
+    "耕地", "园地", "林地", "草地", "设施农用地", "田坎",
+    # 建设用地相关
+    "商服用地", "工矿用地", "住宅用地", "公共管理与公共服务用地", "特殊用地资源", "交通运输用地", 
+    "城镇村及工矿用地", # <--- 新增：大模型常返回这个汇总类
+    # 生态相关
+    "水域及水利设施用地", "其他用地", "其他土地" # <--- 新增：国标常用名
+]
+
+
 def parse_land_use_row(raw_json_input):
     """
     解析“土地利用现状”数据，提取 12 个基础地类。
     支持处理 "100 + 20" 这种算术表达式。
     """
-    # 定义12个标准地类
-    target_categories = [
-        # 农用地相关
-        "耕地", "园地", "林地", "草地", "设施农用地", "田坎",
-        # 建设用地相关
-        "商服用地", "工矿用地", "住宅用地", "公共管理与公共服务用地", "特殊用地资源", "交通运输用地", 
-        "城镇村及工矿用地", # <--- 新增：大模型常返回这个汇总类
-        # 生态相关
-        "水域及水利设施用地", "其他用地", "其他土地" # <--- 新增：国标常用名
-    ]
+    target_categories = LAND_USE_CATEGORIES
     
     # 初始化全0
     final_result = {cat: 0.0 for cat in target_categories}
@@ -185,11 +188,15 @@ def parse_potential_row(raw_json_input, target_potentials):
 # ==========================================
 # 4. 项目汇总 解析器
 # ==========================================
+PROJECT_CATEGORIES = ["农用地整理类项目", "建设用地整理类项目", "生态保护修复类项目", 
+                      "乡村风貌提升和历史文化保护类项目", "公共服务与基础设施建设类项目", 
+                      "产业导入类项目", "其他类项目"]
+PROJECT_METRICS = ["数量", "投资", "规模"]
+
+
 def parse_project_row(raw_json_input):
-    target_categories = ["农用地整理类项目", "建设用地整理类项目", "生态保护修复类项目", 
-                         "乡村风貌提升和历史文化保护类项目", "公共服务与基础设施建设类项目", 
-                         "产业导入类项目", "其他类项目"]
-    metrics = ["数量", "投资", "规模"]
+    target_categories = PROJECT_CATEGORIES
+    metrics = PROJECT_METRICS
     final_result = {f"{c}_{m}": 0.0 for c in target_categories for m in metrics}
 
     if pd.isna(raw_json_input) or raw_json_input == "": return pd.Series(final_result)
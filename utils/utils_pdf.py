@@ -1,18 +1,287 @@
 import fitz  # PyMuPDF
 import re
 import pikepdf
-import io
 import os
 import fitz  
 import difflib
+import gc
+import sys
+import time
+import mmap
+import array
+import multiprocessing
+import json
+import hashlib
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+    import msvcrt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.utils_cache import CACHE_DIR, file_content_hash, load_toc_cache, save_toc_cache, \
+    record_repair, record_repair_hit, save_crop_manifest, load_crop_manifest, list_crop_manifest, \
+    delete_crop_manifest, record_output_size, load_crop_fingerprints, save_crop_fingerprints, TOC_CACHE_VERSION, \
+    cache_session
+from utils.utils_metrics import timed, timed_phase, tracked_document, set_document_pages
 
 
-def calculate_global_offset(doc, toc_dict):
+# ========================================================
+# 页面文本存储 (每页文本最多提取一次)
+# ========================================================
+PAGE_TEXT_DIR = os.path.join(CACHE_DIR, "page_text")
+HEADER_RATIO = 0.4   # 页眉区域：页面上部 40%，用于偏移量校准
+
+
+class PageTextStore:
+    """
+    单个文档的页面文本存储，同时保存【全文】和【页眉区域】两种文本。
+    parse_toc_to_dict / calculate_global_offset / extract_pages_by_keywords 共用，
+    每页每种文本最多调用一次 get_text。
+
+    传入 file_hash 时持久化到磁盘 (每个文档三个文件)：
+    - {hash}.idx: int64 偏移表，每页 4 项 [全文偏移, 全文长度, 页眉偏移, 页眉长度]，长度 -1 表示未提取
+    - {hash}.bin: UTF-8 文本 blob，只追加；读取时通过 mmap 按偏移切片
+    - {hash}.lock: 写锁，多个进程 (批量裁剪进程池、硬链接的重复文件) 共用同一内容哈希时串行写入
+    """
+    _FULL, _HEADER = 0, 2
+
+    def __init__(self, doc, file_hash=None, store_dir=None, page_count=None):
+        self.doc = doc
+        # doc 为 None 时只读已缓存的文本 (如全库检索)，未缓存的页返回空字符串
+        self.page_count = doc.page_count if doc is not None else page_count
+        self.file_hash = file_hash   # 为空时只缓存在内存中
+        self._new_texts = {}   # 本次新提取的文本 {(page, kind): text}
+        self._index = None
+        self._blob = None
+        self._blob_file = None
+        self._idx_path = self._bin_path = self._lock_path = None
+
+        if file_hash:
+            store_dir = store_dir or PAGE_TEXT_DIR
+            os.makedirs(store_dir, exist_ok=True)
+            self._idx_path = os.path.join(store_dir, f"{file_hash}.idx")
+            self._bin_path = os.path.join(store_dir, f"{file_hash}.bin")
+            self._lock_path = os.path.join(store_dir, f"{file_hash}.lock")
+            self._load()
+
+    @contextmanager
+    def _locked(self):
+        """跨进程写锁 (与读写的文件分开，替换 .idx / .bin 不影响加锁)"""
+        with open(self._lock_path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @staticmethod
+    def _write_atomic(path, data):
+        # 临时文件名按进程区分，避免多个进程互相 replace 掉对方的临时文件
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_index(self):
+        """读取磁盘上的偏移表；不存在、损坏或与页数不一致时返回 None"""
+        if not (os.path.exists(self._idx_path) and os.path.exists(self._bin_path)):
+            return None
+        index = array.array("q")
+        try:
+            with open(self._idx_path, "rb") as f:
+                index.frombytes(f.read())
+        except Exception:
+            return None
+        return index if len(index) == self.page_count * 4 else None
+
+    def _reset_files(self):
+        """
+        重建空的偏移表与 blob。其他进程可能正 mmap 着旧 blob，
+        因此写到新文件后原子替换，而不是原地截断 (旧映射仍指向原文件，不受影响)。
+        """
+        index = array.array("q", [0, -1] * (self.page_count * 2))
+        self._write_atomic(self._bin_path, b"")
+        self._write_atomic(self._idx_path, index.tobytes())
+        return index
+
+    def _remap(self):
+        """重新以只读方式 mmap 文本 blob (flush 追加或其他进程替换之后)"""
+        if self._blob is not None: self._blob.close()
+        if self._blob_file is not None: self._blob_file.close()
+        self._blob = self._blob_file = None
+        if os.path.getsize(self._bin_path) > 0:
+            self._blob_file = open(self._bin_path, "rb")
+            self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _load(self):
+        """读取已有的偏移表，并以只读方式 mmap 文本 blob"""
+        with self._locked():
+            index = self._read_index()
+            if index is None:
+                # 不存在或与文档页数不一致，重建
+                index = self._reset_files()
+            self._index = index
+            self._remap()
+
+    def _get(self, page_index, kind):
+        key = (page_index, kind)
+        if key in self._new_texts:
+            return self._new_texts[key]
+
+        if self._index is not None:
+            pos = page_index * 4 + kind
+            offset, length = self._index[pos], self._index[pos + 1]
+            if length >= 0 and self._blob is not None and offset + length <= len(self._blob):
+                return self._blob[offset:offset + length].decode("utf-8")
+
+        if self.doc is None:
+            return ""
+        # 未缓存：提取一次
+        try:
+            with timed_phase("get_text"):
+                page = self.doc[page_index]
+                if kind == self._HEADER:
+                    header_rect = fitz.Rect(0, 0, page.rect.width, page.rect.height * HEADER_RATIO)
+                    text = page.get_text("text", clip=header_rect) or ""
+                else:
+                    text = page.get_text() or ""
+        except Exception:
+            text = ""
+        self._new_texts[key] = text
+        return text
+
+    def text(self, page_index):
+        """整页文本"""
+        return self._get(page_index, self._FULL)
+
+    def header_text(self, page_index):
+        """页眉区域 (上部 40%) 文本"""
+        return self._get(page_index, self._HEADER)
+
+    def flush(self):
+        """
+        把新提取的文本追加到 blob，并原子地重写偏移表。
+        加锁后以磁盘上的偏移表为准合并 (其他进程可能已写入别的页)，写完重新 mmap，
+        已写出的页之后直接从 blob 读取，不会再次提取、重复追加。
+        """
+        if self._index is None or not self._new_texts:
+            return
+        with self._locked():
+            index = self._read_index()
+            if index is None:
+                index = self._reset_files()
+            with open(self._bin_path, "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                for (page_index, kind), text in self._new_texts.items():
+                    pos = page_index * 4 + kind
+                    if index[pos + 1] >= 0:
+                        continue   # 其他进程已写入同一页
+                    data = text.encode("utf-8")
+                    f.write(data)
+                    index[pos], index[pos + 1] = offset, len(data)
+                    offset += len(data)
+            self._write_atomic(self._idx_path, index.tobytes())
+            self._index = index
+            self._new_texts = {}
+            self._remap()
+
+    def refresh(self):
+        """其他进程 (如分片并行扫描) 写入同一文档的文本之后，重新读取偏移表；新提取的文本先写出"""
+        if self._index is None:
+            return
+        self.flush()
+        self._load()
+
+    def add_texts(self, texts):
+        """放入其他进程提取的整页文本 {页索引: 文本} (仅内存缓存时使用)，已有的页不覆盖"""
+        for page_index, text in texts.items():
+            self._new_texts.setdefault((page_index, self._FULL), text)
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"⚠️ 页面文本缓存写入失败: {e}")
+        finally:
+            if self._blob is not None: self._blob.close()
+            if self._blob_file is not None: self._blob_file.close()
+            self._blob = self._blob_file = None
+
+
+def open_page_text_store(doc, pdf_path=None):
+    """为已打开的文档创建文本存储；能计算内容哈希时持久化到磁盘，否则仅在内存中复用"""
+    file_hash = None
+    if pdf_path:
+        try:
+            file_hash = file_content_hash(pdf_path)
+        except Exception as e:
+            print(f"⚠️ 计算文件哈希失败，页面文本仅缓存在内存: {e}")
+    return PageTextStore(doc, file_hash)
+
+
+
+# 偏移量校准用到的正则 (模块级预编译)
+_NON_WORD_RE = re.compile(r"[^\u4e00-\u9fa5a-zA-Z0-9]")
+_TOC_LINE_RE = re.compile(r'[\.\…⋯·\s]+\d+\s*$')
+
+
+def calculate_global_offset(doc, toc_dict, text_store=None):
     """
     通过对比【目录中的页码】和【正文中标题实际出现的页码】，计算全局偏移量。
     已增加：防目录误判逻辑（避免匹配到目录页本身）。
     """
-    if not toc_dict: return 0
+    return calibrate_offset(doc, toc_dict, text_store)["offset"]
+
+
+def _build_header_line_index(text_store, page_indices):
+    """
+    单次遍历候选页：每页只取一次页眉文本、每行只清洗一次。
+    返回 {页索引: [清洗后的正文标题行, ...]}，
+    已剔除目录特征行 (以页码结尾 / 虚线引导) 和前 20 页中的"目录"页。
+    """
+    line_index = {}
+    for i in page_indices:
+        page_text = text_store.header_text(i)
+        # 特征 C: 检查该页是不是明确写着“目录”
+        # (如果页面最顶端写着“目录”，哪怕这行没有数字也跳过)
+        if "目录" in page_text[:50] and i < 20:
+            line_index[i] = []
+            continue
+        clean_lines = []
+        for line in page_text.split('\n'):
+            # 特征 A/B: 后面紧跟数字 (e.g., "第一章... 1")、包含大量虚线/点 (e.g., "......")
+            if _TOC_LINE_RE.search(line.strip()):
+                continue
+            clean_line = _NON_WORD_RE.sub("", line)
+            if clean_line:
+                clean_lines.append(clean_line)
+        line_index[i] = clean_lines
+    return line_index
+
+
+@timed("offset")
+def calibrate_offset(doc, toc_dict, text_store=None, max_anchors=3):
+    """
+    单次扫描的锚点校准：
+    1. 取目录中最靠前的 max_anchors 个条目作为锚点；
+    2. 把所有锚点的搜索窗口合并，每个候选页只提取、清洗一次，建立清洗后的行索引；
+    3. 在索引上逐个测试锚点，得到各自的 Offset。
+    最终 Offset 取第一个成功的锚点 (与原逻辑一致)，
+    置信度 = 与最终 Offset 一致的锚点数 / 可用锚点数。
+    返回 {"offset": int, "anchor": str|None, "confidence": float, "votes": {锚点标题: offset}}
+    """
+    result = {"offset": 0, "anchor": None, "confidence": 0.0, "votes": {}}
+    if not toc_dict: return result
+    if text_store is None: text_store = PageTextStore(doc)
     
     print("🔄 正在利用目录内容进行偏移量校准 (Anchor Calibration)...")
 
@@ -21,81 +290,330 @@ def calculate_global_offset(doc, toc_dict):
     for title, pages in toc_dict.items():
         start_page = pages[0]
         if start_page >= 1:
-            valid_entries.append((title, start_page))
+            # 清洗标题
+            clean_target = _NON_WORD_RE.sub("", title)
+            if len(clean_target) >= 2:
+                valid_entries.append((title, start_page, clean_target))
     
     valid_entries.sort(key=lambda x: x[1])
-    anchors = valid_entries[:3] # 取前3个
+    anchors = valid_entries[:max_anchors] # 取前3个
 
-    if not anchors: return 0
+    if not anchors: return result
 
-    # 2. 遍历锚点
-    for title, logic_page in anchors:
-        # 扩大搜索范围，但跳过极前部（防止匹配到封面/摘要）
-        # 假设 Offset 可能很大（比如前言有15页），所以往后多搜一点
-        search_start = max(0, logic_page - 5) 
-        search_end = min(doc.page_count, logic_page + 30)
+    # 2. 合并搜索窗口，单次扫描建立行索引
+    # 扩大搜索范围，但跳过极前部（防止匹配到封面/摘要）
+    # 假设 Offset 可能很大（比如前言有15页），所以往后多搜一点
+    windows = {title: range(max(0, logic_page - 5), min(doc.page_count, logic_page + 30))
+               for title, logic_page, _ in anchors}
+    candidate_pages = sorted(set().union(*[set(w) for w in windows.values()]))
+    line_index = _build_header_line_index(text_store, candidate_pages)
 
-        # 清洗标题
-        clean_target = re.sub(r"[^\u4e00-\u9fa5a-zA-Z0-9]", "", title)
-        if len(clean_target) < 2: continue
+    # 3. 在索引上测试所有锚点
+    votes = {}
+    for title, logic_page, clean_target in anchors:
+        for i in windows[title]:
+            if any(clean_target in line for line in line_index.get(i, [])):
+                offset = i - (logic_page - 1)
+                # 再次校验：Offset 通常 >= 0
+                if offset >= 0:
+                    votes[title] = offset
+                    break
+    result["votes"] = votes
 
-        for i in range(search_start, search_end):
-            try:
-                page = doc[i]
-                
-                # === 核心修改 1: 获取更详细的文本块 ===
-                # 我们不仅要看 text，还要看这一行长什么样
-                # 获取页面上部 40%
-                header_rect = fitz.Rect(0, 0, page.rect.width, page.rect.height * 0.4)
-                
-                # 获取 text 及其布局位置，按行分割
-                page_text = page.get_text("text", clip=header_rect)
-                lines = page_text.split('\n')
-                
-                is_real_header = False
-                
-                for line in lines:
-                    clean_line = re.sub(r"[^\u4e00-\u9fa5a-zA-Z0-9]", "", line)
-                    
-                    # 检查是否包含标题
-                    if clean_target in clean_line:
-                        # === 核心修改 2: 排除目录特征 ===
-                        # 特征 A: 后面紧跟数字 (e.g., "第一章... 1")
-                        # 特征 B: 包含大量虚线/点 (e.g., "......")
-                        
-                        # 检查原始 line 是否以数字结尾 (允许少量空格)
-                        if re.search(r'[\.\…\s]+\d+\s*$', line.strip()):
-                            # print(f"   [跳过] 第 {i+1} 页疑似目录项: {line.strip()}")
-                            continue 
-                        # 特征 C: 检查该页是不是明确写着“目录”
-                        # (如果页面最顶端写着“目录”，哪怕这行没有数字也跳过)
-                        if "目录" in page_text[:50] and i < 20: 
-                             continue
-                        # 通过所有检查，认为是正文标题
-                        is_real_header = True
-                        break
-                if is_real_header:
-                    # 计算偏移量
-                    offset = i - (logic_page - 1)
-                    
-                    # 再次校验：Offset 通常 >= 0
-                    if offset >= 0:
-                        print(f"✅ 校准成功！锚点: '{title}'")
-                        print(f"   - 目录页码: {logic_page}")
-                        print(f"   - 物理索引: {i} (第 {i+1} 页)")
-                        print(f"   - 修正 Offset: {offset}")
-                        return offset
-            except:
-                continue
+    for title, logic_page, _ in anchors:
+        if title in votes:
+            offset = votes[title]
+            agree = sum(1 for v in votes.values() if v == offset)
+            result.update(offset=offset, anchor=title, confidence=round(agree / len(anchors), 2))
+            print(f"✅ 校准成功！锚点: '{title}'")
+            print(f"   - 目录页码: {logic_page}")
+            print(f"   - 物理索引: {logic_page - 1 + offset} (第 {logic_page + offset} 页)")
+            print(f"   - 修正 Offset: {offset} (置信度 {result['confidence']:.2f}, 锚点投票: {votes})")
+            return result
 
     print("⚠️ 未能通过内容校准偏移量，默认 Offset = 0")
-    return 0
+    return result
+
+
+# ========================================================
+# 目录分析 (带磁盘缓存)
+# ========================================================
+@timed("outline")
+def parse_outline_to_dict(doc):
+    """
+    读取 PDF 内嵌书签 (doc.get_toc)，返回与 parse_toc_to_dict 相同结构的字典：
+    {"clean_title_string": [start_page, end_page], ...}
+    书签中的页码就是物理页码 (从 1 开始)，无需偏移量校准 (Offset = 0)。
+    结束页取下一个 同级或更高级 书签的起始页，最后一项为文档总页数。
+    """
+    try:
+        outline = doc.get_toc(simple=True)
+    except Exception:
+        return {}
+
+    entries = []
+    for level, title, page in outline:
+        compact_title = re.sub(r"\s+", "", title or "")
+        # 页码 <= 0 表示书签没有指向文档内的页面
+        if len(compact_title) > 1 and 1 <= page <= doc.page_count:
+            entries.append((level, compact_title, page))
+
+    toc_dict = {}
+    for i, (level, title, start_p) in enumerate(entries):
+        end_p = doc.page_count
+        for next_level, _, next_start_p in entries[i + 1:]:
+            if next_level <= level:
+                end_p = max(start_p, next_start_p)
+                break
+        # 重名书签保留第一个
+        if title not in toc_dict:
+            toc_dict[title] = [start_p, end_p]
+    return toc_dict
+
+
+def analyze_toc(src_doc, pdf_path=None, text_store=None, source="auto"):
+    """
+    对已打开的文档执行目录分析，结果按源文件内容哈希缓存到磁盘。
+    同一文件再次裁剪 / 更换关键词时直接读缓存，无需任何 PDF 文本提取。
+    source:
+      - "outline": 只读取内嵌书签 (物理页码，Offset = 0)
+      - "text": 文本目录解析 + 偏移量校准
+      - "auto": 书签优先，书签为空时使用文本目录
+    text_store: 可选的 PageTextStore，与全文扫描共用页面文本
+    返回 {"toc": toc_dict, "offset": int, "anchor": str|None, "confidence": float,
+          "page_count": int, "source": "outline"|"text"}
+    confidence 为偏移量置信度 (锚点一致率，书签为 1.0)，下游可据此决定是否信任 Offset
+    """
+    if source == "auto":
+        analysis = analyze_toc(src_doc, pdf_path, text_store, "outline")
+        if analysis["toc"]:
+            return analysis
+        return analyze_toc(src_doc, pdf_path, text_store, "text")
+
+    file_hash = None
+    if pdf_path:
+        try:
+            with cache_session():
+                file_hash = file_content_hash(pdf_path)
+                cached = load_toc_cache(file_hash, source)
+            if cached is not None:
+                if cached["toc"]:
+                    print(f"⚡ 命中目录缓存 ({source}, Offset={cached['offset']}, 锚点: {cached['anchor']})")
+                return cached
+        except Exception as e:
+            print(f"⚠️ 读取目录缓存失败: {e}")
+
+    if source == "outline":
+        toc_dict = parse_outline_to_dict(src_doc)
+        # 书签页码即物理页码，偏移量无需校准
+        offset, anchor, confidence = 0, None, 1.0
+        if toc_dict:
+            print(f"📑 读取内嵌书签: {len(toc_dict)} 个条目")
+    else:
+        print("正在解析目录结构...")
+        own_store = text_store is None
+        if own_store: text_store = PageTextStore(src_doc, file_hash)
+        try:
+            toc_dict = parse_toc_to_dict(src_doc, text_store=text_store)
+            calibration = calibrate_offset(src_doc, toc_dict, text_store)
+            offset, anchor, confidence = calibration["offset"], calibration["anchor"], calibration["confidence"]
+        finally:
+            if own_store: text_store.close()
+    analysis = {"toc": toc_dict, "offset": offset, "anchor": anchor, "confidence": confidence,
+                "page_count": src_doc.page_count, "source": source}
+
+    if file_hash:
+        try:
+            save_toc_cache(file_hash, toc_dict, offset, anchor, src_doc.page_count, source, confidence)
+        except Exception as e:
+            print(f"⚠️ 写入目录缓存失败: {e}")
+    return analysis
+
+
+def get_toc_analysis(pdf_path):
+    """
+    按文件路径获取目录分析结果 (供手动裁剪修复使用)，书签优先。
+    缓存命中时完全不打开 PDF；未命中才打开文档解析一次。失败返回 None。
+    """
+    try:
+        with cache_session():
+            file_hash = file_content_hash(pdf_path)
+            cached_outline = load_toc_cache(file_hash, "outline")
+            if cached_outline is not None and cached_outline["toc"]:
+                return cached_outline
+            cached_text = load_toc_cache(file_hash, "text")
+        if cached_outline is not None and cached_text is not None:
+            return cached_text
+    except Exception as e:
+        print(f"⚠️ 读取目录缓存失败: {e}")
+
+    src_doc = open_pdf_auto_repair(pdf_path)
+    if not src_doc: return None
+    try:
+        return analyze_toc(src_doc, pdf_path)
+    finally:
+        src_doc.close()
+
+
+# ========================================================
+# 无目录时的兜底：按字号 / 加粗识别章节标题
+# ========================================================
+HEADING_SAMPLE_PAGES = 10     # 估计正文字号时抽样的页数
+HEADING_SIZE_RATIO = 1.15     # 字号至少比正文大 15% 才算标题
+HEADING_MARGIN_RATIO = 0.06   # 页面上下 6% 视为页眉页脚，不参与识别
+_HEADING_NUMBER_RE = re.compile(r"^(?:第[一二三四五六七八九十\d]+[章节部分]|[一二三四五六七八九十]+[、.．]|\d+(?:\.\d+)*[、.．\s])")
+_BOLD_FONT_HINTS = ("bold", "black", "heavy", "hei", "黑")
+
+
+def _is_bold_span(span):
+    """加粗：字体标志位 (bit 4) 或黑体类字体名"""
+    return bool(span.get("flags", 0) & 16) or any(h in span.get("font", "").lower() for h in _BOLD_FONT_HINTS)
+
+
+def _heading_scanner(src_doc, text_store=None):
+    """
+    返回 find(keyword) -> (start_idx, end_idx, heading) 或 None：在没有书签和文本目录的文档中，
+    用 get_text("dict") 的字号与加粗标记识别章节标题，合成章节区间。
+    - 正文字号从少量抽样页估计 (按字符数加权的众数)；
+    - 先用页面纯文本 (PageTextStore 缓存) 筛出包含关键词的页，只对这些页解析字号；
+    - 找到目标标题后向后逐页解析，遇到同级或更高级标题即停止，不扫描整份文档。
+    同一文档解析过的页会缓存，多个关键词共用。
+    """
+    page_count = src_doc.page_count
+    page_headings = {}
+    body = {}
+
+    def page_text(page_index):
+        return text_store.text(page_index) if text_store else src_doc[page_index].get_text()
+
+    def page_lines(page_index):
+        page = src_doc[page_index]
+        with timed_phase("get_text"):
+            blocks = page.get_text("dict")["blocks"]
+        top, bottom = page.rect.height * HEADING_MARGIN_RATIO, page.rect.height * (1 - HEADING_MARGIN_RATIO)
+        lines = []
+        for block in blocks:
+            for line in block.get("lines", []):
+                spans = [sp for sp in line["spans"] if sp["text"].strip()]
+                if spans and top <= line["bbox"][1] and line["bbox"][3] <= bottom:
+                    lines.append({"spans": spans, "text": "".join(sp["text"] for sp in spans).strip()})
+        return lines
+
+    def body_size():
+        if "size" not in body:
+            step = max(1, page_count // HEADING_SAMPLE_PAGES)
+            weights = {}
+            for page_index in range(0, page_count, step):
+                for line in page_lines(page_index):
+                    for span in line["spans"]:
+                        size = round(span["size"], 1)
+                        weights[size] = weights.get(size, 0) + len(span["text"].strip())
+            body["size"] = max(weights.items(), key=lambda x: x[1])[0] if weights else 0.0
+        return body["size"]
+
+    def headings(page_index):
+        """页面上的标题行 [(标题, 字号, 是否加粗), ...]"""
+        if page_index not in page_headings:
+            size_threshold = body_size() * HEADING_SIZE_RATIO
+            found = []
+            for line in page_lines(page_index):
+                text = line["text"]
+                compact = re.sub(r"\s+", "", text)
+                if not (2 <= len(compact) <= 40) or _TOC_LINE_RE.search(text):
+                    continue
+                size = max(sp["size"] for sp in line["spans"])
+                bold = all(_is_bold_span(sp) for sp in line["spans"])
+                if size >= size_threshold or (bold and size >= body_size() and _HEADING_NUMBER_RE.match(compact)):
+                    found.append((compact, round(size, 1), bold))
+            page_headings[page_index] = found
+        return page_headings[page_index]
+
+    def find(keyword):
+        clean_keyword = _NON_WORD_RE.sub("", keyword) or keyword
+        for page_index in range(page_count):
+            if clean_keyword not in _NON_WORD_RE.sub("", page_text(page_index)):
+                continue
+            for pos, (title, size, bold) in enumerate(headings(page_index)):
+                if clean_keyword not in _NON_WORD_RE.sub("", title):
+                    continue
+                # 向后找第一个同级或更高级的标题 (字号更大，或字号相同且加粗程度不低于目标)
+                def is_boundary(heading):
+                    return heading[1] > size + 0.5 or (abs(heading[1] - size) <= 0.5 and heading[2] >= bold)
+                if any(is_boundary(h) for h in headings(page_index)[pos + 1:]):
+                    return page_index, page_index, title
+                for next_index in range(page_index + 1, page_count):
+                    if any(is_boundary(h) for h in headings(next_index)):
+                        return page_index, next_index, title
+                return page_index, page_count - 1, title
+        return None
+
+    return find
+
+
+def _section_locator(src_doc, pdf_path=None, text_store=None):
+    """
+    返回 locate(keyword, details=None) -> (start_idx, end_idx, matched_title) 或 None。
+    书签优先：先在内嵌书签中匹配 (无需偏移量校准)；书签缺失或未匹配到时，
+    才回退到 parse_toc_to_dict + calculate_global_offset；两者都没有目录时，按字号识别正文中的章节标题。
+    同一文档的各种分析各只做一次。
+    传入 details 字典时，定位成功后写入 {"score": 匹配分, "source": "outline"/"text"/"headings", "offset": 偏移量}。
+    """
+    analyses = {}
+
+    def get_analysis(source):
+        if source not in analyses:
+            analysis = analyze_toc(src_doc, pdf_path, text_store, source)
+            # 标题特征只预处理一次，供该文档的所有关键词复用
+            analysis["prepared"] = prepare_toc_titles(analysis["toc"])
+            analyses[source] = analysis
+        return analyses[source]
+
+    def describe(details, analysis, keyword, source, offset):
+        if details is None:
+            return
+        best = match_sections_batch(analysis["toc"], [keyword], top_k=1, prepared=analysis["prepared"])[keyword]
+        details.update(score=best[0]["score"] if best else None, source=source, offset=offset)
+
+    def locate(keyword, details=None):
+        outline = get_analysis("outline")
+        if outline["toc"]:
+            section = _resolve_section_pages(src_doc.page_count, outline["toc"], 0, keyword, outline["prepared"])
+            if section is not None:
+                describe(details, outline, keyword, "outline", 0)
+                return section
+            print("⚠️ 书签中未找到匹配章节，回退到文本目录解析...")
+
+        analysis = get_analysis("text")
+        print(f"📄 文档总页数: {src_doc.page_count}, 计算偏移量 Offset = {analysis['offset']} "
+              f"(置信度 {analysis['confidence']:.2f})")
+        if not analysis["toc"]:
+            print("⚠️ 书签与文本目录均解析失败，按字号识别章节标题...")
+            if "headings" not in analyses:
+                analyses["headings"] = _heading_scanner(src_doc, text_store)
+            section = analyses["headings"](keyword)
+            if section is None:
+                print("❌ 未找到匹配的章节标题")
+                return None
+            start_idx, end_idx, title = section
+            print(f"✅ 执行裁剪: {title} (字号识别)")
+            print(f"   物理索引: {start_idx} -> {end_idx}")
+            if details is not None:
+                details.update(score=None, source="headings", offset=None)
+            return section
+        section = _resolve_section_pages(src_doc.page_count, analysis["toc"], analysis["offset"], keyword,
+                                         analysis["prepared"])
+        if section is not None:
+            describe(details, analysis, keyword, "text", analysis["offset"])
+        return section
+
+    return locate
 
 
 # ========================================================
 # 解析目录生成字典
 # ========================================================
-def parse_toc_to_dict(doc, max_scan_pages=20):
+@timed("parse_toc")
+def parse_toc_to_dict(doc, max_scan_pages=20, text_store=None):
     """
     解析PDF目录，返回结构化字典：
     {
@@ -105,11 +623,12 @@ def parse_toc_to_dict(doc, max_scan_pages=20):
     """
     toc_list = [] # 临时存储 [(title, page), ...]
     full_toc_text = ""
+    if text_store is None: text_store = PageTextStore(doc)
 
     # --- A. 提取前N页文本 ---
     for i in range(min(max_scan_pages, doc.page_count)):
         try:
-            page_text = doc[i].get_text()
+            page_text = text_store.text(i)
             if page_text:
                 full_toc_text += page_text + "\n"
         except:
@@ -117,7 +636,7 @@ def parse_toc_to_dict(doc, max_scan_pages=20):
 
     # --- B. 清洗文本 (关键步骤) ---
     # 1. 去除目录中的虚线/点 (如 "......")
-    clean_text = re.sub(r"[…\.．]{2,}", " ", full_toc_text)
+    clean_text = re.sub(r"[…⋯·\.．]{2,}", " ", full_toc_text)
     # 2. 尝试修复换行 (有些标题被断成两行，通常下一行是页码)
     # 这一步比较激进，根据实际情况微调
     # clean_text = re.sub(r'\n\s*(\d+)', r' \1', clean_text) 
@@ -174,78 +693,136 @@ def parse_toc_to_dict(doc, max_scan_pages=20):
 # ========================================================
 # 匹配逻辑：在字典中查表
 # ========================================================
-def match_section_from_dict(toc_dict, keyword, threshold=0.4, min_pages=1):
+_TITLE_PREFIX_RE = re.compile(r"^[第\d一二三四五六七八九十\(\)（）\.、\s]+")
+
+
+def _char_ngrams(text, n=2):
+    """字符 n-gram 集合 (文本短于 n 时退化为单字集合)"""
+    if len(text) < n:
+        return set(text)
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def prepare_toc_titles(toc_dict):
+    """
+    预处理目录标题 (每个目录只做一次)：去序号、去符号，并预先计算字符 bigram。
+    返回 [{"title", "start", "end", "len", "clean", "ngrams"}, ...]
+    """
+    prepared = []
+    for title, pages in toc_dict.items():
+        start_page, end_page = pages
+        # 清洗标题 (去掉 "六、", "(一)", "1." 等序号)
+        # 这一步很重要，否则 "(三) 子项目" 的纯度会比 "子项目" 低
+        clean_title_full = _TITLE_PREFIX_RE.sub("", title)
+        # 再次清洗，去掉中间空格
+        clean_title = _NON_WORD_RE.sub("", clean_title_full)
+        prepared.append({
+            "title": title,
+            "start": start_page,
+            "end": end_page,
+            "len": end_page - start_page,
+            "clean": clean_title,
+            "ngrams": _char_ngrams(clean_title),
+        })
+    return prepared
+
+
+def _title_similarity(clean_keyword, keyword_ngrams, item, similarity):
+    """基础相似度：sequence = difflib.SequenceMatcher；ngram = 字符 bigram 的 Dice 系数 (更快)"""
+    if similarity == "ngram":
+        if not keyword_ngrams or not item["ngrams"]:
+            return 0.0
+        overlap = len(keyword_ngrams & item["ngrams"])
+        return 2.0 * overlap / (len(keyword_ngrams) + len(item["ngrams"]))
+    return difflib.SequenceMatcher(None, clean_keyword, item["clean"]).ratio()
+
+
+@timed("match")
+def match_sections_batch(toc_dict, keywords, threshold=0.4, min_pages=1, top_k=5,
+                         similarity="sequence", prepared=None):
+    """
+    批量匹配：同一个目录对多个关键词一次性打分，标题只清洗一次。
+    - similarity: "sequence" (默认，与 match_section_from_dict 一致) 或 "ngram" (字符 bigram 重叠，更快)
+    - prepared: 可传入 prepare_toc_titles 的结果，在多次调用间复用
+    返回 {keyword: [候选, ...]}，候选按得分降序，最多 top_k 个 (None 表示全部)，
+    候选结构 {"title", "start", "end", "score", "purity", "len"}
+    """
+    if prepared is None:
+        prepared = prepare_toc_titles(toc_dict) if toc_dict else []
+    # === 过滤条件 1: 页数检查 ===
+    items = [item for item in prepared if item["len"] >= min_pages]
+
+    results = {}
+    for keyword in keywords:
+        clean_keyword = _NON_WORD_RE.sub("", keyword)
+        if not clean_keyword: clean_keyword = keyword
+        keyword_ngrams = _char_ngrams(clean_keyword) if similarity == "ngram" else None
+
+        candidates = []
+        for item in items:
+            clean_title = item["clean"]
+            contains = clean_keyword in clean_title
+
+            # === 评分逻辑 ===
+            # 1. 基础相似度 (Fuzzy Match)
+            if contains:
+                base_score = 1.0
+            else:
+                base_score = _title_similarity(clean_keyword, keyword_ngrams, item, similarity)
+
+            # 2. 标题纯度 (Purity) - 解决父子包含问题的核心！
+            # 纯度 = 关键词长度 / 标题长度
+            # 例子：
+            # 关键词="子项目" (3字)
+            # 标题A="建设内容与子项目" (8字) -> 纯度 0.375
+            # 标题B="子项目" (3字) -> 纯度 1.0
+            # 结果：标题B胜出
+            if len(clean_title) > 0:
+                purity_score = len(clean_keyword) / len(clean_title)
+                # 防止关键词比标题长导致的 >1
+                purity_score = min(1.0, purity_score)
+            else:
+                purity_score = 0
+
+            # 3. 综合得分 (加权)
+            # 相似度占 60%，纯度占 40% (纯度权重越高，越倾向于短标题)
+            final_score = base_score * 0.6 + purity_score * 0.4
+            
+            # 如果包含关键词，给予额外奖励，确保它比单纯的模糊匹配高
+            if contains:
+                final_score += 0.2
+
+            if final_score >= threshold:
+                candidates.append({
+                    "title": item["title"],
+                    "start": item["start"],
+                    "end": item["end"],
+                    "score": final_score,
+                    "purity": purity_score,
+                    "len": item["len"]
+                })
+
+        # === 排序选优 === (按分数降序排列；稳定排序，同分保留目录顺序)
+        candidates.sort(key=lambda x: x["score"], reverse=True)
+        results[keyword] = candidates if top_k is None else candidates[:top_k]
+    return results
+
+
+def match_section_from_dict(toc_dict, keyword, threshold=0.4, min_pages=1, similarity="sequence", prepared=None):
     """
     在目录字典中寻找最匹配 keyword 的条目 (增强版)
     改进点：
     1. 引入"标题纯度"：优先匹配"字数更少、更精准"的标题，解决父子标题包含问题。
     2. 引入"页数过滤"：过滤掉页数为0或过短的无效章节。
+    评分逻辑见 match_sections_batch；需要候选列表时请直接调用它。
     """
     if not toc_dict:
         return None, None, None
 
-    candidates = []
-    clean_keyword = re.sub(r"[^\u4e00-\u9fa5a-zA-Z0-9]", "", keyword)
-    if not clean_keyword: clean_keyword = keyword
-
-    for title, pages in toc_dict.items():
-        start_page, end_page = pages
-        page_len = end_page - start_page
-        
-        # === 过滤条件 1: 页数检查 ===
-        if page_len < min_pages:
-            continue
-
-        # 清洗标题 (去掉 "六、", "(一)", "1." 等序号)
-        # 这一步很重要，否则 "(三) 子项目" 的纯度会比 "子项目" 低
-        clean_title_full = re.sub(r"^[第\d一二三四五六七八九十\(\)（）\.、\s]+", "", title)
-        # 再次清洗，去掉中间空格
-        clean_title = re.sub(r"[^\u4e00-\u9fa5a-zA-Z0-9]", "", clean_title_full)
+    candidates = match_sections_batch(toc_dict, [keyword], threshold, min_pages, top_k=2,
+                                      similarity=similarity, prepared=prepared)[keyword]
 
-        # === 评分逻辑 ===
-        # 1. 基础相似度 (Fuzzy Match)
-        if clean_keyword in clean_title:
-            base_score = 1.0
-        else:
-            base_score = difflib.SequenceMatcher(None, clean_keyword, clean_title).ratio()
-
-        # 2. 标题纯度 (Purity) - 解决父子包含问题的核心！
-        # 纯度 = 关键词长度 / 标题长度
-        # 例子：
-        # 关键词="子项目" (3字)
-        # 标题A="建设内容与子项目" (8字) -> 纯度 0.375
-        # 标题B="子项目" (3字) -> 纯度 1.0
-        # 结果：标题B胜出
-        if len(clean_title) > 0:
-            purity_score = len(clean_keyword) / len(clean_title)
-            # 防止关键词比标题长导致的 >1
-            purity_score = min(1.0, purity_score)
-        else:
-            purity_score = 0
-
-        # 3. 综合得分 (加权)
-        # 相似度占 60%，纯度占 40% (纯度权重越高，越倾向于短标题)
-        final_score = base_score * 0.6 + purity_score * 0.4
-        
-        # 如果包含关键词，给予额外奖励，确保它比单纯的模糊匹配高
-        if clean_keyword in clean_title:
-            final_score += 0.2
-
-        if final_score >= threshold:
-            candidates.append({
-                "title": title,
-                "start": start_page,
-                "end": end_page,
-                "score": final_score,
-                "purity": purity_score,
-                "len": page_len
-            })
-
-    # === 排序选优 ===
     if candidates:
-        # 按分数降序排列
-        candidates.sort(key=lambda x: x["score"], reverse=True)
-        
         best = candidates[0]
         print(f"🔍 搜索: '{keyword}'")
         print(f"   🏆 最佳命中: '{best['title']}' (分: {best['score']:.2f}, 纯度: {best['purity']:.2f}, 页数: {best['len']})")
@@ -262,59 +839,656 @@ def match_section_from_dict(toc_dict, keyword, threshold=0.4, min_pages=1):
 # ========================================================
 # 裁剪函数
 # ========================================================
-def extract_section_to_pdf(pdf_path, output_path, section_keyword="问题"):
-    src_doc = None
-    out_doc = None
+def _compile_keyword_pattern(keyword_pattern_str):
+    """编译关键词正则；如果用户输入的不是合法正则，转为普通包含匹配"""
     try:
-        src_doc = fitz.open(pdf_path)
-       
-        # 2. 解析目录
-        print("正在解析目录结构...")
-        toc_dict = parse_toc_to_dict(src_doc)
-        
-        offset = calculate_global_offset(src_doc, toc_dict)
-        print(f"📄 文档总页数: {src_doc.page_count}, 计算偏移量 Offset = {offset}")
-        
-        if not toc_dict:
-            print("⚠️ 文本目录解析失败，尝试使用书签...")
-            return False
+        return re.compile(keyword_pattern_str)
+    except:
+        return re.compile(re.escape(keyword_pattern_str))
 
-        # 3. 匹配区间 (得到的是目录上的逻辑页码，例如 5 -> 8)
-        start_logic, end_logic, matched_title = match_section_from_dict(toc_dict, section_keyword)
-        
-        if start_logic is None:
-            print("❌ 未找到匹配章节")
-            return False
-        
-        start_idx = start_logic + offset - 1
+
+def _resolve_section_pages(page_count, toc_dict, offset, section_keyword, prepared=None):
+    """
+    根据目录字典与偏移量，计算章节的物理页码区间 (0-based，闭区间)。
+    prepared: 可选的 prepare_toc_titles 结果，同一目录匹配多个关键词时复用
+    返回 (start_idx, end_idx, matched_title)，失败返回 None。
+    """
+    # 3. 匹配区间 (得到的是目录上的逻辑页码，例如 5 -> 8)
+    start_logic, end_logic, matched_title = match_section_from_dict(toc_dict, section_keyword, prepared=prepared)
+    
+    if start_logic is None:
+        print("❌ 未找到匹配章节")
+        return None
+    
+    start_idx = start_logic + offset - 1
+    
+    # 处理最后一章的情况 (end_logic 为 99999)
+    if end_logic > 90000:
+        end_idx = page_count - 1 # 直到文档末尾
+    else:
+        end_idx = end_logic + offset - 1
+    # 5. 边界修正
+    if start_idx < 0: start_idx = 0
+    if start_idx >= page_count: 
+        print("❌ 计算出的起始页超出文档范围")
+        return None
         
-        # 处理最后一章的情况 (end_logic 为 99999)
-        if end_logic > 90000:
-            end_idx = src_doc.page_count - 1 # 直到文档末尾
+    if end_idx >= page_count: end_idx = page_count - 1
+    
+    # 关键修正：如果算出来的 end_idx 比 start_idx 还小（目录页码标错了），强制取一页
+    if end_idx < start_idx: 
+        # 尝试往后多取几页，比如默认提取 3 页
+        print("⚠️ 结束页码异常，默认提取 3 页")
+        end_idx = min(start_idx + 2, page_count - 1)
+
+    print(f"✅ 执行裁剪: {matched_title}")
+    print(f"   逻辑页码: {start_logic} -> {end_logic}")
+    print(f"   物理索引: {start_idx} -> {end_idx} (Offset={offset})")
+    return start_idx, end_idx, matched_title
+
+
+def _pages_to_ranges(page_indices):
+    """将页索引列表合并为连续区间 [(from, to), ...] (闭区间)"""
+    ranges = []
+    for p_idx in page_indices:
+        if ranges and p_idx == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], p_idx)
         else:
-            end_idx = end_logic + offset - 1
-        # 5. 边界修正
-        if start_idx < 0: start_idx = 0
-        if start_idx >= src_doc.page_count: 
-            print("❌ 计算出的起始页超出文档范围")
-            return False
-            
-        if end_idx >= src_doc.page_count: end_idx = src_doc.page_count - 1
-        
-        # 关键修正：如果算出来的 end_idx 比 start_idx 还小（目录页码标错了），强制取一页
-        if end_idx < start_idx: 
-            # 尝试往后多取几页，比如默认提取 3 页
-            print("⚠️ 结束页码异常，默认提取 3 页")
-            end_idx = min(start_idx + 2, src_doc.page_count - 1)
+            ranges.append((p_idx, p_idx))
+    return ranges
 
-        print(f"✅ 执行裁剪: {matched_title}")
-        print(f"   逻辑页码: {start_logic} -> {end_logic}")
-        print(f"   物理索引: {start_idx} -> {end_idx} (Offset={offset})")
 
-        out_doc = fitz.open()
-        # insert_pdf 的 to_page 是包含在内的，所以不需要 -1
-        out_doc.insert_pdf(src_doc, from_page=start_idx, to_page=end_idx)
-        out_doc.save(output_path)
+# ========================================================
+# 输出配置 (裁剪结果的体积优化)
+# ========================================================
+# 裁剪结果会逐个上传到 Coze，体积直接决定上传耗时
+OUTPUT_PROFILES = {
+    # 原样保存 (与旧版本一致)
+    "original": {},
+    # 无损压缩：清理无用对象 + 压缩数据流 + 字体子集化
+    "compact": {"garbage": 3, "deflate": True, "subset_fonts": True},
+    # 无损压缩 + 图片降采样到 100 DPI (JPEG)
+    "downsample": {"garbage": 3, "deflate": True, "subset_fonts": True, "image_dpi": 100},
+    # 无损压缩 + 删除全部图片 (只需要表格/文字的章节，如土地利用现状表)
+    "strip_images": {"garbage": 4, "deflate": True, "subset_fonts": True, "strip_images": True},
+}
+# 允许删除图片的任务 (只需要文字 / 表格)；其余章节 (如 空间布局 的规划图) 即使选了 strip_images 也只做无损压缩
+STRIP_IMAGES_TASKS = {"LandUse", "issue", "potential", "project"}
+
+
+def _output_task_suffix(output_path):
+    """从输出文件名中取任务后缀：xxx_issue.pdf / xxx_issue_manual.pdf (手动裁剪) -> issue"""
+    stem = os.path.splitext(os.path.basename(output_path))[0]
+    if stem.endswith("_manual"):
+        stem = stem[:-len("_manual")]
+    return stem.rsplit("_", 1)[-1] if "_" in stem else ""
+
+
+def _effective_output_profile(output_profile, output_path):
+    """strip_images 只作用于 STRIP_IMAGES_TASKS 中的章节，其余章节退回 compact"""
+    if output_profile == "strip_images" and _output_task_suffix(output_path) not in STRIP_IMAGES_TASKS:
+        return "compact"
+    return output_profile
+
+
+def _optimize_output_doc(out_doc, profile):
+    """按输出配置处理文档中的图片与字体 (保存参数在 _save_page_ranges 中处理)"""
+    if profile.get("strip_images"):
+        for page in out_doc:
+            for img in page.get_images(full=True):
+                try:
+                    page.delete_image(img[0])
+                except Exception:
+                    pass
+    elif profile.get("image_dpi") and hasattr(out_doc, "rewrite_images"):
+        try:
+            out_doc.rewrite_images(dpi_threshold=profile["image_dpi"] + 10,
+                                   dpi_target=profile["image_dpi"], quality=75)
+        except Exception as e:
+            print(f"⚠️ 图片降采样失败: {e}")
+    if profile.get("subset_fonts"):
+        try:
+            out_doc.subset_fonts()
+        except Exception as e:
+            print(f"⚠️ 字体子集化失败: {e}")
+
+
+def _estimate_original_size(src_doc, page_ranges):
+    """
+    按页数占比估算原样保存的字节数 (源文件大小 x 裁剪页数 / 总页数)。
+    不为统计体积再完整序列化一遍文档；源文档不在磁盘上时返回 None。
+    """
+    try:
+        src_size = os.path.getsize(src_doc.name)
+    except (OSError, TypeError):
+        return None
+    page_count = sum(to_page - from_page + 1 for from_page, to_page in page_ranges)
+    return int(src_size * page_count / max(1, src_doc.page_count))
+
+
+def _save_page_ranges(src_doc, page_ranges, output_path, output_profile=None):
+    """
+    把若干页码区间 (闭区间) 写入新的 PDF 文件。
+    output_profile: OUTPUT_PROFILES 中的配置名，None / "original" 为原样保存；
+                    strip_images 只对 STRIP_IMAGES_TASKS 中的章节生效。
+    优化时记录 优化前 (按源文件页数占比估算) / 优化后 的字节数。
+    返回 (original_size, optimized_size)，original_size 无法估算时为 None
+    """
+    output_profile = _effective_output_profile(output_profile, output_path)
+    profile = OUTPUT_PROFILES.get(output_profile or "original", {})
+    out_doc = fitz.open()
+    try:
+        for from_page, to_page in page_ranges:
+            # insert_pdf 的 to_page 是包含在内的，所以不需要 -1
+            with timed_phase("insert_pdf"):
+                out_doc.insert_pdf(src_doc, from_page=from_page, to_page=to_page)
+        if not profile:
+            with timed_phase("save"):
+                out_doc.save(output_path)
+            original_size = optimized_size = os.path.getsize(output_path)
+        else:
+            original_size = _estimate_original_size(src_doc, page_ranges)
+            with timed_phase("optimize"):
+                _optimize_output_doc(out_doc, profile)
+            with timed_phase("save"):
+                out_doc.save(output_path, garbage=profile.get("garbage", 0),
+                             deflate=profile.get("deflate", False), clean=True)
+            optimized_size = os.path.getsize(output_path)
+            if original_size:
+                print(f"📦 {os.path.basename(output_path)}: 约 {original_size / 1024:.1f} KB -> "
+                      f"{optimized_size / 1024:.1f} KB ({output_profile})")
+    finally:
+        out_doc.close()
+    record_output_size(output_path, output_profile or "original", original_size, optimized_size)
+    return original_size, optimized_size
+
+
+# ========================================================
+# 文本层导出 (与裁剪 PDF 同名的 .text.json)
+# ========================================================
+TEXT_EXPORT_EXT = ".text.json"
+
+
+def text_export_path(output_path):
+    """裁剪 PDF 对应的文本层文件路径：xxx_issue.pdf -> xxx_issue.text.json"""
+    return os.path.splitext(output_path)[0] + TEXT_EXPORT_EXT
+
+
+@timed("text_export")
+def _export_text_layer(src_doc, pdf_path, page_ranges, output_path, text_store=None):
+    """
+    在裁剪的同一次遍历中导出文本层：逐页记录文本与表格单元格 (页码为源文件物理页码，从 1 开始)。
+    体积远小于 PDF，可直接哈希比对，也可替代 PDF 发送给工作流或本地解析。
+    """
+    pages = []
+    for from_page, to_page in page_ranges:
+        for page_index in range(from_page, to_page + 1):
+            page = src_doc[page_index]
+            text = text_store.text(page_index) if text_store else page.get_text()
+            tables = []
+            try:
+                with timed_phase("find_tables"):
+                    found_tables = page.find_tables().tables
+                for table in found_tables:
+                    tables.append([[cell if cell is not None else "" for cell in row] for row in table.extract()])
+            except Exception as e:
+                print(f"⚠️ 第 {page_index + 1} 页表格提取失败: {e}")
+            pages.append({"page": page_index + 1, "text": text.strip(), "tables": tables})
+
+    export = {
+        "source": os.path.basename(pdf_path),
+        "page_ranges": [[a + 1, b + 1] for a, b in page_ranges],
+        "pages": pages,
+    }
+    export_path = text_export_path(output_path)
+    tmp_path = export_path + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(export, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, export_path)
+    print(f"📝 已导出文本层: {os.path.basename(export_path)} ({os.path.getsize(export_path) / 1024:.1f} KB)")
+
+
+def load_text_export(output_path):
+    """读取裁剪结果的文本层，不存在时返回 None"""
+    export_path = text_export_path(output_path)
+    if not os.path.exists(export_path):
+        return None
+    with open(export_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _emit_crop(src_doc, pdf_path, page_ranges, output_path, virtual=False, output_profile=None,
+               export_text=False, text_store=None):
+    """
+    输出一个裁剪结果。
+    - virtual=False: 立即写出 PDF (并清除同名的旧清单)；
+    - virtual=True: 只记录裁剪清单 (源文件哈希、页码区间、任务后缀、地区名)，
+                    PDF 在步骤 2 上传或用户下载时才通过 materialize_crop 生成。
+    - export_text=True: 同时导出文本层 (复用已打开的文档与页面文本缓存)，虚拟裁剪也会导出。
+    """
+    if export_text:
+        try:
+            _export_text_layer(src_doc, pdf_path, page_ranges, output_path, text_store)
+        except Exception as e:
+            print(f"⚠️ 文本层导出失败: {e}")
+    if not virtual:
+        _save_page_ranges(src_doc, page_ranges, output_path, output_profile)
+        delete_crop_manifest(output_path)
+        return
+
+    out_name = os.path.basename(output_path)
+    task_suffix = _output_task_suffix(output_path)
+    # 与结果文件合并时一致：按别名规则标准化后的地区名 (utils_region 依赖本模块，在此处导入)
+    from utils.utils_region import normalize_region
+    region = normalize_region(out_name)["文件名"]
+    save_crop_manifest(output_path, pdf_path, file_content_hash(pdf_path), page_ranges, task_suffix, region)
+    # 删除旧的实体文件，避免与新清单不一致
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    print(f"🗂️ 已记录裁剪清单: {out_name} {page_ranges}")
+
+
+@tracked_document("materialize")
+def materialize_crop(output_path, output_profile=None):
+    """
+    按裁剪清单生成实际的 PDF 文件 (output_profile 见 OUTPUT_PROFILES)。文件已存在时直接返回 True。
+    源文件缺失或内容已变化 (哈希不一致) 时返回 False。
+    """
+    if os.path.exists(output_path):
+        return True
+    entry = load_crop_manifest(output_path)
+    if entry is None:
+        return False
+    source_path = entry["source_path"]
+    if not os.path.exists(source_path) or file_content_hash(source_path) != entry["source_hash"]:
+        print(f"❌ 源文件缺失或已变化，无法生成: {os.path.basename(output_path)}")
+        return False
+
+    src_doc = open_pdf_auto_repair(source_path)
+    if not src_doc:
+        return False
+    set_document_pages(src_doc.page_count)
+    try:
+        _save_page_ranges(src_doc, entry["page_ranges"], output_path, output_profile)
+        return True
+    except Exception as e:
+        print(f"❌ 生成裁剪文件失败: {e}")
+        return False
+    finally:
+        src_doc.close()
+
+
+def list_virtual_crops(crop_dir):
+    """列出目录下尚未生成实体文件的裁剪清单 {文件名: 清单}"""
+    return {os.path.basename(e["output_path"]): e
+            for e in list_crop_manifest(crop_dir) if not os.path.exists(e["output_path"])}
+
+
+def delete_crop_output(output_path):
+    """删除裁剪结果：实体文件、文本层与裁剪清单一并删除"""
+    for path in (output_path, text_export_path(output_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    delete_crop_manifest(output_path)
+
+
+# ========================================================
+# 有界内存模式 (超大 PDF / 大量扫描附图)
+# ========================================================
+MEMORY_WINDOW_PAGES = 50     # 每处理多少页释放一次 MuPDF 缓存
+REOPEN_EVERY_WINDOWS = 4     # 每隔多少个窗口重新打开一次文档
+LARGE_DOC_PAGES = 300        # 超过此页数的文档自动启用有界内存模式
+WORKER_RECYCLE_TASKS = 10    # 设置内存上限时，每个工作进程处理多少个文件后重启
+
+
+class MemoryLimitExceeded(MemoryError):
+    """处理单个文件时新增的常驻内存超过上限"""
+
+
+def current_rss_mb():
+    """当前进程常驻内存 (MB)；无法获取时返回 None (仅 Linux 可读 /proc)"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except Exception:
+        return None
+
+
+class BoundedPageWindow:
+    """
+    按窗口遍历文档页面，限制单个文件占用的内存：
+    - 每 window_pages 页：写出页面文本缓存、清空 MuPDF 资源缓存 (图片/字体/显示列表)、回收 Python 对象；
+    - 开始遍历时通过 reopen() 打开自己的文档句柄，所有读取 (文本缓存、表格检测) 都走这个句柄；
+      每 REOPEN_EVERY_WINDOWS 个窗口关闭它并重新打开，释放文档级的内部缓存；
+    - 设置 rss_limit_mb 时，释放缓存后常驻内存比开始遍历时增长超过上限则抛出 MemoryLimitExceeded，
+      只让这一个文件失败，避免拖垮共享的 Streamlit 服务器。按增量计算：单进程裁剪时在 Streamlit 进程内运行，
+      服务器本身已占用的内存 (各类缓存、其他会话) 不计入这个文件。
+    reopen 为空时不重新打开 (例如调用方只持有内存中的文档)。
+    """
+
+    def __init__(self, doc, reopen=None, window_pages=MEMORY_WINDOW_PAGES, rss_limit_mb=None, text_store=None):
+        self.doc = doc
+        self.reopen = reopen
+        self.window_pages = max(1, window_pages)
+        self.rss_limit_mb = rss_limit_mb
+        self.text_store = text_store
+        self._windows = 0
+        self._baseline_rss = None   # 开始遍历时的常驻内存，上限按相对它的增量判断
+        self._orig_doc = doc
+        self._owned_doc = None   # 本对象重新打开的文档，由本对象负责关闭
+
+    def _release(self):
+        if self.text_store is not None:
+            try:
+                self.text_store.flush()
+            except Exception as e:
+                # 文本缓存只是优化，写入失败 (磁盘已满等) 不影响裁剪
+                print(f"⚠️ 页面文本缓存写入失败: {e}")
+        try:
+            fitz.TOOLS.store_shrink(100)
+        except Exception:
+            pass
+        gc.collect()
+
+    def _reopen(self):
+        """打开新的文档句柄并切换过去，关闭之前做读取的句柄 (调用方的原始文档不在这里关闭)"""
+        new_doc = self.reopen()
+        if new_doc is None:
+            return
+        if self._owned_doc is not None:
+            self._owned_doc.close()
+        self.doc = self._owned_doc = new_doc
+        if self.text_store is not None:
+            self.text_store.doc = new_doc
+
+    def _next_window(self, page_index):
+        self._windows += 1
+        self._release()
+        if self.reopen and self._windows % REOPEN_EVERY_WINDOWS == 0:
+            self._reopen()
+            self._release()
+        if self.rss_limit_mb and self._baseline_rss is not None:
+            rss = current_rss_mb()
+            if rss is not None and rss - self._baseline_rss > self.rss_limit_mb:
+                raise MemoryLimitExceeded(
+                    f"第 {page_index + 1} 页处常驻内存增长 {rss - self._baseline_rss:.0f} MB "
+                    f"(共 {rss:.0f} MB) 超过上限 {self.rss_limit_mb} MB"
+                )
+
+    def pages(self):
+        """依次产出 (页索引, 当前文档)，页面对象由调用方按需获取、用完即弃"""
+        if self.rss_limit_mb and self._baseline_rss is None:
+            self._baseline_rss = current_rss_mb()
+        if self.reopen and self._owned_doc is None:
+            # 不在调用方的原始文档上读取：它在扫描期间一直打开，页面缓存无法释放
+            self._reopen()
+        for page_index in range(self.doc.page_count):
+            if page_index and page_index % self.window_pages == 0:
+                self._next_window(page_index)
+            yield page_index, self.doc
+
+    def close(self):
+        """关闭重新打开的文档，页面文本缓存重新指向调用方传入的原始文档"""
+        if self._owned_doc is not None:
+            if self.text_store is not None:
+                self.text_store.doc = self._orig_doc
+            self._owned_doc.close()
+            self._owned_doc = None
+        self.doc = self._orig_doc
+        self._release()
+
+
+def _open_page_window(src_doc, pdf_path, text_store=None, memory_limit_mb=None):
+    """
+    需要时创建 BoundedPageWindow：设置了内存上限，或文档超过 LARGE_DOC_PAGES 页。
+    重新打开时走 open_pdf_auto_repair (损坏文件直接命中已修复缓存)。
+    """
+    if not memory_limit_mb and src_doc.page_count < LARGE_DOC_PAGES:
+        return None
+    print(f"🧮 有界内存模式: {src_doc.page_count} 页, 每 {MEMORY_WINDOW_PAGES} 页释放缓存"
+          + (f", 内存上限 {memory_limit_mb} MB" if memory_limit_mb else ""))
+    return BoundedPageWindow(src_doc, reopen=lambda: open_pdf_auto_repair(pdf_path), window_pages=MEMORY_WINDOW_PAGES,
+                             rss_limit_mb=memory_limit_mb, text_store=text_store)
+
+
+def _replay_keyword_scan(page_indices, pattern_count, max_table_pages, is_title, has_table):
+    """
+    关键词扫描的状态机 (串行扫描与分片并行扫描共用，保证两者结果完全一致)：
+    - 页面匹配某个正则 (标题页) -> 记录该页，进入该正则的"表格连续模式"；
+    - 处于表格连续模式、本页不是标题页：本页有表格则记录为跨页表格，否则断开；
+    - 超过 max_table_pages 时断开连续。
+    is_title(page_index, k) / has_table(page_index) 由调用方提供，has_table 只在需要时调用，每页最多一次。
+    返回与正则等长的列表，每项为页索引列表。
+    """
+    pages_per_pattern = [[] for _ in range(pattern_count)]
+    in_table = [False] * pattern_count
+    table_run = [0] * pattern_count   # 标题之后已合并的连续表格页数
+
+    for page_index in page_indices:
+        page_has_table = None  # 惰性计算
+
+        for k in range(pattern_count):
+            # 先做正则文本匹配：判断是否包含标题
+            if is_title(page_index, k):
+                in_table[k] = True
+                table_run[k] = 0
+                pages_per_pattern[k].append(page_index)
+                continue
+
+            if not in_table[k]:
+                continue
+
+            if max_table_pages[k] is not None and table_run[k] >= max_table_pages[k]:
+                # 超过连续表格页上限，断开连续
+                in_table[k] = False
+                continue
+
+            # 只有可能延续表格的页面才做表格检测
+            if page_has_table is None:
+                page_has_table = has_table(page_index)
+
+            if page_has_table:
+                # 如果处于"表格连续模式"且当前页也有表格，判定为跨页表格
+                table_run[k] += 1
+                pages_per_pattern[k].append(page_index)
+            else:
+                # 断开连续
+                in_table[k] = False
+
+    return pages_per_pattern
+
+
+def _normalize_table_caps(max_table_pages, pattern_count):
+    if not isinstance(max_table_pages, (list, tuple)):
+        return [max_table_pages] * pattern_count
+    return list(max_table_pages)
+
+
+def _scan_keyword_pages(src_doc, patterns, max_table_pages=None, text_store=None, window=None):
+    """
+    单次遍历文档所有页面，同时为多个正则计算要保存的页索引。
+    每页只提取一次文本；表格检测 (find_tables) 是最耗时的调用，
+    只在"某个正则处于表格连续模式、且本页不含标题"时才执行，每页最多一次。
+    max_table_pages: 标题之后最多连续合并多少页表格 (None 表示不限制)；
+                     也可传入与 patterns 等长的列表，为每个正则分别设置
+    window: 可选的 BoundedPageWindow (有界内存模式)，按窗口释放缓存并检查内存上限
+    返回与 patterns 等长的列表，每项为页索引列表。
+    """
+    max_table_pages = _normalize_table_caps(max_table_pages, len(patterns))
+    if text_store is None: text_store = PageTextStore(src_doc)
+    current = {"doc": src_doc}
+
+    def page_indices():
+        if window:
+            for page_index, doc in window.pages():
+                current["doc"] = doc
+                yield page_index
+        else:
+            yield from range(src_doc.page_count)
+
+    def is_title(page_index, k):
+        return patterns[k].search(text_store.text(page_index)) is not None
+
+    def has_table(page_index):
+        with timed_phase("find_tables"):
+            page = current["doc"][page_index]
+            found = len(page.find_tables().tables) > 0
+            del page
+        return found
+
+    return _replay_keyword_scan(page_indices(), len(patterns), max_table_pages, is_title, has_table)
+
+
+# ========================================================
+# 分片并行扫描 (单个超大文档)
+# ========================================================
+PARALLEL_SCAN_MIN_PAGES = 200   # 少于此页数时进程启动开销大于收益，仍走串行扫描
+MIN_SHARD_PAGES = 50
+
+
+def _scan_shard(job):
+    """
+    在工作进程中扫描一个页分片 [start, end)，各自打开自己的文档。
+    页面文本走与串行扫描相同的 PageTextStore：有 file_hash 时直接读写磁盘上的文本缓存 (加锁合并)，
+    否则随结果返回 "texts" {页: 文本}，由调用方放回自己的文本存储。
+    返回 {"titles": {页: [各正则是否命中]}, "tables": {页: 是否有表格}, "texts"}，表格只检测可能用到的页：
+    1. 分片内部：按与串行扫描相同的状态机惰性检测 (假设分片开头不处于表格连续模式)；
+    2. 分片开头可能延续上一分片的跨页表格：从开头逐页检测，直到遇到无表格页 (或超过合并上限)。
+    """
+    pdf_path, start, end, patterns, caps = job["pdf_path"], job["start"], job["end"], job["patterns"], job["caps"]
+    doc = open_pdf_auto_repair(pdf_path)
+    if doc is None:
+        raise RuntimeError(f"无法打开 {pdf_path}")
+    text_store = PageTextStore(doc, job.get("file_hash"))
+    try:
+        titles, texts = {}, {}
+        for page_index in range(start, end):
+            text = text_store.text(page_index)
+            if not job.get("file_hash"):
+                texts[page_index] = text
+            titles[page_index] = [p.search(text) is not None for p in patterns]
+
+        tables = {}
+
+        def has_table(page_index):
+            if page_index not in tables:
+                page = doc[page_index]
+                tables[page_index] = len(page.find_tables().tables) > 0
+                del page
+            return tables[page_index]
+
+        _replay_keyword_scan(range(start, end), len(patterns), caps, lambda i, k: titles[i][k], has_table)
+        if start > 0:
+            limit = end if any(c is None for c in caps) else min(end, start + max(caps) + 1)
+            for page_index in range(start, limit):
+                if not has_table(page_index):
+                    break
+        return {"titles": titles, "tables": tables, "texts": texts}
+    finally:
+        text_store.close()
+        doc.close()
+        try:
+            fitz.TOOLS.store_shrink(100)
+        except Exception:
+            pass
+
+
+@timed("scan_parallel")
+def scan_keyword_pages_parallel(pdf_path, patterns, max_table_pages=None, max_workers=None, page_count=None,
+                                text_store=None):
+    """
+    把文档按页分片，在多个工作进程中并行扫描，再按原顺序回放 _replay_keyword_scan 合并结果，
+    与 _scan_keyword_pages 的结果完全一致。个别页的表格标志缺失时在当前进程补测。
+    text_store: 调用方的 PageTextStore，分片提取的页面文本写回其中，后续裁剪 / 导出文本层不再重复提取
+    返回与 patterns 等长的列表，每项为页索引列表。
+    """
+    caps = _normalize_table_caps(max_table_pages, len(patterns))
+    if page_count is None:
+        doc = open_pdf_auto_repair(pdf_path)
+        page_count = doc.page_count
+        doc.close()
+    max_workers = max_workers or default_crop_workers()
+    shard_count = max(1, min(max_workers * 2, page_count // MIN_SHARD_PAGES))
+    bounds = [page_count * i // shard_count for i in range(shard_count + 1)]
+    file_hash = text_store.file_hash if text_store is not None else None
+    jobs = [{"pdf_path": pdf_path, "start": a, "end": b, "patterns": patterns, "caps": caps, "file_hash": file_hash}
+            for a, b in zip(bounds, bounds[1:]) if b > a]
+
+    titles, tables = {}, {}
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(jobs)), mp_context=ctx) as executor:
+        for result in executor.map(_scan_shard, jobs):
+            titles.update(result["titles"])
+            tables.update(result["tables"])
+            if text_store is not None:
+                text_store.add_texts(result["texts"])
+    if text_store is not None:
+        text_store.refresh()
+    print(f"🧩 分片并行扫描: {page_count} 页, {len(jobs)} 个分片, 检测表格 {len(tables)} 页")
+
+    fallback_doc = None
+
+    def has_table(page_index):
+        nonlocal fallback_doc
+        if page_index not in tables:
+            if fallback_doc is None:
+                fallback_doc = open_pdf_auto_repair(pdf_path)
+            tables[page_index] = len(fallback_doc[page_index].find_tables().tables) > 0
+        return tables[page_index]
+
+    try:
+        return _replay_keyword_scan(range(page_count), len(patterns), caps, lambda i, k: titles[i][k], has_table)
+    finally:
+        if fallback_doc is not None:
+            fallback_doc.close()
+
+
+def _scan_document(src_doc, pdf_path, patterns, max_table_pages, text_store, memory_limit_mb=None, scan_workers=None):
+    """
+    全文扫描入口：
+    - scan_workers > 1 且文档足够大：分片并行扫描 (失败时回退到串行)；
+      设置了内存上限时不分片：上限针对单个文件的增量，分散到多个工作进程后无法按窗口检查；
+    - 否则串行扫描，需要时启用有界内存模式。
+    """
+    if scan_workers and scan_workers > 1 and src_doc.page_count >= PARALLEL_SCAN_MIN_PAGES:
+        if memory_limit_mb:
+            print(f"🧮 已设置内存上限 {memory_limit_mb} MB，不做分片并行扫描")
+        else:
+            try:
+                return scan_keyword_pages_parallel(pdf_path, patterns, max_table_pages, scan_workers,
+                                                   src_doc.page_count, text_store)
+            except Exception as e:
+                print(f"⚠️ 分片并行扫描失败，回退到串行扫描: {e}")
+
+    window = _open_page_window(src_doc, pdf_path, text_store, memory_limit_mb)
+    try:
+        return _scan_keyword_pages(src_doc, patterns, max_table_pages, text_store, window)
+    finally:
+        if window: window.close()
+
+
+@tracked_document("toc")
+def extract_section_to_pdf(pdf_path, output_path, section_keyword="问题", virtual=False, output_profile=None,
+                           export_text=False):
+    """
+    按目录章节裁剪。virtual=True 时只记录裁剪清单，不立即写出 PDF。
+    output_profile: 输出体积优化配置，见 OUTPUT_PROFILES
+    export_text: 同时导出文本层 (.text.json)
+    """
+    src_doc = None
+    try:
+        with timed_phase("open"):
+            src_doc = fitz.open(pdf_path)
+        set_document_pages(src_doc.page_count)
+       
+        # 2. 定位章节：书签优先，回退到文本目录 (分析结果按内容哈希缓存)
+        section = _section_locator(src_doc, pdf_path)(section_keyword)
+        if section is None:
+            return False
+        start_idx, end_idx, _ = section
+
+        _emit_crop(src_doc, pdf_path, [(start_idx, end_idx)], output_path, virtual, output_profile, export_text)
         return True
 
     except Exception as e:
@@ -324,25 +1498,496 @@ def extract_section_to_pdf(pdf_path, output_path, section_keyword="问题"):
         return False
     finally:
         if src_doc: src_doc.close()
-        if out_doc: out_doc.close()
 
 
+@tracked_document("single_pass")
+def extract_sections_single_pass(pdf_path, section_tasks, virtual=False, output_profile=None, export_text=False,
+                                 memory_limit_mb=None, scan_workers=None):
+    """
+    单次遍历模式：每个源文件只打开一次，一次性裁剪出多个章节。
+    - 目录模式的任务共用一次书签读取 (必要时一次 parse_toc_to_dict + calculate_global_offset)；
+    - 全文扫描模式的任务共用一次逐页扫描 (每页只提取一次文本、只检测一次表格)。
+    
+    section_tasks: [{"keyword": "存在问题", "output_path": "...", "content_mode": False}, ...]
+                   全文扫描任务可选 "max_table_pages" (标题后最多合并的连续表格页数)；
+                   带 "page_ranges" (0-based 闭区间列表，如审核后的裁剪计划) 的任务直接按页码输出，不再定位
+    virtual: 为 True 时只记录裁剪清单，不立即写出 PDF
+    output_profile: 输出体积优化配置，见 OUTPUT_PROFILES；任务中的 "output_profile" 优先
+    export_text: 同时导出文本层 (.text.json)，与裁剪共用页面文本缓存
+    memory_limit_mb: 单个文件的内存上限 (MB，处理期间常驻内存的增量)，设置后全文扫描按窗口处理，超限时该文件失败
+    scan_workers: 大于 1 时，超大文档的全文扫描按页分片并行执行
+    返回: {output_path: 是否成功}
+    """
+    results = {task["output_path"]: False for task in section_tasks}
+    fixed_tasks = [t for t in section_tasks if t.get("page_ranges") is not None]
+    toc_tasks = [t for t in section_tasks if t.get("page_ranges") is None and not t.get("content_mode")]
+    content_tasks = [t for t in section_tasks if t.get("page_ranges") is None and t.get("content_mode")]
+
+    src_doc = None
+    text_store = None
+    try:
+        src_doc = open_pdf_auto_repair(pdf_path)
+        if not src_doc: return results
+        set_document_pages(src_doc.page_count)
+        # 目录解析、偏移量校准与全文扫描共用同一份页面文本
+        text_store = open_page_text_store(src_doc, pdf_path)
+
+        # --- A. 目录章节匹配 (书签 / 文本目录各只分析一次) ---
+        if toc_tasks:
+            locate = _section_locator(src_doc, pdf_path, text_store)
+            for task in toc_tasks:
+                try:
+                    section = locate(task["keyword"])
+                    if section is None: continue
+                    start_idx, end_idx, _ = section
+                    _emit_crop(src_doc, pdf_path, [(start_idx, end_idx)], task["output_path"], virtual,
+                               task.get("output_profile", output_profile), export_text, text_store)
+                    results[task["output_path"]] = True
+                except Exception as e:
+                    print(f"裁剪过程异常 [{task['keyword']}]: {e}")
+
+        # --- B. 全文关键词扫描 (所有正则共用一次逐页扫描) ---
+        if content_tasks:
+            patterns = [_compile_keyword_pattern(t["keyword"]) for t in content_tasks]
+            table_caps = [t.get("max_table_pages") for t in content_tasks]
+            pages_per_pattern = _scan_document(src_doc, pdf_path, patterns, table_caps, text_store,
+                                               memory_limit_mb, scan_workers)
+            for task, pages_to_save in zip(content_tasks, pages_per_pattern):
+                if not pages_to_save: continue
+                try:
+                    _emit_crop(src_doc, pdf_path, _pages_to_ranges(pages_to_save), task["output_path"], virtual,
+                               task.get("output_profile", output_profile), export_text, text_store)
+                    results[task["output_path"]] = True
+                except Exception as e:
+                    print(f"关键词提取失败 [{task['keyword']}]: {e}")
 
+        # --- C. 指定页码 (已审核的裁剪计划) ---
+        for task in fixed_tasks:
+            page_ranges = [(max(0, a), min(b, src_doc.page_count - 1)) for a, b in task["page_ranges"]]
+            page_ranges = [(a, b) for a, b in page_ranges if a <= b]
+            if not page_ranges: continue
+            try:
+                _emit_crop(src_doc, pdf_path, page_ranges, task["output_path"], virtual,
+                           task.get("output_profile", output_profile), export_text, text_store)
+                results[task["output_path"]] = True
+            except Exception as e:
+                print(f"按页码裁剪失败 [{task.get('task_suffix', task['keyword'])}]: {e}")
+
+        return results
+
+    except Exception as e:
+        print(f"单次遍历裁剪异常: {e}")
+        return results
+    finally:
+        if text_store: text_store.close()
+        if src_doc: src_doc.close()
+
+
+
+# ========================================================
+# 批量裁剪引擎 (多进程)
+# ========================================================
+def default_crop_workers():
+    """默认并行进程数：保留一个核心给 Streamlit 主进程"""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+# 裁剪逻辑的版本号，章节定位 / 关键词扫描 / 输出方式有改动时 +1，旧指纹全部失效
+CROP_CODE_VERSION = 1
+
+
+def crop_task_fingerprint(src_hash, task, output_profile=None, export_text=False, virtual=False):
+    """
+    裁剪任务指纹：源文件内容哈希 + 任务类型 + 关键词/正则 + 裁剪模式 + 输出配置 + 是否仅记录清单 + 代码版本。
+    指纹与上次成功输出时一致，说明重新裁剪只会得到相同的结果。
+    指定页码的任务 (已审核的裁剪计划) 同时计入页码区间。
+    """
+    fields = [
+        src_hash, task.get("task_suffix"), task["keyword"], bool(task.get("content_mode")),
+        task.get("max_table_pages"), task.get("output_profile", output_profile), bool(export_text),
+        bool(virtual), CROP_CODE_VERSION, TOC_CACHE_VERSION,
+    ]
+    if task.get("page_ranges") is not None:
+        fields.append([list(r) for r in task["page_ranges"]])
+    payload = json.dumps(fields, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _crop_output_exists(output_path, export_text=False, virtual=False):
+    """
+    裁剪结果仍然存在：需要实体 PDF 时必须有实体文件，仅记录清单时实体文件或裁剪清单均可；
+    需要文本层时文本层也要存在
+    """
+    if not os.path.exists(output_path) and not (virtual and load_crop_manifest(output_path)):
+        return False
+    return not export_text or os.path.exists(text_export_path(output_path))
+
+
+def _plan_crop_jobs(jobs):
+    """
+    按任务指纹过滤批量任务：
+    返回 (待执行的任务列表, 全部跳过的任务列表, {output_path: 指纹})
+    待执行任务中只保留指纹变化或输出缺失的章节任务。
+    """
+    pending, skipped, fingerprints = [], [], {}
+    with cache_session():   # 整批任务的哈希、指纹与清单查询共用一个数据库连接
+        stored = load_crop_fingerprints([t["output_path"] for job in jobs for t in job["section_tasks"]])
+        for job in jobs:
+            try:
+                src_hash = file_content_hash(job["src_path"])
+            except OSError:
+                pending.append(job)
+                continue
+            todo = []
+            export_text, virtual = job.get("export_text", False), job.get("virtual", False)
+            for task in job["section_tasks"]:
+                fp = crop_task_fingerprint(src_hash, task, job.get("output_profile"), export_text, virtual)
+                fingerprints[task["output_path"]] = fp
+                if stored.get(task["output_path"]) != fp or \
+                        not _crop_output_exists(task["output_path"], export_text, virtual):
+                    todo.append(task)
+            if not todo:
+                skipped.append(job)
+            elif len(todo) < len(job["section_tasks"]):
+                pending.append(dict(job, section_tasks=todo))
+            else:
+                pending.append(job)
+    return pending, skipped, fingerprints
+
+
+def _crop_job(job):
+    """
+    处理单个源文件的裁剪任务 (在工作进程中执行，每个进程各自打开 PyMuPDF 文档)。
+    job: {"src_path": "...", "section_tasks": [{"keyword", "output_path", "content_mode", "task_suffix",
+                                                "page_ranges" (可选，指定页码时不再定位)}, ...],
+          "virtual": 是否只记录裁剪清单, "output_profile": 输出体积优化配置, "export_text": 是否导出文本层,
+          "memory_limit_mb": 单个文件的内存上限 (常驻内存增量), "scan_workers": 单文件分片并行扫描的进程数}
+    返回: {"src_path": "...", "ok": bool, "failed": [失败的 task_suffix], "outputs": {output_path: 是否成功}}
+    """
+    section_tasks = job["section_tasks"]
+    virtual = job.get("virtual", False)
+    output_profile = job.get("output_profile")
+    export_text = job.get("export_text", False)
+    memory_limit_mb = job.get("memory_limit_mb")
+    scan_workers = job.get("scan_workers")
+    try:
+        if len(section_tasks) == 1 and section_tasks[0].get("page_ranges") is None:
+            task = section_tasks[0]
+            if task.get("content_mode"):
+                is_ok = extract_pages_by_keywords(job["src_path"], task["output_path"], task["keyword"],
+                                                  task.get("max_table_pages"), virtual,
+                                                  task.get("output_profile", output_profile), export_text,
+                                                  memory_limit_mb, scan_workers)
+            else:
+                is_ok = extract_section_to_pdf(job["src_path"], task["output_path"], task["keyword"], virtual,
+                                               task.get("output_profile", output_profile), export_text)
+            results = {task["output_path"]: is_ok}
+        else:
+            results = extract_sections_single_pass(job["src_path"], section_tasks, virtual, output_profile, export_text,
+                                                   memory_limit_mb, scan_workers)
+    except Exception as e:
+        print(f"处理出错 {os.path.basename(job['src_path'])}: {e}")
+        results = {}
+    finally:
+        # 每个文件处理完都清空 MuPDF 资源缓存，避免工作进程的内存逐文件累积
+        try:
+            fitz.TOOLS.store_shrink(100)
+        except Exception:
+            pass
+
+    failed = [t.get("task_suffix", t["keyword"]) for t in section_tasks if not results.get(t["output_path"])]
+    outputs = {t["output_path"]: bool(results.get(t["output_path"])) for t in section_tasks}
+    return {"src_path": job["src_path"], "ok": not failed, "failed": failed, "outputs": outputs}
+
+
+def _format_error_file(result, multi_task):
+    """失败文件的展示名：多任务时附上失败的任务后缀"""
+    f_name = os.path.basename(result["src_path"])
+    if multi_task and result["failed"]:
+        return f"{f_name} ({', '.join(result['failed'])})"
+    return f_name
+
+
+def batch_crop_files(jobs, max_workers=None, progress_callback=None, skip_unchanged=True):
+    """
+    多进程批量裁剪：把文件分发到进程池，每个工作进程独立打开自己的 PyMuPDF 文档。
+    - max_workers: 并行进程数，默认 default_crop_workers()；为 1 时在当前进程串行执行
+    - progress_callback(done, total, result): 每完成一个文件回调一次 (在调用方线程中执行)，
+      跳过的文件 result["skipped"] 为 True
+    - skip_unchanged: 按任务指纹跳过上次已成功输出、且源文件与参数均未变化的任务
+    返回: (success_count, error_files, skipped_count)
+    """
+    total = len(jobs)
+    success_count = 0
+    error_files = []
+    if total == 0:
+        return success_count, error_files, 0
+    multi_task = any(len(job["section_tasks"]) > 1 for job in jobs)
+
+    fingerprints = {}
+    skipped = []
+    if skip_unchanged:
+        jobs, skipped, fingerprints = _plan_crop_jobs(jobs)
+        if skipped:
+            print(f"⏭️ {len(skipped)} 个文件未变化，跳过裁剪")
+
+    def _collect(done, result):
+        nonlocal success_count
+        if result["ok"]:
+            success_count += 1
+        else:
+            error_files.append(_format_error_file(result, multi_task))
+        # 只为成功输出的任务记录指纹，失败的任务下次仍会重试
+        save_crop_fingerprints({p: fingerprints[p] for p, ok in result.get("outputs", {}).items()
+                                if ok and p in fingerprints})
+        if progress_callback:
+            progress_callback(done, total, result)
+
+    for done, job in enumerate(skipped, 1):
+        if progress_callback:
+            progress_callback(done, total, {"src_path": job["src_path"], "ok": True, "failed": [], "skipped": True})
+    offset_done = len(skipped)
+    if not jobs:
+        return success_count, error_files, len(skipped)
+
+    max_workers = max_workers or default_crop_workers()
+    if max_workers <= 1 or len(jobs) == 1:
+        if len(jobs) == 1 and max_workers > 1:
+            # 只有一个文件 (如单独重跑某个大文件) 时，把并行度用在该文件的分片扫描上
+            jobs = [dict(jobs[0], scan_workers=max_workers)]
+        for done, job in enumerate(jobs, offset_done + 1):
+            _collect(done, _crop_job(job))
+            # 手动清理内存
+            gc.collect()
+        return success_count, error_files, len(skipped)
+
+    # 使用 spawn 启动工作进程：MuPDF 不保证 fork 安全，且 Streamlit 主进程是多线程的
+    ctx = multiprocessing.get_context("spawn")
+    pool_kwargs = {}
+    if any(job.get("memory_limit_mb") for job in jobs) and sys.version_info >= (3, 11):
+        # 设置了内存上限时定期重启工作进程，归还处理大文件后留下的内存碎片
+        pool_kwargs["max_tasks_per_child"] = WORKER_RECYCLE_TASKS
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(jobs)), mp_context=ctx, **pool_kwargs) as executor:
+        futures = {executor.submit(_crop_job, job): job for job in jobs}
+        for done, future in enumerate(as_completed(futures), offset_done + 1):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # 工作进程崩溃 (如 MuPDF 段错误) 时，只记该文件失败
+                print(f"处理出错 {os.path.basename(job['src_path'])}: {e}")
+                result = {"src_path": job["src_path"], "ok": False,
+                          "failed": [t.get("task_suffix", t["keyword"]) for t in job["section_tasks"]]}
+            _collect(done, result)
+
+    return success_count, error_files, len(skipped)
+
+
+# ========================================================
+# 裁剪计划 (dry-run)：先定位、审核，再一次性批量输出
+# ========================================================
+def format_page_ranges(page_ranges):
+    """0-based 闭区间列表 -> 1-based 页码文本，如 [(4, 11), (19, 19)] -> "5-12, 20" """
+    return ", ".join(f"{a + 1}-{b + 1}" if b > a else f"{a + 1}" for a, b in page_ranges)
+
+
+def parse_page_ranges(text, page_count=None):
+    """
+    1-based 页码文本 -> 0-based 闭区间列表，支持 "5-12, 20"、"5~12；20" 等写法。
+    格式错误、区间颠倒或超出 page_count 时抛出 ValueError。
+    """
+    page_ranges = []
+    for part in re.split(r"[,，;；\s]+", str(text or "").strip()):
+        if not part: continue
+        m = re.fullmatch(r"(\d+)(?:[-~—–](\d+))?", part)
+        if not m:
+            raise ValueError(f"无法识别的页码: {part}")
+        start, end = int(m.group(1)), int(m.group(2) or m.group(1))
+        if start < 1 or end < start:
+            raise ValueError(f"页码区间无效: {part}")
+        if page_count and end > page_count:
+            raise ValueError(f"页码超出文档范围 (共 {page_count} 页): {part}")
+        page_ranges.append((start - 1, end - 1))
+    return page_ranges
+
+
+@tracked_document("plan")
+def plan_section_crops(pdf_path, section_tasks, memory_limit_mb=None, scan_workers=None):
+    """
+    裁剪计划 (dry-run)：与 extract_sections_single_pass 相同的章节定位 / 全文扫描，但不写出任何裁剪结果。
+    (目录分析与页面文本仍按内容哈希缓存，之后正式裁剪时直接复用)
+    返回 {output_path: {"page_ranges": [(from, to), ...], "title": 命中的目录标题, "score": 匹配分,
+                        "source": "outline"/"text"/"content"} 或 None (未定位到)}
+    """
+    plans = {task["output_path"]: None for task in section_tasks}
+    toc_tasks = [t for t in section_tasks if not t.get("content_mode")]
+    content_tasks = [t for t in section_tasks if t.get("content_mode")]
+
+    src_doc = None
+    text_store = None
+    try:
+        src_doc = open_pdf_auto_repair(pdf_path)
+        if not src_doc: return plans
+        set_document_pages(src_doc.page_count)
+        text_store = open_page_text_store(src_doc, pdf_path)
+
+        if toc_tasks:
+            locate = _section_locator(src_doc, pdf_path, text_store)
+            for task in toc_tasks:
+                details = {}
+                try:
+                    section = locate(task["keyword"], details)
+                except Exception as e:
+                    print(f"章节定位异常 [{task['keyword']}]: {e}")
+                    continue
+                if section is None: continue
+                start_idx, end_idx, title = section
+                plans[task["output_path"]] = {"page_ranges": [(start_idx, end_idx)], "title": title,
+                                              "score": details.get("score"), "source": details.get("source")}
+
+        if content_tasks:
+            patterns = [_compile_keyword_pattern(t["keyword"]) for t in content_tasks]
+            table_caps = [t.get("max_table_pages") for t in content_tasks]
+            pages_per_pattern = _scan_document(src_doc, pdf_path, patterns, table_caps, text_store,
+                                               memory_limit_mb, scan_workers)
+            for task, pages in zip(content_tasks, pages_per_pattern):
+                if pages:
+                    plans[task["output_path"]] = {"page_ranges": _pages_to_ranges(pages), "title": None,
+                                                  "score": None, "source": "content"}
+        return plans
+
+    except Exception as e:
+        print(f"裁剪计划异常: {e}")
+        return plans
+    finally:
+        if text_store: text_store.close()
+        if src_doc: src_doc.close()
+
+
+def _plan_job(job):
+    """计算单个源文件的裁剪计划 (在工作进程中执行)，返回计划行列表"""
+    try:
+        plans = plan_section_crops(job["src_path"], job["section_tasks"], job.get("memory_limit_mb"),
+                                   job.get("scan_workers"))
+    except Exception as e:
+        print(f"处理出错 {os.path.basename(job['src_path'])}: {e}")
+        plans = {}
+    finally:
+        try:
+            fitz.TOOLS.store_shrink(100)
+        except Exception:
+            pass
+    return _plan_rows(job, plans)
+
+
+def _plan_rows(job, plans):
+    """计划结果 -> 计划行 (未定位到的任务 page_ranges 为空)"""
+    rows = []
+    for task in job["section_tasks"]:
+        plan = plans.get(task["output_path"])
+        rows.append({
+            "src_path": job["src_path"],
+            "output_path": task["output_path"],
+            "task_suffix": task.get("task_suffix", task["keyword"]),
+            "keyword": task["keyword"],
+            "page_ranges": plan["page_ranges"] if plan else [],
+            "title": plan["title"] if plan else None,
+            "score": plan["score"] if plan else None,
+            "source": plan["source"] if plan else None,
+        })
+    return rows
+
+
+def batch_plan_crops(jobs, max_workers=None, progress_callback=None):
+    """
+    批量计算裁剪计划 (不写出任何裁剪结果)，jobs 与 batch_crop_files 相同。
+    progress_callback(done, total, src_path): 每完成一个文件回调一次
+    返回计划行列表 (按 jobs 顺序)，每行 {"src_path", "output_path", "task_suffix", "keyword",
+    "page_ranges" (0-based 闭区间，未定位到为空), "title", "score", "source"}
+    """
+    total = len(jobs)
+    rows_by_src = {}
+    if total == 0:
+        return []
+    max_workers = max_workers or default_crop_workers()
+    if max_workers <= 1 or total == 1:
+        if total == 1 and max_workers > 1:
+            jobs = [dict(jobs[0], scan_workers=max_workers)]
+        for done, job in enumerate(jobs, 1):
+            rows_by_src[job["src_path"]] = _plan_job(job)
+            if progress_callback: progress_callback(done, total, job["src_path"])
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(max_workers, total), mp_context=ctx) as executor:
+            futures = {executor.submit(_plan_job, job): job for job in jobs}
+            for done, future in enumerate(as_completed(futures), 1):
+                job = futures[future]
+                try:
+                    rows_by_src[job["src_path"]] = future.result()
+                except Exception as e:
+                    print(f"处理出错 {os.path.basename(job['src_path'])}: {e}")
+                    rows_by_src[job["src_path"]] = _plan_rows(job, {})
+                if progress_callback: progress_callback(done, total, job["src_path"])
+    return [row for job in jobs for row in rows_by_src.get(job["src_path"], [])]
+
+
+def planned_crop_jobs(plan_rows, **job_options):
+    """
+    把审核后的计划行 (含 "page_ranges") 转为 batch_crop_files 的任务：同一源文件的多个输出合并为一个任务，
+    只打开一次源文件。job_options 为其余任务参数 (virtual / output_profile / export_text ...)。
+    """
+    jobs = {}
+    for row in plan_rows:
+        if not row["page_ranges"]: continue
+        job = jobs.setdefault(row["src_path"], dict(job_options, src_path=row["src_path"], section_tasks=[]))
+        job["section_tasks"].append({
+            "keyword": row["keyword"],
+            "output_path": row["output_path"],
+            "task_suffix": row["task_suffix"],
+            "page_ranges": [tuple(r) for r in row["page_ranges"]],
+        })
+    return list(jobs.values())
+
+
+# 修复后的 PDF 缓存目录 (按源文件内容哈希命名)
+REPAIRED_DIR = os.path.join(CACHE_DIR, "repaired")
+
+
+@timed("open")
 def open_pdf_auto_repair(pdf_path):
     """
     尝试打开 PDF 的通用工具函数。
-    优先尝试 fitz 直接打开，失败则调用 pikepdf 修复流。
+    优先尝试 fitz 直接打开，失败则调用 pikepdf 修复。
+    修复结果按源文件内容哈希保存在磁盘 (temp_workspace/cache/repaired)，
+    之后再打开同一文件直接复用，不再重复修复、也不在内存中复制整个文件。
     """
     try:
         return fitz.open(pdf_path)
     except Exception as e:
         # print(f"fitz 打开失败: {e}，尝试修复...")
         try:
-            with pikepdf.open(pdf_path, allow_overwriting_input=True) as p:
-                mem_stream = io.BytesIO()
-                p.save(mem_stream)
-                mem_stream.seek(0)
-                return fitz.open("pdf", mem_stream)
+            file_hash = file_content_hash(pdf_path)
+            repaired_path = os.path.join(REPAIRED_DIR, f"{file_hash}.pdf")
+            if os.path.exists(repaired_path):
+                try:
+                    doc = fitz.open(repaired_path)
+                    record_repair_hit(file_hash)
+                    return doc
+                except Exception:
+                    os.remove(repaired_path)
+
+            os.makedirs(REPAIRED_DIR, exist_ok=True)
+            t0 = time.time()
+            tmp_path = repaired_path + f".{os.getpid()}.part"
+            try:
+                with pikepdf.open(pdf_path) as p:
+                    p.save(tmp_path)
+                os.replace(tmp_path, repaired_path)
+            finally:
+                if os.path.exists(tmp_path): os.remove(tmp_path)
+            record_repair(file_hash, pdf_path, time.time() - t0)
+            print(f"🩹 已修复并缓存: {os.path.basename(pdf_path)} ({time.time() - t0:.1f}s)")
+            return fitz.open(repaired_path)
         except Exception:
             return None
 
@@ -461,16 +2106,17 @@ def extract_section_to_pdf(pdf_path, output_path, section_title="问题"):
         if out_doc: out_doc.close()     
 '''
 
-def extract_section_to_pdf_self(pdf_path, start, end, output_path):
+@tracked_document("manual")
+def extract_section_to_pdf_self(pdf_path, start, end, output_path, output_profile=None):
     """
     按指定页码裁剪 PDF 并保存 (PyMuPDF 增强版)
     start/end: 逻辑页码 (从 1 开始)
     end: 结束页码 (不包含，与 Python range 习惯一致，例如 start=1, end=3 提取第1,2页)
          (注意：请确认您的调用逻辑，如果 end 是包含的，请在下方 indices 计算时调整)
+    output_profile: 输出体积优化配置，见 OUTPUT_PROFILES
     """
     offset = 0  # 默认不偏移，如果需要自动计算偏移，可调用 compute_page_offset
     src_doc = None
-    out_doc = None
     
     try:
         # 1. 使用自动修复功能打开源文件
@@ -478,6 +2124,7 @@ def extract_section_to_pdf_self(pdf_path, start, end, output_path):
         if not src_doc:
             print(f"❌ 无法打开或修复文件: {pdf_path}")
             return False
+        set_document_pages(src_doc.page_count)
 
         # 2. 转换页码为物理索引 (0-based)
         # 用户传入的 start 是 1-based，所以减 1
@@ -494,14 +2141,12 @@ def extract_section_to_pdf_self(pdf_path, start, end, output_path):
             return False
 
         # 3. 提取并保存
-        out_doc = fitz.open()
-        
         # fitz.insert_pdf 的参数 from_page 是包含的，to_page 也是包含的
         # 我们要提取 [start_idx, end_idx) 区间
         # 所以 to_page 应该是 end_idx - 1
-        out_doc.insert_pdf(src_doc, from_page=start_idx, to_page=end_idx - 1)
-        
-        out_doc.save(output_path)
+        _save_page_ranges(src_doc, [(start_idx, end_idx - 1)], output_path, output_profile)
+        # 手动裁剪结果以实体文件为准，清除同名的旧清单
+        delete_crop_manifest(output_path)
         print(f"自定义处理完成 -> {os.path.basename(output_path)}")
         return True
 
@@ -511,7 +2156,6 @@ def extract_section_to_pdf_self(pdf_path, start, end, output_path):
     finally:
         # 确保关闭文件句柄
         if src_doc: src_doc.close()
-        if out_doc: out_doc.close()
 
 def parser_file(filename):
     """
@@ -591,11 +2235,8 @@ def extract_info(filename):
         city = match.group(1)
         district = match.group(2)
     else:
-        # 特殊规则兜底
-        if "广州市-湛江市" in filename:
-            city = "广州湛江合作园"
-            district = "奋勇高新区"
-        elif "市" in clean_name and city == "未知城市":
+        # 特殊地区 (如 广州市-湛江市 合作园) 的改名见 utils_region 的别名表
+        if "市" in clean_name and city == "未知城市":
             # 最后的尝试：按“市”字切分
             try:
                 idx = clean_name.index("市")
@@ -637,65 +2278,48 @@ def extract_info(filename):
     }
     
     
-def extract_pages_by_keywords(pdf_path, output_path, keyword_pattern_str):
+@tracked_document("content")
+def extract_pages_by_keywords(pdf_path, output_path, keyword_pattern_str, max_table_pages=None, virtual=False,
+                              output_profile=None, export_text=False, memory_limit_mb=None, scan_workers=None):
     """
     扫描每一页内容，匹配关键词（支持正则表达式）。
     如果找到标题，且后续页面是连续表格，会自动合并后续页面。
+    max_table_pages: 标题之后最多合并的连续表格页数 (None 表示不限制)
+    virtual: 为 True 时只记录裁剪清单，不立即写出 PDF
+    output_profile: 输出体积优化配置，见 OUTPUT_PROFILES
+    export_text: 同时导出文本层 (.text.json)
+    memory_limit_mb: 单个文件的内存上限 (MB，处理期间常驻内存的增量)，设置后按窗口扫描 (超大文档自动启用)，超限时返回 False
+    scan_workers: 大于 1 时，超大文档按页分片在多个进程中并行扫描
     """
-    pages_to_save = []
-    in_table = False
-    
-    try:
-        search_pattern = re.compile(keyword_pattern_str)
-    except:
-        # 如果用户输入的不是正则，转为普通包含匹配
-        search_pattern = re.compile(re.escape(keyword_pattern_str))
+    search_pattern = _compile_keyword_pattern(keyword_pattern_str)
 
     src_doc = None
-    out_doc = None
+    text_store = None
     
     try:
         src_doc = open_pdf_auto_repair(pdf_path)
         if not src_doc: return False
+        set_document_pages(src_doc.page_count)
         
-        for page_index, page in enumerate(src_doc):
-            text = page.get_text() or ""
-            
-            # 判断是否包含标题
-            has_title = bool(search_pattern.search(text))
-            
-            # 判断是否有表格 (PyMuPDF 功能)
-            # find_tables 比较耗时，仅在必要时调用或每一页调用
-            tables = page.find_tables()
-            has_table = len(tables.tables) > 0
-            
-            if has_title:
-                in_table = True
-                pages_to_save.append(page_index)
-            elif in_table and has_table:
-                # 如果处于"表格连续模式"且当前页也有表格，判定为跨页表格
-                pages_to_save.append(page_index)
-            else:
-                # 断开连续
-                in_table = False
+        # 页面文本按内容哈希持久化，换关键词重新扫描时无需再次提取
+        text_store = open_page_text_store(src_doc, pdf_path)
+        pages_to_save = _scan_document(src_doc, pdf_path, [search_pattern], max_table_pages, text_store,
+                                       memory_limit_mb, scan_workers)[0]
         
         if not pages_to_save:
             return False
             
         # 保存结果
-        out_doc = fitz.open()
-        for p_idx in pages_to_save:
-            out_doc.insert_pdf(src_doc, from_page=p_idx, to_page=p_idx)
-            
-        out_doc.save(output_path)
+        _emit_crop(src_doc, pdf_path, _pages_to_ranges(pages_to_save), output_path, virtual, output_profile,
+                   export_text, text_store)
         return True
 
     except Exception as e:
         print(f"关键词提取失败: {e}")
         return False
     finally:
+        if text_store: text_store.close()
         if src_doc: src_doc.close()
-        if out_doc: out_doc.close()
 
 
         
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+from utils.utils_pdf import extract_info
+from utils.utils_cache import load_region_records, save_region_records
+
+# 地区别名表 (管理员可编辑)：原始文件名包含"匹配"文本时，用非空字段覆盖解析结果；
+# "文件名" 留空时按覆盖后的 城市-地区/县-详细单元 重新组装，保证与其余字段一致
+REGION_ALIASES_PATH = "region_aliases.json"
+REGION_ALIAS_FIELDS = ["城市", "地区/县", "详细单元", "文件名"]
+DEFAULT_REGION_ALIASES = [
+    {"匹配": "广州市-湛江市", "城市": "广州湛江合作园", "地区/县": "奋勇高新区", "详细单元": "", "文件名": ""},
+]
+# extract_info 的解析规则有改动时 +1，登记表中的旧记录自动失效
+REGION_RULES_VERSION = 2
+
+_alias_cache = {"path": None, "mtime": None, "aliases": DEFAULT_REGION_ALIASES}
+_memo = {}   # 进程内缓存 {(rules_key, filename): record}
+
+
+def load_region_aliases(path=REGION_ALIASES_PATH):
+    """读取别名表 (按修改时间缓存)；文件不存在时使用内置默认值"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return DEFAULT_REGION_ALIASES
+    if _alias_cache["path"] != path or _alias_cache["mtime"] != mtime:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                aliases = json.load(f)
+        except Exception as e:
+            print(f"⚠️ 别名表读取失败，使用默认值: {e}")
+            aliases = DEFAULT_REGION_ALIASES
+        _alias_cache.update(path=path, mtime=mtime, aliases=aliases)
+    return _alias_cache["aliases"]
+
+
+def save_region_aliases(aliases, path=REGION_ALIASES_PATH):
+    """保存别名表：去掉"匹配"为空的行，字段统一为字符串"""
+    cleaned = []
+    for alias in aliases:
+        match = str(alias.get("匹配") or "").strip()
+        if not match:
+            continue
+        row = {"匹配": match}
+        for field in REGION_ALIAS_FIELDS:
+            value = alias.get(field)
+            row[field] = "" if value is None or value != value else str(value).strip()  # NaN -> ""
+        cleaned.append(row)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cleaned, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return cleaned
+
+
+def _rules_key(aliases):
+    """规则版本 + 别名表内容，任一变化都会让登记表重新解析"""
+    digest = hashlib.sha1(json.dumps(aliases, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{REGION_RULES_VERSION}:{digest[:12]}"
+
+
+def _region_file_name(record):
+    """按 城市-地区/县-详细单元 组装 "文件名" (与 extract_info 解析短横线格式的规则互逆)"""
+    parts = [record["城市"]]
+    if record.get("地区/县") and record["地区/县"] != "-":
+        parts.append(record["地区/县"])
+    if record.get("详细单元") and record["详细单元"] != "无":
+        parts.append(record["详细单元"])
+    return "-".join(parts)
+
+
+def apply_region_alias(record, aliases):
+    """
+    按第一条匹配的别名覆盖记录中的非空字段。
+    别名改了地区字段但没有指定 "文件名" 时，"文件名" 随之重新组装，CSV 中的地区主键与各字段保持一致。
+    """
+    for alias in aliases:
+        match = alias.get("匹配")
+        if match and match in record["原始文件名"]:
+            record = dict(record)
+            for field in REGION_ALIAS_FIELDS:
+                if alias.get(field):
+                    record[field] = alias[field]
+            if not alias.get("文件名") and any(alias.get(f) for f in REGION_ALIAS_FIELDS if f != "文件名"):
+                record["文件名"] = _region_file_name(record)
+            break
+    return record
+
+
+def normalize_regions(filenames, aliases=None):
+    """
+    批量标准化文件名，返回 {filename: {"原始文件名", "文件名", "城市", "地区/县", "详细单元"}}。
+    依次查 进程内缓存 -> 工作区登记表 (一次批量查询)，未登记的文件名才调用 extract_info 解析，
+    新结果一次性写回登记表。"文件名" 是数据融合时的地区主键。
+    """
+    aliases = load_region_aliases() if aliases is None else aliases
+    rules_key = _rules_key(aliases)
+    records = {}
+    missing = []
+    for name in dict.fromkeys(filenames):
+        record = _memo.get((rules_key, name))
+        if record is None:
+            missing.append(name)
+        else:
+            records[name] = record
+
+    if missing:
+        stored = load_region_records(missing, rules_key)
+        parsed = {}
+        for name in missing:
+            record = stored.get(name)
+            if record is None:
+                record = parsed[name] = apply_region_alias(extract_info(name), aliases)
+            records[name] = record
+            _memo[(rules_key, name)] = record
+        save_region_records(parsed, rules_key)
+    return records
+
+
+def normalize_region(filename, aliases=None):
+    """标准化单个文件名 (见 normalize_regions)"""
+    return normalize_regions([filename], aliases)[filename]
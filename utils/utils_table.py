@@ -0,0 +1,467 @@
+import os
+import re
+import json
+from utils.utils_cache import file_content_hash, load_crop_manifest
+from utils.utils_pdf import open_pdf_auto_repair, load_text_export
+from utils.utils_parse import LAND_USE_CATEGORIES, PROJECT_CATEGORIES, PROJECT_METRICS
+
+# ========================================================
+# 本地表格提取：直接从裁剪结果中的表格读出数值，成功时不再调用大模型工作流
+# ========================================================
+
+# 报告中的地类写法 -> 标准地类 (LAND_USE_CATEGORIES)
+LAND_USE_ALIASES = {
+    "农业设施建设用地": "设施农用地",
+    "设施农业用地": "设施农用地",
+    "商业服务业用地": "商服用地",
+    "商业服务业设施用地": "商服用地",
+    "工矿仓储用地": "工矿用地",
+    "特殊用地": "特殊用地资源",
+    "公共管理与公共服务设施用地": "公共管理与公共服务用地",
+}
+# 本地提取成功需要覆盖全部标准地类 (缺失的地类在步骤 3 会被当作 0，不能静默跳过大模型)。
+# 每组内的写法互为替代：同义的标准名，或 汇总类 (城镇村及工矿用地) 与其全部明细类
+CONSTRUCTION_DETAIL_CATEGORIES = ("商服用地", "工矿用地", "住宅用地", "公共管理与公共服务用地", "特殊用地资源")
+REQUIRED_LAND_USE_GROUPS = [
+    ("耕地",), ("园地",), ("林地",), ("草地",), ("设施农用地",), ("田坎",),
+    ("交通运输用地",), ("水域及水利设施用地",), ("其他用地", "其他土地"),
+]
+
+_NUMBER_RE = re.compile(r"^[-+]?\d+(?:\.\d+)?(?:[+＋]\d+(?:\.\d+)?)*$")
+_LABEL_PREFIX_RE = re.compile(r"^(?:[（(]?[\d一二三四五六七八九十]+[)）、.．]|[①-⑳])+")
+
+
+def _clean_cell(cell):
+    """去掉单元格中的空白 (表格单元格常被折行)"""
+    return re.sub(r"\s+", "", str(cell or ""))
+
+
+def _parse_number(cell):
+    """单元格 -> 数值；百分比、空值、"—" 等返回 None，支持千分位与 "100+20" 写法"""
+    text = _clean_cell(cell).replace(",", "").replace("，", "")
+    if not text or "%" in text or "％" in text:
+        return None
+    if not _NUMBER_RE.match(text):
+        return None
+    return sum(float(part) for part in re.split(r"[+＋]", text.lstrip("+")) if part)
+
+
+def _area_unit(header):
+    """表头中的面积单位 -> 换算为公顷的系数；没有写单位时返回 None"""
+    if "公顷" in header or "hm" in header.lower():
+        return 1.0
+    if "万亩" in header:
+        return 10000 / 15
+    if "亩" in header:
+        return 1 / 15
+    if "平方公里" in header or "km" in header.lower():
+        return 100.0
+    return None
+
+
+def _unit_factor(header):
+    """表头中的面积单位 -> 换算为公顷的系数 (没有写单位时按公顷)"""
+    factor = _area_unit(header)
+    return 1.0 if factor is None else factor
+
+
+_UNIT_NOTE_RE = re.compile(r"单\s*位\s*[:：]\s*(万亩|亩|公顷|hm|平方公里|km)", re.IGNORECASE)
+
+
+def _page_unit_hint(text):
+    """页面上的 "单位：亩" 之类说明 (常写在表格框线外)；没有或写了多种单位时返回 None"""
+    factors = {_area_unit(unit) for unit in _UNIT_NOTE_RE.findall(text or "")}
+    return factors.pop() if len(factors) == 1 else None
+
+
+def load_crop_tables(crop_path):
+    """
+    读取裁剪结果每页的表格与文本，返回 [{"tables": [[[单元格, ...], ...], ...], "text": "..."}, ...]。
+    依次尝试：文本层 (.text.json，裁剪时已检测过表格) -> 实体 PDF -> 裁剪清单对应的源文件页。
+    都不可用时返回 None。
+    """
+    export = load_text_export(crop_path)
+    if export is not None:
+        return [{"tables": page["tables"], "text": page["text"]} for page in export["pages"]]
+
+    page_ranges = None
+    pdf_path = crop_path
+    if not os.path.exists(crop_path):
+        entry = load_crop_manifest(crop_path)
+        if entry is None or not os.path.exists(entry["source_path"]) or \
+                file_content_hash(entry["source_path"]) != entry["source_hash"]:
+            return None
+        pdf_path, page_ranges = entry["source_path"], entry["page_ranges"]
+
+    doc = open_pdf_auto_repair(pdf_path)
+    if doc is None:
+        return None
+    try:
+        page_indices = [i for a, b in page_ranges for i in range(a, b + 1)] if page_ranges else range(doc.page_count)
+        pages = []
+        for page_index in page_indices:
+            page = doc[page_index]
+            tables = []
+            try:
+                for table in page.find_tables().tables:
+                    tables.append([[cell if cell is not None else "" for cell in row] for row in table.extract()])
+            except Exception as e:
+                print(f"⚠️ 第 {page_index + 1} 页表格提取失败: {e}")
+            pages.append({"tables": tables, "text": page.get_text()})
+        return pages
+    finally:
+        doc.close()
+
+
+def _match_land_use(cell):
+    """单元格 -> 标准地类 (精确匹配，避免 "其他草地" 之类的二级类误配)"""
+    label = _LABEL_PREFIX_RE.sub("", _clean_cell(cell))
+    if label in LAND_USE_CATEGORIES:
+        return label
+    return LAND_USE_ALIASES.get(label)
+
+
+def _area_column(header_rows):
+    """
+    在表头中找面积列：返回 (列号, 换算系数)，找不到时列号为 None，表头没有写单位时换算系数为 None。
+    多个面积列时 (如 现状/规划) 优先取现状、基期。
+    """
+    if not header_rows:
+        return None, None
+    width = max(len(row) for row in header_rows)
+    headers = ["".join(_clean_cell(row[i]) for row in header_rows if i < len(row)) for i in range(width)]
+    candidates = [i for i, h in enumerate(headers)
+                  if ("面积" in h or "规模" in h) and not any(k in h for k in ("比例", "占比", "%", "变化", "增减"))]
+    if not candidates:
+        return None, _area_unit("".join(headers))
+    current = [i for i in candidates if any(k in headers[i] for k in ("现状", "基期", "现有"))]
+    col = (current or candidates)[0]
+    factor = _area_unit(headers[col])
+    return col, _area_unit("".join(headers)) if factor is None else factor
+
+
+def _land_use_from_rows(rows, areas, use_header=True, state=None, unit_hint=None):
+    """
+    按行读取 地类 -> 面积，已识别过的地类不覆盖 (同一报告中先出现的现状表优先)。
+    use_header=False 时 (由页面文本拼出的行，列不对齐) 只用表头判断单位，不按列号取值。
+    state: 同一份裁剪结果内跨表格延续的表头信息 {"area_col", "factor"}：跨页续表没有重复表头时，
+           沿用上一张表的面积列与单位；读入了数值但单位不明时置 state["unit_unknown"] = True。
+    unit_hint: 表头没有写单位时使用的页面单位说明 (见 _page_unit_hint)
+    """
+    state = {} if state is None else state
+    first_label_row = next((i for i, row in enumerate(rows) if any(_match_land_use(c) for c in row)), None)
+    if first_label_row is None:
+        return
+    area_col, factor = _area_column(rows[:first_label_row])
+    if area_col is None and factor is None and "factor" in state:
+        area_col, factor = state["area_col"], state["factor"]   # 续表
+    else:
+        if factor is None:
+            factor = unit_hint
+        state.update(area_col=area_col, factor=factor)
+    if not use_header:
+        area_col = None
+    scale = 1.0 if factor is None else factor
+
+    def store(cat, value):
+        areas[cat] = value * scale
+        if factor is None:
+            state["unit_unknown"] = True
+
+    for r, row in enumerate(rows[first_label_row:], first_label_row):
+        labels = [(i, _match_land_use(c)) for i, c in enumerate(row)]
+        labels = [(i, cat) for i, cat in labels if cat]
+        if not labels:
+            continue
+        # 横排表：一行是地类名、下一行是面积
+        if len(labels) >= 2 and all(_parse_number(c) is None for c in row):
+            for values in rows[r + 1:r + 3]:
+                for i, cat in labels:
+                    value = _parse_number(values[i]) if i < len(values) else None
+                    if value is not None and cat not in areas:
+                        store(cat, value)
+            continue
+        col, cat = labels[0]
+        if cat in areas:
+            continue
+        value = _parse_number(row[area_col]) if area_col is not None and area_col < len(row) else None
+        if value is None:
+            value = next((v for v in map(_parse_number, row[col + 1:]) if v is not None), None)
+        if value is not None:
+            store(cat, value)
+
+
+def _rows_from_text(text):
+    """没有框线、find_tables 检测不到表格时：把页面文本按地类名切成行"""
+    rows = []
+    for line in (l.strip() for l in text.split("\n")):
+        if not line:
+            continue
+        if _match_land_use(line) or not rows:
+            rows.append([line])
+        else:
+            rows[-1].append(line)
+    return rows
+
+
+def _missing_land_use(areas):
+    """尚未识别出的标准地类 (每组取第一个写法；建设用地缺汇总类时列出缺少的明细类)"""
+    missing = [group[0] for group in REQUIRED_LAND_USE_GROUPS if not any(cat in areas for cat in group)]
+    if "城镇村及工矿用地" not in areas:
+        missing += [cat for cat in CONSTRUCTION_DETAIL_CATEGORIES if cat not in areas]
+    return missing
+
+
+def extract_land_use_table(crop_path):
+    """
+    从裁剪出的土地利用现状表中提取各地类面积 (公顷)，返回 {地类: 面积}；
+    未覆盖全部标准地类 (REQUIRED_LAND_USE_GROUPS + 建设用地)，或读入数值的表格中有单位不明的，
+    返回 None (交给大模型工作流)。
+    """
+    pages = load_crop_tables(crop_path)
+    if not pages:
+        return None
+    areas = {}
+    table_state, text_state = {}, {}
+    for page in pages:
+        unit_hint = _page_unit_hint(page["text"])
+        for table in page["tables"]:
+            _land_use_from_rows(table, areas, state=table_state, unit_hint=unit_hint)
+    if _missing_land_use(areas):
+        for page in pages:
+            _land_use_from_rows(_rows_from_text(page["text"]), areas, use_header=False,
+                                state=text_state, unit_hint=_page_unit_hint(page["text"]))
+    missing = _missing_land_use(areas)
+    if missing:
+        print(f"↪️ {os.path.basename(crop_path)} 本地表格缺少地类: {'、'.join(missing)}")
+        return None
+    if table_state.get("unit_unknown") or text_state.get("unit_unknown"):
+        print(f"↪️ {os.path.basename(crop_path)} 本地表格面积单位不明")
+        return None
+    return {cat: round(value, 4) for cat, value in areas.items()}
+
+
+def land_use_rawdata(areas):
+    """本地提取结果 -> 与工作流返回值相同格式的 rawdata，步骤 3 的 parse_land_use_row 可直接解析"""
+    return json.dumps({"output": json.dumps({"数据": areas}, ensure_ascii=False)}, ensure_ascii=False)
+
+
+# ========================================================
+# 子项目汇总表
+# ========================================================
+# 表头关键词 -> 指标 (按顺序判断，"投资规模（万元）" 归为投资)
+PROJECT_HEADER_KEYWORDS = [
+    ("投资", ("投资", "万元", "亿元", "资金")),
+    ("数量", ("数量", "个数", "项目数", "（个）", "(个)")),
+    ("规模", ("规模", "面积", "公顷", "亩")),
+]
+_TOTAL_LABELS = ("合计", "总计", "总计划", "共计")
+
+
+def _project_key(label):
+    """类别名归一：去掉序号、"类"/"项目"/"小计" 后缀与连接词，"乡村风貌提升与历史文化保护类" 等写法都能对上"""
+    label = _LABEL_PREFIX_RE.sub("", _clean_cell(label))
+    label = re.sub(r"(?:类)?(?:项目)?(?:小计)?$", "", label)
+    return re.sub(r"[和与及、]", "", label)
+
+
+_PROJECT_KEYS = {_project_key(c): c for c in PROJECT_CATEGORIES}
+
+
+def _match_project_category(cell):
+    label = _clean_cell(cell)
+    return _PROJECT_KEYS.get(_project_key(label)) if label else None
+
+
+def _invest_factor(header):
+    """投资列的单位 -> 换算为万元的系数"""
+    if "亿元" in header:
+        return 10000.0
+    if "万元" in header:
+        return 1.0
+    if "元" in header:
+        return 1 / 10000
+    return 1.0
+
+
+def _project_columns(header_rows):
+    """
+    解析子项目表头：返回 ({指标: (列号, 换算系数)}, 项目名称列, 项目类型列)。
+    有 "项目名称" 列说明是逐个项目的明细表，需要按类别汇总。
+    """
+    columns, name_col, type_col = {}, None, None
+    if not header_rows:
+        return columns, name_col, type_col
+    width = max(len(row) for row in header_rows)
+    headers = ["".join(_clean_cell(row[i]) for row in header_rows if i < len(row)) for i in range(width)]
+    for i, h in enumerate(headers):
+        if not h or any(k in h for k in ("占比", "比例", "%")):
+            continue
+        if "名称" in h and name_col is None:
+            name_col = i
+            continue
+        if any(k in h for k in ("类型", "类别", "分类")) and type_col is None:
+            type_col = i
+            continue
+        for metric, keywords in PROJECT_HEADER_KEYWORDS:
+            if metric not in columns and any(k in h for k in keywords):
+                factor = _invest_factor(h) if metric == "投资" else _unit_factor(h) if metric == "规模" else 1.0
+                columns[metric] = (i, factor)
+                break
+    return columns, name_col, type_col
+
+
+def _is_project_header(row):
+    """没有数值、且能认出名称列或指标列的行视为表头 (续表可能重复表头)"""
+    if any(_parse_number(c) is not None for c in row):
+        return False
+    columns, name_col, _ = _project_columns([row])
+    return bool(columns) or name_col is not None
+
+
+def _project_from_rows(rows, summary, detail, totals, state=None):
+    """
+    读取一张子项目表：
+    - 汇总行 (类别 + 数量/投资/规模) 写入 summary；
+    - 明细表 (有项目名称列) 的项目行按类别累加到 detail，类别来自类型列或前面的分组行 (如 "（一）农用地整理类项目")；
+    - 合计行的 数量/投资 写入 totals，用于校验 (明细表常没有数量列，只能核对投资)。
+    state: 同一份裁剪结果内跨表格延续的 表头列 / 当前分组类别。跨页续表没有表头、也可能没有类别行
+           (只有项目行和合计行)，此时沿用上一张表的列与分组。
+    """
+    state = {} if state is None else state
+    first_label_row = next((i for i, row in enumerate(rows) if any(_match_project_category(c) for c in row)), None)
+    continuation = first_label_row is None
+    if continuation:
+        if "columns" not in state:
+            return
+        first_label_row = next((i for i, row in enumerate(rows) if not _is_project_header(row)), len(rows))
+    header_rows = rows[:first_label_row]
+    columns, name_col, type_col = _project_columns(header_rows)
+    if continuation and header_rows and (columns, name_col, type_col) != \
+            (state["columns"], state["name_col"], state["type_col"]):
+        return      # 表头不同、又没有类别行：不是子项目表的续表
+    if columns or name_col is not None or "columns" not in state:
+        state.update(columns=columns, name_col=name_col, type_col=type_col, current_cat=None)
+    else:
+        columns, name_col, type_col = state["columns"], state["name_col"], state["type_col"]   # 续表
+    current_cat = state["current_cat"]
+
+    for row in rows[first_label_row:]:
+        cells = [_clean_cell(c) for c in row]
+        if any(c in _TOTAL_LABELS for c in cells):
+            total = _project_values(row, columns, 0)
+            if total and (total.get("数量") is not None or total.get("投资") is not None):
+                totals.append(total)
+            continue
+
+        if type_col is not None and type_col < len(row):
+            cat = _match_project_category(row[type_col])
+            label_col = type_col
+        else:
+            label_col, cat = next(((i, _match_project_category(c)) for i, c in enumerate(row)
+                                   if _match_project_category(c)), (None, None))
+        is_project = name_col is not None and name_col < len(row) and cells[name_col] and \
+            _parse_number(cells[name_col]) is None and not _match_project_category(cells[name_col])
+
+        if is_project:
+            cat = cat or current_cat
+            if cat is None:
+                continue
+            values = _project_values(row, columns, None)
+            acc = detail.setdefault(cat, {"数量": 0.0, "投资": 0.0, "规模": 0.0})
+            acc["数量"] += 1
+            for metric in ("投资", "规模"):
+                acc[metric] += (values or {}).get(metric) or 0.0
+        elif cat is not None:
+            values = _project_values(row, columns, label_col)
+            if values is None:
+                current_cat = cat       # 分组行
+            else:
+                summary[cat] = values   # 汇总 / 小计行
+    state["current_cat"] = current_cat
+
+
+def _project_values(row, columns, label_col):
+    """
+    取一行的 数量/投资/规模：有表头时按列取值，否则取类别名之后的前三个数值。
+    一个数值都没有时返回 None。
+    """
+    if columns:
+        values = {}
+        for metric, (col, factor) in columns.items():
+            value = _parse_number(row[col]) if col < len(row) else None
+            values[metric] = value * factor if value is not None else None
+        return values if any(v is not None for v in values.values()) else None
+    numbers = [v for v in map(_parse_number, row[(label_col or 0) + 1:]) if v is not None]
+    if not numbers:
+        return None
+    return dict(zip(PROJECT_METRICS, numbers + [None] * (3 - len(numbers))))
+
+
+def extract_project_table(crop_path):
+    """
+    从裁剪出的子项目章节中提取 7 类项目的 数量/投资 (万元)/规模 (公顷)，返回 {类别: {"数量", "投资", "规模"}}。
+    以下情况视为不完整并返回 None (交给大模型工作流)：没有识别出任何类别、汇总行缺少数量或投资、
+    数量/投资之和与合计行不一致、按明细累加的类别没有合计行可以校验。
+    """
+    pages = load_crop_tables(crop_path)
+    if not pages:
+        return None
+    summary, detail, totals, state = {}, {}, [], {}
+    for page in pages:
+        for table in page["tables"]:
+            _project_from_rows(table, summary, detail, totals, state=state)
+
+    projects = dict(detail)
+    projects.update(summary)    # 表中给出的小计优先于按明细累加
+    if not projects:
+        return None
+    if any(values.get("数量") is None or values.get("投资") is None for values in summary.values()):
+        return None
+    checked = []
+    if totals:
+        for metric in ("数量", "投资"):
+            total = totals[0].get(metric)
+            if total is not None:
+                value = sum(v.get(metric) or 0.0 for v in projects.values())
+                checked.append(abs(value - total) <= max(0.5, abs(total) * 0.001))
+    if checked and not all(checked):
+        print(f"⚠️ 子项目数量/投资与合计行不一致: {os.path.basename(crop_path)}")
+        return None
+    if not checked and any(cat not in summary for cat in detail):
+        print(f"↪️ {os.path.basename(crop_path)} 子项目明细没有合计行可校验")
+        return None
+    return {cat: {m: round(v.get(m) or 0.0, 4) for m in PROJECT_METRICS} for cat, v in projects.items()}
+
+
+def project_rawdata(projects):
+    """本地提取结果 -> 与工作流返回值相同的 Markdown 表格 rawdata，步骤 3 的 parse_project_row 可直接解析"""
+    lines = ["| 项目类别 | " + " | ".join(PROJECT_METRICS) + " |", "|---|---|---|---|"]
+    for cat in PROJECT_CATEGORIES:
+        if cat in projects:
+            lines.append(f"| {cat} | " + " | ".join(str(projects[cat][m]) for m in PROJECT_METRICS) + " |")
+    return json.dumps({"output": "\n".join(lines)}, ensure_ascii=False)
+
+
+# 任务后缀 -> (本地提取函数, 结果转 rawdata 的函数)
+LOCAL_EXTRACTORS = {
+    "LandUse": (extract_land_use_table, land_use_rawdata),
+    "project": (extract_project_table, project_rawdata),
+}
+
+
+def extract_crop_locally(crop_path, task_suffix):
+    """
+    对裁剪结果做本地表格提取，成功返回 rawdata 字符串；
+    该任务没有本地提取器、或提取结果不完整时返回 None。
+    """
+    extractor = LOCAL_EXTRACTORS.get(task_suffix)
+    if extractor is None:
+        return None
+    extract, to_rawdata = extractor
+    try:
+        result = extract(crop_path)
+    except Exception as e:
+        print(f"⚠️ 本地表格提取失败 {os.path.basename(crop_path)}: {e}")
+        return None
+    return to_rawdata(result) if result else None
@@ -0,0 +1,86 @@
+import os
+import json
+from utils.utils_cache import CACHE_DIR, file_content_hash
+from utils.utils_pdf import open_pdf_auto_repair
+
+# 页面缩略图缓存：thumbnails/{文件内容哈希}/{dpi}_{页码}.jpg，同一文件重复浏览直接读盘
+THUMBNAIL_DIR = os.path.join(CACHE_DIR, "thumbnails")
+THUMBNAIL_DPI = 40          # 低分辨率即可看清版式与标题，A4 页约 330x470 像素
+THUMBNAIL_WINDOW = 12       # 每次预览的页数 (只渲染可见窗口)
+
+
+def _thumbnail_dir(file_hash, thumb_dir=None):
+    return os.path.join(thumb_dir or THUMBNAIL_DIR, file_hash)
+
+
+def _thumbnail_path(file_hash, page_idx, dpi, thumb_dir=None):
+    return os.path.join(_thumbnail_dir(file_hash, thumb_dir), f"{dpi}_{page_idx}.jpg")
+
+
+def _load_page_count(file_hash, thumb_dir=None):
+    meta_path = os.path.join(_thumbnail_dir(file_hash, thumb_dir), "meta.json")
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)["page_count"]
+    except Exception:
+        return None
+
+
+def _save_page_count(file_hash, page_count, thumb_dir=None):
+    meta_path = os.path.join(_thumbnail_dir(file_hash, thumb_dir), "meta.json")
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"page_count": page_count}, f)
+
+
+def _write_atomic(path, data):
+    tmp_path = path + f".{os.getpid()}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def render_page_thumbnails(pdf_path, start_idx=0, count=THUMBNAIL_WINDOW, dpi=THUMBNAIL_DPI, thumb_dir=None):
+    """
+    渲染页面缩略图 (0-based 页码 [start_idx, start_idx + count))，返回 (总页数, {页码: 图片路径})。
+    缩略图按文件内容哈希缓存在磁盘，窗口内全部命中时完全不打开 PDF；
+    只有缺失的页才打开文档 (损坏文件自动修复) 并用 PyMuPDF pixmap 渲染。
+    """
+    file_hash = file_content_hash(pdf_path)
+    os.makedirs(_thumbnail_dir(file_hash, thumb_dir), exist_ok=True)
+
+    def split_window(page_count):
+        cached, missing = {}, []
+        for idx in range(max(0, start_idx), min(page_count, start_idx + count)):
+            path = _thumbnail_path(file_hash, idx, dpi, thumb_dir)
+            if os.path.exists(path):
+                cached[idx] = path
+            else:
+                missing.append(idx)
+        return cached, missing
+
+    page_count = _load_page_count(file_hash, thumb_dir)
+    if page_count is not None:
+        thumbs, missing = split_window(page_count)
+        if not missing:
+            return page_count, thumbs
+
+    doc = open_pdf_auto_repair(pdf_path)
+    if doc is None:
+        return page_count or 0, {}
+    try:
+        if page_count is None:
+            page_count = doc.page_count
+            _save_page_count(file_hash, page_count, thumb_dir)
+            thumbs, missing = split_window(page_count)
+
+        for idx in missing:
+            path = _thumbnail_path(file_hash, idx, dpi, thumb_dir)
+            try:
+                pix = doc[idx].get_pixmap(dpi=dpi, alpha=False)   # 默认 RGB，可直接编码为 JPEG
+                _write_atomic(path, pix.tobytes("jpg", jpg_quality=70))
+                thumbs[idx] = path
+            except Exception as e:
+                print(f"⚠️ 第 {idx + 1} 页缩略图渲染失败: {e}")
+    finally:
+        doc.close()
+    return page_count, dict(sorted(thumbs.items()))